@@ -2,25 +2,61 @@
 """acoustic_analysis_livingroom.py
 Do the acoustic analysis side of the pipeline. For living room-style data.
 Praat must be on the path
+
+Praat prints its measurements as a long table, one row per window and measure. 
+These are read from Praat's output as it is printed, into a wide table with one row
+per window (see read_measurements)
 """
 
 import os
 import subprocess
+import array
+import numpy as np
 import pandas as pd
 import logging
 logging.basicConfig(level=logging.DEBUG)
 import distutils.dir_util
 import shutil
 import time
+import collections
 
 script_root = "/Users/BigBrother/Dropbox/Patrick_BigBrother/livingroom/scripts"
 
+# settings for splitting audio into segments (see split_wav_file.praat)
+phone_tier = 1
+split_margin = 0.025
+# settings for praat_voice_measures.praat, in the order the script's form takes them
+voice_analysis_settings = collections.OrderedDict([
+    ('tier_to_analyze', 1),
+    ('padding', 0.025), ('window_length', 0.025), ('timestep', 0.02), 
+    ('max_duration', 5),
+    ('f1ref', 550), ('f2ref', 1650), ('f3ref', 2750), ('f4ref', 3850), ('f5ref', 4950),
+    ('maxformant', 5500),
+    ('min_f0', 50), ('max_f0', 500)])
+
+# columns of the long table that describe the window a measurement comes from, and 
+# how they are stored in the wide table. Measures are stored as measure_dtype
+window_columns = collections.OrderedDict([
+    ('Filename', object), ('Segment label', object), 
+    ('Segment start', np.float64), ('Segment end', np.float64), ('Chunk', np.int64),
+    ('Window_start', np.float64), ('Window_end', np.float64)])
+measure_dtype = np.float32
+undefined_value = "--undefined--"
+
 def do_acoustic_annotation(audio_path, alignments_path, 
-                           working_wav_dir=".tmpwav"):
+                           working_wav_dir=".tmpwav", from_long_sound=False):
     """1. split up audio according to alignments in alignments_path
         2. invoke Praat
+        
+    If from_long_sound is True, measure the segments straight from the audio 
+    (see measure_long_sound) and leave working_wav_dir alone. Returns a wide
+    table of measurements, as read_measurements does
     """
     
+    if from_long_sound:
+        logging.info("Doing acoustic measurements on long sound")
+        return measure_long_sound(audio_path, alignments_path)
+    
     # empty out and create tmp WAV folder (DANGER)
     logging.debug("Working dir: {}".format(working_wav_dir))
     if working_wav_dir in (".", "/"):
@@ -44,15 +80,133 @@ def do_acoustic_annotation(audio_path, alignments_path,
     return results
     
 def split_audio(audio_path, alignments_path, destination_dir):
-    phone_tier = 1
     output = subprocess.check_output( \
-        ["praat", os.path.join(script_root, "utilities/split_wav_file.praat"), "\"{}\" \"{}\" \"{}\" 1 1 1 {} 0 1 0.025 _ _".format(
+        ["praat", os.path.join(script_root, "utilities/split_wav_file.praat"), "\"{}\" \"{}\" \"{}\" 1 1 1 {} 0 1 {} _ _".format(
             os.path.abspath(audio_path), 
             os.path.abspath(alignments_path), 
             os.path.abspath(destination_dir), 
-            phone_tier)], 
+            phone_tier, split_margin)], 
             stderr=subprocess.STDOUT)
 
+def measure_long_sound(audio_path, alignments_path):
+    """Like split_audio followed by invoke_praat_voice_analysis, but without the 
+    intermediate files: praat_voice_measures_longsound.praat reads each padded
+    segment straight out of audio_path. Returns the same wide table"""
+    
+    praat_args = "\"{}\" \"{}\" 1 1 1 {} 0 {} _ _ {}".format(
+        os.path.abspath(audio_path), 
+        os.path.abspath(alignments_path), 
+        phone_tier, split_margin, voice_analysis_arguments())
+    logging.info("Analysis arguments: " + praat_args)
+    
+    measurements = read_measurements(praat_output_lines( \
+        ["praat", os.path.join(script_root,"utilities/praat_voice_measures_longsound.praat"), 
+         praat_args]))
+    return sort_by_filename(measurements)
+
+def sort_by_filename(measurements, extension=".wav"):
+    """Reorder a wide table of measurements (in segment order) into the order in 
+    which praat_voice_measures.praat would have read the segment files. Where two 
+    segments would have been written to the same file, only the later one is kept,
+    as it would have overwritten the earlier one"""
+    
+    filenames = measurements['Filename'].values
+    # number the runs of windows from the same file; keep each file's last run
+    run_ids = np.cumsum(np.r_[True, filenames[1:] != filenames[:-1]])
+    last_runs = pd.Series(run_ids).groupby(filenames).transform('max').values
+    measurements = measurements[run_ids == last_runs]
+    order = np.argsort(measurements['Filename'].values + extension, kind='mergesort')
+    return measurements.iloc[order].reset_index(drop=True)
+
+def praat_output_lines(praat_command):
+    """Run praat_command, yielding lines of its output as Praat prints them rather 
+    than waiting for the whole output. Raises subprocess.CalledProcessError if Praat
+    fails"""
+    
+    praat = subprocess.Popen(praat_command, stdout=subprocess.PIPE)
+    try:
+        for line in iter(praat.stdout.readline, ''):
+            yield line
+    finally:
+        praat.stdout.close()
+        if praat.wait() != 0:
+            raise subprocess.CalledProcessError(praat.returncode, praat_command)
+
+def read_measurements(lines):
+    """Read the long table of measurements printed by praat_voice_measures.praat 
+    (header first, one line per window and measure) from the iterable lines into a 
+    wide table: the window_columns, then one column of type measure_dtype per 
+    measure (NaN where undefined). Lines are consumed one at a time, so the long 
+    table is never held in memory"""
+    
+    lines = iter(lines)
+    header = next(lines).rstrip("\r\n").split("\t")
+    window_positions = [ header.index(column) for column in window_columns ]
+    measure_position, value_position = header.index('Measure'), header.index('Value')
+    filename_position, chunk_position = header.index('Filename'), header.index('Chunk')
+    
+    windows = dict((column, []) for column in window_columns)
+    measures = collections.OrderedDict()
+    measure_typecode = np.dtype(measure_dtype).char
+    nan_row = array.array(measure_typecode, [np.nan])
+    n_windows = 0
+    last_key = None
+    for line in lines:
+        fields = line.rstrip("\r\n").split("\t")
+        if len(fields) < len(header):
+            continue
+        key = (fields[filename_position], fields[chunk_position])
+        if key != last_key:
+            # a new window. Labels and filenames repeat, so share the strings
+            if last_key is not None and key[0] == last_key[0]:
+                fields[filename_position] = last_key[0]
+            for column, position in zip(window_columns, window_positions):
+                windows[column].append(fields[position])
+            for values in measures.itervalues():
+                values.extend(nan_row)
+            n_windows += 1
+            last_key = key
+        measure = fields[measure_position]
+        if measure not in measures:
+            measures[measure] = nan_row * n_windows
+        value = fields[value_position]
+        measures[measure][-1] = np.nan if value == undefined_value else float(value)
+    
+    table = pd.DataFrame(collections.OrderedDict(
+        [ (column, np.array(windows[column], dtype=dtype)) for column, dtype in 
+          window_columns.iteritems() ] +
+        [ (measure, np.frombuffer(values, dtype=measure_dtype)) for measure, values in 
+          measures.iteritems() ]))
+    return table
+
+def long_to_wide(long_table):
+    """Turn a long table of measurements (as printed by the Praat scripts, and as 
+    saved by older versions of the pipeline) into the wide table read_measurements 
+    makes"""
+    
+    keys = ['Filename', 'Chunk']
+    windows = long_table[list(window_columns)].drop_duplicates(keys)
+    values = long_table['Value'].replace(undefined_value, np.nan).astype(measure_dtype)
+    measures = pd.DataFrame({'Value': values.values, 'Measure': long_table['Measure'].values,
+        'Filename': long_table['Filename'].values, 'Chunk': long_table['Chunk'].values})
+    measures = measures.pivot_table(index=keys, columns='Measure', values='Value', 
+                                    aggfunc='last')
+    measure_names = [ measure for measure in pd.unique(long_table['Measure']) 
+                      if measure in measures.columns ]
+    measures = measures[measure_names].reset_index()
+    measures.columns.name = None
+    return windows.merge(measures, on=keys, how='left').reset_index(drop=True)
+
+def typed_measurements(measurements):
+    """Set the types of a wide table of measurements read back from text"""
+    
+    for column in measurements.columns:
+        if column in window_columns:
+            measurements[column] = measurements[column].astype(window_columns[column])
+        else:
+            measurements[column] = measurements[column].astype(measure_dtype)
+    return measurements
+
 def invoke_voicesauce(audio_directory):
     """This will take some work. VoiceSauce itself is 
     pretty dependent on its GUI"""
@@ -62,24 +216,22 @@ def invoke_voicesauce(audio_directory):
     
 def invoke_praat_voice_analysis(audio_directory):
     """Use the Praat acoustic analysis script to get a bunch of acoustic measures out.
-    Return these results as a pandas dataframe
+    Return these results as a wide table of measurements (see read_measurements)
     """
     
     logging.debug("Audio directory:" + audio_directory)
     praat_args = ('{audio_path} .wav' +
-        " {textgrid_path} .TextGrid" + 
-        " {tier_to_analyze} {padding} {window_length} {timestep}" +
-        " {max_duration} {f1ref} {f2ref} {f3ref} {f4ref} {f5ref} {maxformant}" + 
-        " {min_f0} {max_f0}").format(
+        " {textgrid_path} .TextGrid {settings}").format(
             audio_path=os.path.abspath(audio_directory), 
             textgrid_path=os.path.abspath(audio_directory), 
-            tier_to_analyze=1,
-            padding=0.025, window_length=0.025, timestep=0.02, max_duration=5,
-            f1ref=550, f2ref=1650, f3ref=2750, f4ref=3850, f5ref=4950,        
-            maxformant=5500,
-            min_f0=50, max_f0=500)
+            settings=voice_analysis_arguments())
     logging.info("Analysis arguments: " + praat_args)
     
-    output = subprocess.check_output( \
-        ["praat", os.path.join(script_root,"utilities/praat_voice_measures.praat"), praat_args])
-    return output
\ No newline at end of file
+    return read_measurements(praat_output_lines( \
+        ["praat", os.path.join(script_root,"utilities/praat_voice_measures.praat"), praat_args]))
+
+def voice_analysis_arguments(settings=None):
+    """Measurement settings as arguments to the Praat measurement scripts"""
+    if settings is None:
+        settings = voice_analysis_settings
+    return " ".join([ str(value) for value in settings.itervalues() ])
\ No newline at end of file
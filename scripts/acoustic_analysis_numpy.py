@@ -0,0 +1,679 @@
+#!/usr/bin/env python
+"""acoustic_analysis_numpy.py
+Patrick Callier
+
+In-process alternative to the Praat side of acoustic_analysis_livingroom. Finds the
+same analysis windows that split_wav_file.praat and praat_voice_measures.praat would
+(same segments, padding, chunking, labels and skipped labels), and measures every
+window of a case at once with NumPy, instead of one Praat query at a time. Output is
+the same long-format Filename/Measure/Value/Chunk table that the Praat scripts print.
+
+Measures:
+- F0: normalized autocorrelation (after Boersma 1993) over 3 periods of the pitch
+  floor, Hanning-windowed, with parabolic peak interpolation. Unvoiced windows are
+  filled in by linear interpolation within the segment, like Praat's Interpolate.
+- F1-F3 (and bandwidths B1-B3): Burg LPC (order 10, Gaussian window, pre-emphasis
+  from 50 Hz, at twice the maximum formant), then Viterbi tracking of the candidates
+  toward the reference frequencies, with the same kinds of costs as Praat's Track.
+- H1, H2, H4, A1-A3 (dB and Hz), their Iseli corrections (H1c ... A3c), CPP, CPPS,
+  2k, 5k, p0db and p0hz: from the Hanning-windowed spectrum (in dB/Hz, like a 1-to-1
+  Ltas) and power cepstrum of each window, as praat_voice_measures.praat computes
+  them. All windows of a block go through one FFT.
+HNR and intensity are only measured by the Praat backend.
+
+The methods are simplified versions of Praat's, so values won't match exactly; run
+compare_tables (or this script) to see how far apart the two backends are.
+
+usage: python acoustic_analysis_numpy.py audio.wav alignments.TextGrid [praat_table.tsv]
+"""
+
+import sys
+import re
+import logging
+logging.basicConfig(level=logging.DEBUG)
+import itertools
+import collections
+
+import numpy as np
+import pandas as pd
+import scipy.signal as sp_signal
+import scipy.ndimage as sp_ndimage
+
+import acoustic_analysis_livingroom as acous
+from praat_utilities import textgrid_reader
+from utilities import audio
+
+# same as in praat_voice_measures.praat and split_wav_file.praat
+analysis_rate = 16000
+excluded_labels = ["", "{SL}", "sp", "{LG}", "{NS}", "xxx", "XXX"]
+excluded_prefix = "."
+skip_these_re = re.compile(r"^\{..\}|sp|lg|br|sl|[TPSJFGDHKZCVB]H?$")
+label_cleanup_re = re.compile(r"[^A-Za-z*.,\-_0-9 ]")
+formant_costs = {'freqcost': 1., 'bwcost': 1., 'transcost': 1.}
+n_formants = 5
+n_tracked_formants = 3
+
+# thresholds for voicing decisions (Praat's defaults)
+voicing_threshold = 0.45
+silence_threshold = 0.03
+
+table_columns = ['Filename', 'Segment label', 'Segment start', 'Segment end', 'Measure',
+                 'Value', 'Chunk', 'Window_start', 'Window_end']
+# measures in the order praat_voice_measures.praat prints them
+measure_order = ['F0', 'F1', 'F2', 'F3', 'H1', 'H2', 'H4', 'A1', 'A2', 'A3',
+                 'H1hz', 'H2hz', 'H4hz', 'A1hz', 'A2hz', 'A3hz',
+                 'H1c', 'H2c', 'H4c', 'A1c', 'A2c', 'A3c', 'CPP', 'CPPS',
+                 'HNR', 'HNR05', 'HNR15', 'HNR25', '2k', '5k', 'intensity', 'p0db', 'p0hz']
+
+
+def excluded_intervals(labels):
+    """Which of labels (of intervals of a tier) split_wav_file.praat skips, as the 
+    pipeline runs it: those in excluded_labels, and those starting with 
+    excluded_prefix"""
+    labels = np.asarray(labels).astype(unicode)
+    return np.in1d(labels, excluded_labels) | np.char.startswith(labels, excluded_prefix)
+
+def analysis_windows(alignments_path, sound_duration, settings=None):
+    """Table of the analysis windows for which praat_voice_measures.praat would print
+    measurements after split_wav_file.praat had split up the case's audio.
+    Windows are in the order the Praat scripts would print them, one per row, with
+    the columns of the Praat table (except Measure and Value), plus:
+    segment_offset: time of the start of the padded segment in the long recording
+    segment_duration: duration of the padded segment
+    segment_index: running index of the segment
+    time: time of the midpoint of the window in the long recording"""
+
+    if settings is None:
+        settings = acous.voice_analysis_settings
+    margin = acous.split_margin
+    padding = settings['padding']
+    window_length = settings['window_length']
+    timestep = settings['timestep']
+
+    tier = textgrid_reader.get_tier(alignments_path, acous.phone_tier)
+    keep = ~excluded_intervals(tier.labels)
+    starts = tier.starts[keep]
+    ends = tier.ends[keep]
+    offsets = np.where(starts > margin, starts - margin, 0)
+    ends = np.where(ends < sound_duration - margin, ends + margin, sound_duration)
+
+    segments = pd.DataFrame({
+        'Filename': [ "__{:.0f}_".format(ms) for ms in np.floor(offsets * 1000) ],
+        'segment_offset': offsets,
+        'segment_duration': ends - offsets})
+    # segments written to the same file overwrite each other: keep the last one
+    segments = segments.iloc[::-1].drop_duplicates('Filename').iloc[::-1]
+    segments = segments[(segments['segment_duration'] < settings['max_duration']) &
+                        (segments['segment_duration'] > 3. / settings['min_f0'])]
+    # praat_voice_measures.praat reads the files in sorted order
+    segments = segments.iloc[np.argsort((segments['Filename'] + ".wav").values,
+                                        kind='mergesort')]
+    segments['segment_index'] = np.arange(segments.shape[0])
+
+    n_b = padding
+    n_e = segments['segment_duration'].values - padding
+    n_chunks = np.floor(((n_e - n_b - window_length) / timestep) + 1)
+    n_chunks = np.maximum(n_chunks, 0).astype(np.int64)
+
+    windows = segments.iloc[np.repeat(np.arange(segments.shape[0]), n_chunks)]
+    windows = windows.reset_index(drop=True)
+    first_window = np.repeat(np.cumsum(n_chunks) - n_chunks, n_chunks)
+    windows['Chunk'] = np.arange(windows.shape[0]) - first_window + 1
+    windows['Segment start'] = n_b
+    windows['Segment end'] = np.repeat(n_e, n_chunks)
+    windows['Window_start'] = timestep * (windows['Chunk'] - 1) + n_b
+    windows['Window_end'] = windows['Window_start'] + window_length
+    windows['time'] = (windows['segment_offset'] + n_b +
+                       (windows['Chunk'] - 1) * timestep + window_length / 2.)
+
+    # label of the window's midpoint, skipping some
+    intervals = textgrid_reader.interval_at_time(tier, windows['time'].values)
+    windows['Segment label'] = [ label_cleanup_re.sub("", label).encode('utf-8')
+                                 for label in tier.labels[intervals - 1] ]
+    windows = windows[windows['Segment label'].map(
+        lambda x: skip_these_re.search(x) is None).values]
+    return windows.reset_index(drop=True)
+
+def frame_matrix(signal, rate, times, frame_duration, target_rate=None):
+    """2-D array with one row per time in times, holding the frame_duration seconds
+    of signal centered on that time (zero outside the signal), resampled to
+    target_rate if given"""
+
+    if target_rate is None:
+        target_rate = rate
+    # take some extra signal on each side, so resampling doesn't wrap around
+    margin = int(np.ceil(0.005 * rate)) if target_rate != rate else 0
+    n_out = int(round(frame_duration * target_rate))
+    n_in = int(round(frame_duration * rate)) + 2 * margin
+    first_samples = np.round(np.asarray(times) * rate).astype(np.int64) - n_in // 2
+    sample_indexes = first_samples[:, np.newaxis] + np.arange(n_in)
+    frames = audio.samples_at(signal, sample_indexes)
+    if target_rate != rate:
+        n_margin = int(round(margin * float(target_rate) / rate))
+        frames = sp_signal.resample(frames, n_out + 2 * n_margin, axis=1)
+        frames = frames[:, n_margin:n_margin + n_out]
+    return frames
+
+def segment_interpolate(values, times, segment_index):
+    """Fill in nan values by linear interpolation between the nearest non-nan values
+    in the same segment (nearest value, at the ends of segments)"""
+
+    values = np.asarray(values, dtype=np.float64)
+    n = values.size
+    positions = np.arange(n)
+    defined = ~np.isnan(values)
+
+    prev_defined = np.maximum.accumulate(np.where(defined, positions, -1))
+    next_defined = np.minimum.accumulate(np.where(defined, positions, n)[::-1])[::-1]
+    has_prev = (prev_defined >= 0)
+    has_prev[has_prev] = segment_index[prev_defined[has_prev]] == segment_index[has_prev]
+    has_next = (next_defined < n)
+    has_next[has_next] = segment_index[next_defined[has_next]] == segment_index[has_next]
+
+    prev_i = np.clip(prev_defined, 0, n - 1)
+    next_i = np.clip(next_defined, 0, n - 1)
+    span = times[next_i] - times[prev_i]
+    weight = np.where(span > 0, (times - times[prev_i]) / np.where(span > 0, span, 1), 0)
+    both = values[prev_i] + weight * (values[next_i] - values[prev_i])
+
+    result = np.where(has_prev & has_next, both,
+                      np.where(has_prev, values[prev_i],
+                               np.where(has_next, values[next_i], np.nan)))
+    return np.where(defined, values, result)
+
+def track_f0(frames, rate, min_f0, max_f0):
+    """F0 (Hz) for each row of frames by normalized autocorrelation, nan where the
+    frame isn't periodic enough, and the peak amplitude of each frame (for deciding
+    on silence). min_f0 may be an array with one pitch floor per row"""
+
+    n_frames, frame_length = frames.shape
+    min_f0 = np.zeros(n_frames) + min_f0
+    frames = frames - frames.mean(axis=1)[:, np.newaxis]
+    local_peaks = np.abs(frames).max(axis=1)
+
+    window = np.hanning(frame_length)
+    min_lag = int(np.floor(rate / float(max_f0)))
+    max_lag = int(np.ceil(rate / min_f0.min()))
+    n_fft = 2 ** int(np.ceil(np.log2(frame_length + max_lag + 2)))
+
+    autocorr = np.fft.irfft(np.abs(np.fft.rfft(frames * window, n_fft)) ** 2, n_fft)
+    window_autocorr = np.fft.irfft(np.abs(np.fft.rfft(window, n_fft)) ** 2, n_fft)
+    lags = np.arange(max_lag + 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (autocorr[:, lags] / autocorr[:, :1]) / (window_autocorr[lags] /
+                                                      window_autocorr[0])
+    r[~np.isfinite(r)] = 0
+
+    # highest peak within each row's range of lags
+    row_max_lags = np.ceil(rate / min_f0).astype(np.int64)
+    in_range = (lags >= max(min_lag, 1)) & (lags[np.newaxis, :] <= row_max_lags[:, np.newaxis])
+    best = np.argmax(np.where(in_range, r, -np.inf), axis=1)
+    rows = np.arange(n_frames)
+    r_prev, r_best, r_next = r[rows, best - 1], r[rows, best], r[rows, best + 1]
+    curvature = r_prev - 2 * r_best + r_next
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where(curvature < 0, 0.5 * (r_prev - r_next) / curvature, 0)
+    strength = r_best - 0.25 * (r_prev - r_next) * shift
+
+    voiced = ((strength > voicing_threshold) &
+              (best > max(min_lag, 1)) & (best < row_max_lags))
+    f0 = rate / (best + shift)
+    return np.where(voiced, f0, np.nan), local_peaks
+
+def lpc_burg(frames, order):
+    """LPC coefficients (a[0] = 1) for each row of frames, by Burg's method"""
+
+    n_frames = frames.shape[0]
+    coefs = np.zeros((n_frames, order + 1))
+    coefs[:, 0] = 1
+    forward = frames[:, 1:].copy()
+    backward = frames[:, :-1].copy()
+    for m in range(order):
+        denominator = (forward ** 2).sum(axis=1) + (backward ** 2).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            k = np.where(denominator > 0,
+                         -2 * (forward * backward).sum(axis=1) / denominator, 0)
+        coefs[:, :m + 2] = coefs[:, :m + 2] + k[:, np.newaxis] * coefs[:, m + 1::-1]
+        forward, backward = (forward[:, 1:] + k[:, np.newaxis] * backward[:, 1:],
+                             backward[:, :-1] + k[:, np.newaxis] * forward[:, :-1])
+    return coefs
+
+def lpc_formants(coefs, rate, max_formant, max_candidates=n_formants):
+    """Formant candidates from LPC coefficients: arrays (n_frames, max_candidates) of
+    frequencies and bandwidths, in order of frequency, nan-padded"""
+
+    n_frames, order = coefs.shape[0], coefs.shape[1] - 1
+    # roots of the LPC polynomial are the eigenvalues of its companion matrix
+    companion = np.zeros((n_frames, order, order))
+    companion[:, 0, :] = -coefs[:, 1:]
+    companion[:, np.arange(1, order), np.arange(order - 1)] = 1
+    roots = np.linalg.eigvals(companion)
+
+    freqs = np.angle(roots) * rate / (2 * np.pi)
+    bandwidths = -np.log(np.abs(roots)) * rate / np.pi
+    candidate = (freqs > 50) & (freqs < max_formant - 50)
+    freqs = np.where(candidate, freqs, np.inf)
+    order_by_freq = np.argsort(freqs, axis=1)[:, :max_candidates]
+    rows = np.arange(n_frames)[:, np.newaxis]
+    freqs = freqs[rows, order_by_freq]
+    bandwidths = np.where(np.isinf(freqs), np.nan, bandwidths[rows, order_by_freq])
+    freqs[np.isinf(freqs)] = np.nan
+    return freqs, bandwidths
+
+def track_formants(freqs, bandwidths, segment_index, references, n_tracks=n_tracked_formants,
+                   freqcost=1., bwcost=1., transcost=1.):
+    """Choose n_tracks formants out of the candidates in each frame, by Viterbi search
+    within each segment. Costs are as in Praat's Track: distance from the reference
+    frequencies, relative bandwidth, and relative frequency jumps between frames.
+    Frames must be grouped by segment. Returns (frequencies, bandwidths), each
+    (n_frames, n_tracks); nan where there were not enough candidates"""
+
+    huge = 1e30
+    n_frames, n_candidates = freqs.shape
+    states = np.array(list(itertools.combinations(range(n_candidates), n_tracks)))
+    n_states = states.shape[0]
+    state_freqs = freqs[:, states]              # (frames, states, tracks)
+    state_bws = bandwidths[:, states]
+    references = np.asarray(references[:n_tracks], dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        local_costs = (freqcost * np.abs(state_freqs - references) / references +
+                       bwcost * state_bws / state_freqs).sum(axis=2)
+    local_costs[~np.isfinite(local_costs)] = huge
+
+    # positions of each segment's frames
+    segment_starts = np.flatnonzero(np.r_[True, segment_index[1:] != segment_index[:-1]])
+    segment_lengths = np.diff(np.r_[segment_starts, n_frames])
+
+    # forward pass, all segments at once
+    costs = local_costs[segment_starts].copy()
+    back_pointers = np.zeros((n_frames, n_states), dtype=np.int64)
+    for step in range(1, segment_lengths.max() if n_frames else 0):
+        active = np.flatnonzero(segment_lengths > step)
+        frames = segment_starts[active] + step
+        prev_freqs = state_freqs[frames - 1][:, :, np.newaxis, :]
+        cur_freqs = state_freqs[frames][:, np.newaxis, :, :]
+        with np.errstate(invalid='ignore'):
+            transitions = (transcost * np.abs(prev_freqs - cur_freqs) /
+                           (prev_freqs + cur_freqs)).sum(axis=3)
+        transitions[~np.isfinite(transitions)] = huge
+        total = costs[active][:, :, np.newaxis] + transitions
+        back_pointers[frames] = np.argmin(total, axis=1)
+        costs[active] = total.min(axis=1) + local_costs[frames]
+
+    # trace back
+    chosen = np.zeros(n_frames, dtype=np.int64)
+    best_last = np.argmin(costs, axis=1)
+    for step in range(segment_lengths.max() - 1 if n_frames else -1, -1, -1):
+        active = np.flatnonzero(segment_lengths > step)
+        frames = segment_starts[active] + step
+        is_last = segment_lengths[active] == step + 1
+        next_frames = np.minimum(frames + 1, n_frames - 1)
+        chosen[frames] = np.where(is_last, best_last[active],
+                                  back_pointers[next_frames, chosen[next_frames]])
+
+    rows = np.arange(n_frames)
+    return state_freqs[rows, chosen], state_bws[rows, chosen]
+
+def power_spectra(frames, rate, n_fft=None):
+    """Spectrum of each (windowed) row of frames, in dB/Hz like a Praat Ltas made
+    with To Ltas (1-to-1), and the frequencies of the bins"""
+
+    if n_fft is None:
+        n_fft = 2 ** int(np.ceil(np.log2(frames.shape[1])))
+    spectra = np.fft.rfft(frames, n_fft) / float(rate)
+    bin_width = rate / float(n_fft)
+    power_density = 2 * (spectra.real ** 2 + spectra.imag ** 2) * bin_width
+    with np.errstate(divide='ignore'):
+        spectra_db = np.where(power_density > 0,
+                              10 * np.log10(power_density / 4e-10), -300)
+    return spectra_db, np.arange(spectra_db.shape[1]) * bin_width
+
+def parabolic_peaks(values, indexes):
+    """Position (in bins) and height of the parabola through each row's values at
+    indexes - 1, indexes, indexes + 1"""
+
+    rows = np.arange(values.shape[0])
+    left = values[rows, np.clip(indexes - 1, 0, values.shape[1] - 1)]
+    center = values[rows, indexes]
+    right = values[rows, np.clip(indexes + 1, 0, values.shape[1] - 1)]
+    curvature = left - 2 * center + right
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0)
+    return indexes + shift, center - 0.25 * (left - right) * shift
+
+def band_maxima(spectra_db, freqs, lower, upper, interpolate=False):
+    """Amplitude and frequency of the highest bin of each row of spectra_db between
+    lower and upper (arrays, one bound per row), like Ltas: Get maximum and Get
+    frequency of maximum. Where no bin falls in the band, the bin nearest it is
+    used; where a bound is nan, so are the results"""
+
+    lower = np.asarray(lower, dtype=np.float64)
+    upper = np.asarray(upper, dtype=np.float64)
+    bin_width = freqs[1] - freqs[0]
+    with np.errstate(invalid='ignore'):
+        in_band = (freqs >= lower[:, np.newaxis]) & (freqs <= upper[:, np.newaxis])
+        nearest = np.clip(np.round((lower + upper) / 2. / bin_width), 0, freqs.size - 1)
+    nearest[np.isnan(nearest)] = 0
+    peak_bins = np.where(in_band.any(axis=1),
+                         np.argmax(np.where(in_band, spectra_db, -np.inf), axis=1),
+                         nearest.astype(np.int64))
+    if interpolate:
+        peak_positions, peak_db = parabolic_peaks(spectra_db, peak_bins)
+    else:
+        peak_positions, peak_db = peak_bins, spectra_db[np.arange(peak_bins.size), peak_bins]
+    undefined = np.isnan(lower) | np.isnan(upper)
+    return (np.where(undefined, np.nan, peak_db),
+            np.where(undefined, np.nan, peak_positions * bin_width))
+
+def correct_iseli(amplitudes, formants, bandwidths, rate=analysis_rate):
+    """Harmonic/formant amplitudes corrected for the effect of the formants and
+    bandwidths (one column per formant), as in correct_iseli in
+    voice_measures_procedures.praat. Formants that are nan or 0 are skipped"""
+
+    corrected = np.array(amplitudes, dtype=np.float64)
+    for formant, bandwidth in zip(formants.T, bandwidths.T):
+        # as in the Praat procedure, the (corrected) amplitude stands in for the
+        # frequency of the harmonic
+        frequency = corrected
+        r = np.exp(-np.pi * bandwidth / rate)
+        omega_x = 2 * np.pi * formant / rate
+        omega = 2 * np.pi * frequency / rate
+        with np.errstate(invalid='ignore', divide='ignore'):
+            a = r ** 2 + 1 - 2 * r * np.cos(omega_x + omega)
+            b = r ** 2 + 1 - 2 * r * np.cos(omega_x - omega)
+            numerator = r ** 2 + 1 - 2 * r * np.cos(omega_x)
+            correction = -10 * (np.log10(a) + np.log10(b)) + 20 * np.log10(numerator)
+        skip = np.isnan(formant) | (formant == 0)
+        corrected = np.where(skip, corrected, corrected - correction)
+    return corrected
+
+def power_cepstra(spectra_db):
+    """Power cepstrum (in dB) of each row of spectra_db (as made by power_spectra),
+    like Praat's To PowerCepstrum. Quefrency bin i is i / sampling rate"""
+
+    log_power = spectra_db * (np.log(10) / 10)
+    cepstra = np.fft.irfft(log_power, axis=1)[:, :spectra_db.shape[1]] ** 2
+    return 10 * np.log10(cepstra + 1e-30)
+
+def cepstral_peak_prominence(cepstra_db, rate, min_f0, max_f0, trend_start=0.001):
+    """Cepstral peak prominence of each row of cepstra_db: height (dB) of the
+    (parabolically interpolated) peak between quefrencies 1/max_f0 and 1/min_f0
+    above a straight line fit robustly (Theil's incomplete method) to the cepstrum
+    from quefrency trend_start on. min_f0 may be an array with one value per row.
+    Returns prominences and peak quefrencies"""
+
+    n_rows, n_bins = cepstra_db.shape
+    quefrencies = np.arange(n_bins) / float(rate)
+    min_f0 = np.zeros(n_rows) + min_f0
+    in_range = ((quefrencies >= 1. / max_f0) &
+                (quefrencies[np.newaxis, :] <= 1. / min_f0[:, np.newaxis]))
+    peak_bins = np.argmax(np.where(in_range, cepstra_db, -np.inf), axis=1)
+    peak_positions, peak_db = parabolic_peaks(cepstra_db, peak_bins)
+    peak_quefrencies = peak_positions / float(rate)
+
+    # Theil's incomplete method: median of the slopes between points half the
+    # fitting range apart, median of the intercepts
+    fit = np.flatnonzero(quefrencies >= trend_start)
+    half = fit.size // 2
+    x_first, x_second = quefrencies[fit[:half]], quefrencies[fit[half:2 * half]]
+    y_first, y_second = cepstra_db[:, fit[:half]], cepstra_db[:, fit[half:2 * half]]
+    slopes = np.median((y_second - y_first) / (x_second - x_first), axis=1)
+    intercepts = np.median(cepstra_db[:, fit] - slopes[:, np.newaxis] * quefrencies[fit],
+                           axis=1)
+    return peak_db - (slopes * peak_quefrencies + intercepts), peak_quefrencies
+
+def smooth_cepstra(cepstra_db, rate, quefrency_window=0.0005):
+    """Moving average of the power cepstra over quefrency_window, like Praat's
+    PowerCepstrum: Smooth (with one iteration)"""
+
+    width = int(np.floor(quefrency_window * rate))
+    if width <= 1:
+        return cepstra_db
+    power = sp_ndimage.uniform_filter1d(10 ** (cepstra_db / 10), width, axis=1,
+                                        mode='nearest')
+    return 10 * np.log10(power)
+
+def p0_peaks(spectra_db, freqs, f0, h1, h2, low=200, high=300):
+    """p0 amplitude and frequency, as in praat_voice_measures.praat: if the spectrum
+    has one peak between low and high Hz, that peak; if two, the lower if F0 is
+    above 200 Hz, else the higher; otherwise H1 (F0 above 200 Hz) or H2"""
+
+    n_rows, n_bins = spectra_db.shape
+    interior = np.arange(1, n_bins - 1)
+    is_peak = np.zeros(spectra_db.shape, dtype=bool)
+    is_peak[:, interior] = ((spectra_db[:, interior] > spectra_db[:, interior - 1]) &
+                            (spectra_db[:, interior] >= spectra_db[:, interior + 1]))
+    # peak frequencies, interpolated
+    bin_width = freqs[1] - freqs[0]
+    left = spectra_db[:, np.clip(np.arange(n_bins) - 1, 0, n_bins - 1)]
+    right = spectra_db[:, np.clip(np.arange(n_bins) + 1, 0, n_bins - 1)]
+    curvature = left - 2 * spectra_db + right
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where(is_peak & (curvature < 0), 0.5 * (left - right) / curvature, 0)
+    peak_freqs = (np.arange(n_bins) + shift) * bin_width
+    peak_db = spectra_db - 0.25 * (left - right) * shift
+    in_range = is_peak & (peak_freqs >= low) & (peak_freqs <= high)
+
+    n_peaks = in_range.sum(axis=1)
+    rows = np.arange(n_rows)
+    first = np.argmax(in_range, axis=1)
+    second = np.argmax(in_range & (np.arange(n_bins) > first[:, np.newaxis]), axis=1)
+    high_f0 = f0 > 200
+    chosen = np.where((n_peaks == 2) & ~high_f0, second, first)
+    h_db = np.where(high_f0, h1[0], h2[0])
+    h_hz = np.where(high_f0, h1[1], h2[1])
+    use_peak = (n_peaks == 1) | (n_peaks == 2)
+    return (np.where(use_peak, peak_db[rows, chosen], h_db),
+            np.where(use_peak, peak_freqs[rows, chosen], h_hz))
+
+def spectral_measures(frames, rate, f0, formants, bandwidths, min_f0, max_f0):
+    """Harmonic, formant, cepstral, and p0 measures (named as in
+    praat_voice_measures.praat) for each row of frames, which are Hanning-windowed
+    analysis windows. f0 (nan where undefined) and min_f0 have one value per row;
+    formants and bandwidths are arrays with one column per formant (F1-F3).
+    Returns a dict of arrays"""
+
+    spectra_db, freqs = power_spectra(frames, rate)
+    measures = {}
+
+    # harmonics: around F0, 2 F0 and 4 F0 (nan, where F0 is)
+    p10_f0 = f0 / 10.
+    for name, multiple, tolerance in [('H1', 1, p10_f0), ('H2', 2, 2 * p10_f0),
+                                      ('H4', 4, 2 * p10_f0)]:
+        measures[name], measures[name + 'hz'] = band_maxima(spectra_db, freqs,
+            multiple * f0 - tolerance, multiple * f0 + tolerance)
+
+    # formant amplitudes, only if F0, F1 and F2 are defined. Like the script, use
+    # F3 = 0 where there is no third formant
+    formants = formants.copy()
+    formants[np.isnan(formants[:, 2]), 2] = 0
+    defined = ~(np.isnan(f0) | np.isnan(formants[:, 0]) | np.isnan(formants[:, 1]))
+    for i_formant in range(3):
+        name = 'A{}'.format(i_formant + 1)
+        formant = np.where(defined, formants[:, i_formant], np.nan)
+        measures[name], measures[name + 'hz'] = band_maxima(spectra_db, freqs,
+            formant - formant / 10., formant + formant / 10.)
+    for name in ['H1', 'H2', 'H4', 'A1', 'A2', 'A3']:
+        measures[name + 'c'] = np.where(defined,
+            correct_iseli(measures[name], formants, bandwidths, rate), np.nan)
+    p0db, p0hz = p0_peaks(spectra_db, freqs, f0, (measures['H1'], measures['H1hz']),
+                          (measures['H2'], measures['H2hz']))
+    measures['p0db'] = np.where(defined, p0db, np.nan)
+    measures['p0hz'] = np.where(defined, p0hz, np.nan)
+
+    # cepstral peak prominence, smoothed and not
+    cepstra_db = power_cepstra(spectra_db)
+    measures['CPP'] = cepstral_peak_prominence(cepstra_db, rate, min_f0, max_f0)[0]
+    measures['CPPS'] = cepstral_peak_prominence(smooth_cepstra(cepstra_db, rate), rate,
+                                                min_f0, max_f0)[0]
+
+    # 2k and 5k: highest amplitude within a harmonic's width (by the cepstral peak)
+    peak_quefrencies = cepstral_peak_prominence(cepstra_db, rate, 50, 550)[1]
+    peak_freqs = 1 / peak_quefrencies
+    for name, center in [('2k', 2000), ('5k', 5000)]:
+        measures[name] = band_maxima(spectra_db, freqs, center - peak_freqs,
+                                     center + peak_freqs, interpolate=True)[0]
+    return measures
+
+def measure_windows(signal, rate, windows, settings=None, block_size=2048):
+    """F0, F1-F3, B1-B3 and the spectral measures for every window in windows (as
+    made by analysis_windows). Returns a DataFrame with one column per measure,
+    indexed like windows. Windows are framed and analyzed block_size at a time"""
+
+    if settings is None:
+        settings = acous.voice_analysis_settings
+    times = windows['time'].values
+    segment_index = windows['segment_index'].values
+    max_formant = settings['maxformant']
+    formant_rate = 2 * max_formant
+
+    # as in praat_voice_measures.praat, very short sounds get a higher pitch floor
+    durations = windows['segment_duration'].values
+    pitch_floors = np.where(durations < 3. / 40, 3. / durations, settings['min_f0'])
+    pitch_frame_duration = 3. / settings['min_f0']
+
+    f0 = np.empty(times.size)
+    local_peaks = np.empty(times.size)
+    candidate_freqs = np.empty((times.size, n_formants))
+    candidate_bws = np.empty((times.size, n_formants))
+    for block_start in range(0, times.size, block_size):
+        block = slice(block_start, block_start + block_size)
+        pitch_frames = frame_matrix(signal, rate, times[block], pitch_frame_duration,
+                                    analysis_rate)
+        f0[block], local_peaks[block] = track_f0(pitch_frames, analysis_rate,
+                                                 pitch_floors[block], settings['max_f0'])
+
+        # formants: Gaussian window twice the effective length, pre-emphasis from 50 Hz
+        formant_frames = frame_matrix(signal, rate, times[block],
+                                      2 * settings['window_length'], formant_rate)
+        formant_frames[:, 1:] -= (np.exp(-2 * np.pi * 50. / formant_rate) *
+                                  formant_frames[:, :-1])
+        edge = np.exp(-12.)
+        position = (np.arange(formant_frames.shape[1]) + 0.5) / formant_frames.shape[1]
+        gaussian = (np.exp(-48 * (position - 0.5) ** 2) - edge) / (1 - edge)
+        candidate_freqs[block], candidate_bws[block] = lpc_formants(
+            lpc_burg(formant_frames * gaussian, 2 * n_formants), formant_rate, max_formant)
+
+    # voicing decisions by silence threshold relative to the rest of the segment
+    segment_peaks = pd.Series(local_peaks).groupby(segment_index).transform('max').values
+    f0[local_peaks <= silence_threshold * segment_peaks] = np.nan
+    f0 = segment_interpolate(f0, times, segment_index)
+
+    references = [ settings[ref] for ref in ['f1ref', 'f2ref', 'f3ref'] ]
+    formants, bandwidths = track_formants(candidate_freqs, candidate_bws,
+                                          segment_index, references, **formant_costs)
+
+    measures = pd.DataFrame({'F0': f0}, index=windows.index)
+    for i_formant in range(n_tracked_formants):
+        measures['F{}'.format(i_formant + 1)] = formants[:, i_formant]
+        measures['B{}'.format(i_formant + 1)] = bandwidths[:, i_formant]
+
+    # spectral measures need F0 and formants for the whole segment, so make a second
+    # pass. The script takes its spectra from Hanning-windowed analysis windows
+    window_length = settings['window_length']
+    spectral = collections.defaultdict(lambda: np.empty(times.size))
+    for block_start in range(0, times.size, block_size):
+        block = slice(block_start, block_start + block_size)
+        frames = frame_matrix(signal, rate, times[block], window_length, analysis_rate)
+        frames *= 0.5 - 0.5 * np.cos(2 * np.pi * (np.arange(frames.shape[1]) + 0.5) /
+                                     frames.shape[1])
+        block_measures = spectral_measures(frames, analysis_rate, f0[block],
+            formants[block], bandwidths[block], pitch_floors[block], settings['max_f0'])
+        for name, values in block_measures.iteritems():
+            spectral[name][block] = values
+    for name in spectral:
+        measures[name] = spectral[name]
+    return measures
+
+def to_long_table(windows, measures, measure_names=None):
+    """Combine windows and a DataFrame of measures for them into a long-format table
+    like the one praat_voice_measures.praat prints"""
+
+    if measure_names is None:
+        measure_names = [ measure for measure in measure_order if measure in measures ]
+    n_measures = len(measure_names)
+    table = windows[[ col for col in table_columns if col in windows.columns ]]
+    table = table.iloc[np.repeat(np.arange(table.shape[0]), n_measures)]
+    table = table.reset_index(drop=True)
+    table['Measure'] = np.tile(measure_names, windows.shape[0])
+    table['Value'] = measures[measure_names].values.ravel()
+    return table[table_columns]
+
+def to_wide_table(windows, measures, measure_names=None):
+    """Combine windows and a DataFrame of measures for them into a wide table like
+    the one acoustic_analysis_livingroom.read_measurements makes"""
+
+    if measure_names is None:
+        measure_names = [ measure for measure in measure_order if measure in measures ]
+    table = windows[list(acous.window_columns)].reset_index(drop=True)
+    for measure in measure_names:
+        table[measure] = measures[measure].values.astype(acous.measure_dtype)
+    return table
+
+def measure_case(audio_path, alignments_path, settings=None, block_size=2048,
+                 wide=False):
+    """Measure one case, as acoustic_analysis_livingroom.do_acoustic_annotation would.
+    Returns a long-format DataFrame, or a wide one (one row per window) if wide is 
+    True"""
+
+    rate, signal = audio.read_wav(audio_path)
+    windows = analysis_windows(alignments_path, audio.duration(rate, signal), settings)
+    logging.info("Measuring {} windows in {} segments".format(windows.shape[0],
+        windows['segment_index'].nunique()))
+    measures = measure_windows(signal, rate, windows, settings, block_size)
+    if wide:
+        return to_wide_table(windows, measures)
+    return to_long_table(windows, measures)
+
+def compare_tables(praat_table, numpy_table, measures=None):
+    """How far apart two measurement tables (long or wide, e.g. from Praat and from
+    measure_case) are. Windows are matched on Filename and Chunk. Returns a table
+    with one row per measure: how many windows have values in both, or only one,
+    and the mean, mean absolute, median absolute and RMS difference (numpy - praat)
+    and correlation where both have values"""
+
+    def wide(table):
+        if 'Measure' not in table:
+            return table.set_index(['Filename', 'Chunk']).drop(
+                [ column for column in acous.window_columns if column in table and
+                  column not in ('Filename', 'Chunk') ], axis=1).astype(float)
+        table = table.copy()
+        table['Value'] = table['Value'].astype(float)
+        return table.pivot_table(index=['Filename', 'Chunk'], columns='Measure',
+                                 values='Value', aggfunc='first')
+
+    praat_wide = wide(praat_table)
+    numpy_wide = wide(numpy_table)
+    if measures is None:
+        measures = [ measure for measure in praat_wide.columns if measure in numpy_wide ]
+    praat_wide, numpy_wide = praat_wide.align(numpy_wide, join='outer')
+
+    rows = []
+    for measure in measures:
+        praat_values = praat_wide[measure]
+        numpy_values = numpy_wide[measure]
+        both = praat_values.notnull() & numpy_values.notnull()
+        diff = (numpy_values - praat_values)[both]
+        rows.append(dict(Measure=measure,
+            n_both=both.sum(),
+            n_praat_only=(praat_values.notnull() & numpy_values.isnull()).sum(),
+            n_numpy_only=(numpy_values.notnull() & praat_values.isnull()).sum(),
+            mean_diff=diff.mean(),
+            mean_abs_diff=diff.abs().mean(),
+            median_abs_diff=diff.abs().median(),
+            rms_diff=np.sqrt((diff ** 2).mean()),
+            correlation=praat_values[both].corr(numpy_values[both])))
+    return pd.DataFrame(rows, columns=['Measure', 'n_both', 'n_praat_only', 'n_numpy_only',
+        'mean_diff', 'mean_abs_diff', 'median_abs_diff', 'rms_diff',
+        'correlation']).set_index('Measure')
+
+
+if __name__ == '__main__':
+    audio_path, alignments_path = sys.argv[1:3]
+    numpy_table = measure_case(audio_path, alignments_path)
+    if len(sys.argv) > 3:
+        praat_table = pd.read_table(sys.argv[3], na_values="--undefined--")
+    else:
+        praat_table = acous.do_acoustic_annotation(audio_path, alignments_path, 
+                                                   from_long_sound=True)
+    print compare_tables(praat_table, numpy_table).to_csv(sep="\t")
@@ -28,27 +28,41 @@ Creak detection (runs separately) uses the Matlab-based covarep repository and
 the wrappers available at https://github.com/pcallier/creak_batch. 
 
 Output: one table, with acoustic measurements, unique speaker/session IDs, and whatever 
-metadata are available, output to stdout as tab-separated values"""
+metadata are available, written to the path given as the first argument (in the format
+its extension implies, see utilities.table_io) or to stdout as tab-separated values"""
 
 import sys
 import os
 import re
-import StringIO
 import logging
 logging.basicConfig(level=logging.DEBUG)
 logging.root.setLevel(logging.DEBUG)
 import distutils.dir_util
+import shutil
+import tempfile
+import collections
+import contextlib
+import itertools
+import multiprocessing
 
 
 import numpy as np
 #import scipy.io as sp_io
 import pandas as pd
 import acoustic_analysis_livingroom as acous
+import acoustic_analysis_numpy as acous_numpy
 
-from smiles_movamp.get_smiles import do_smiles_movamp, face_file, smile_file
+from smiles_movamp.get_smiles import do_smiles_movamp, read_records, face_file, smile_file
 from praat_utilities import textgrid_table
-from utilities.prepare_metadata import prepare_qualtrics, adorn_with_session_info
-from utilities.get_offset import get_offset_wav
+from praat_utilities import textgrid_reader
+from utilities.prepare_metadata import prepare_qualtrics, adorn_with_session_info, \
+    session_info_columns
+from utilities.session_offsets import session_offsets
+from utilities.intervals import IntervalIndex
+from utilities import result_cache
+from utilities import table_io
+from utilities import manifest
+from utilities import corpus_schema
 
 
 # important regexes
@@ -66,14 +80,47 @@ creak_tmp_dir = "/Users/BigBrother/Documents/pipeline_working/creak_results"
 script_dir = os.path.abspath(os.path.dirname(__file__))
 acous.script_root = script_dir
 smiles_data_path = os.path.join(script_dir,'smiles_movamp')
+# computer vision settings (see smiles_movamp.get_smiles): frames analyzed per second,
+# width of the downscaled frames faces are detected in, and how many analyzed frames
+# faces are tracked for between detections. None (the default) analyzes every frame, 
+# at full size, with detection in each; e.g. 10, 320 and 10 are much faster, but 
+# check the detected, tracked and lost counts logged for a few videos first
+cv_settings = collections.OrderedDict([('analysis_fps', None), 
+                                       ('detection_width', None),
+                                       ('detect_every', None)])
+# if not None, CV is only run on video within this many seconds of either speaker's
+# (aligned) speech; the rest is marked missing
+cv_speech_margin = None
+# number of processes each video is split between (when cases aren't already being 
+# run in a pool of processes)
+cv_workers = multiprocessing.cpu_count()
 # temporary repository (not in Dropbox) of working files
 pipeline_tmp_root = "/Users/BigBrother/Documents/pipeline_working"
 # temporary repository of unjoined results for each case
 tmp_results_dir = os.path.join(pipeline_tmp_root, ".working")
 # temporary repository of wavs and textgrids--regularly deleted and rewritten!
 tmp_wav_dir = os.path.join(pipeline_tmp_root, ".tmpwav")
+# content-addressed cache of the results of each stage of the case pipeline
+result_cache.cache_dir = os.path.join(pipeline_tmp_root, ".cache")
+# offsets between a session's recordings whose confidence (peak-to-sidelobe ratio, see
+# utilities.get_offset) is below this are flagged as unreliable
+min_offset_confidence = 10
+# offsets between the recordings of each session, computed once (see 
+# utilities.session_offsets; edit this table to override offsets by hand)
+offsets_path = os.path.join(pipeline_tmp_root, "session_offsets.tsv")
+# format of intermediate tables (None for the best available, see utilities.table_io)
+output_format = None
+# index of the corpus's data files (see utilities.manifest), kept between runs; None
+# for "manifest" in pipeline_tmp_root, in output_format
+manifest_path = None
+_manifest = None
+_manifest_index = {}
+# format of the unit IDs in the output (see add_unit_ids); with "code", a table of the
+# human-readable IDs is written next to the output (see unit_id_lookup)
+unit_id_format = "string"
 # filename decorators
 cv_decorator = "_cv"
+cv_records_extension = ".f32"
 acoustic_decorator = "_acoustic"
 
 
@@ -85,11 +132,71 @@ def do_creak_detection(creak_results_path):
     return creak_df
     
     
-def do_cv_annotation(video_path):
-    """returns a list of tuples (time, movement amplitude z-score, smile score)
-    from Rob Voigt's computer vision annotation script
+def cv_records_path(unique_id, directory=None):
+    """Where the CV records (see smiles_movamp.get_smiles) for unique_id are kept"""
+    return os.path.join(directory or working_dir(), 
+                        unique_id + cv_decorator + cv_records_extension)
+
+def speech_time_ranges(alignments_path, margin, shift=0):
+    """Merged (start, end) times, plus shift, of the speech (the phones, minus the 
+    intervals acous_numpy.excluded_intervals skips) in the alignments at 
+    alignments_path, widened by margin seconds on either side. Returns an array 
+    with one row per range"""
+    tier = textgrid_reader.get_tier(alignments_path, acous.phone_tier)
+    keep = ~acous_numpy.excluded_intervals(tier.labels)
+    order = np.argsort(tier.starts[keep], kind='mergesort')
+    starts = tier.starts[keep][order] + shift - margin
+    ends = tier.ends[keep][order] + shift + margin
+    if starts.size == 0:
+        return np.zeros((0, 2))
+    # a range starts wherever nothing before it reaches its start
+    reach = np.maximum.accumulate(ends)
+    new_range = np.r_[True, starts[1:] > reach[:-1]]
+    last_in_range = np.r_[np.flatnonzero(new_range)[1:] - 1, reach.size - 1]
+    return np.column_stack([starts[new_range], reach[last_in_range]])
+
+def cv_time_ranges(session_id, audio_path, alignments_path, interlocutor_audio_path, 
+                   interlocutor_alignments_path, margin):
+    """Times, in the speaker's recording, within margin seconds of either speaker's
+    speech (see speech_time_ranges): all the times that the speaker's CV results are
+    looked up at, by case_pipeline for their own speech and by 
+    add_interlocutor_cv_data for the interlocutor's (translated as add_offsets does)"""
+    ranges = [ speech_time_ranges(alignments_path, margin) ]
+    if interlocutor_audio_path is not None and interlocutor_alignments_path is not None:
+        offset = session_offsets([(session_id, audio_path, interlocutor_audio_path)],
+                                 offsets_path)['offset_secs'].iloc[0]
+        ranges.append(speech_time_ranges(interlocutor_alignments_path, margin, -offset))
+    return np.vstack(ranges)
+
+def sample_cv_records(records, times):
+    """Movement amplitude and smile (True or False, or NaN where the CV is missing)
+    interpolated from CV records at times"""
+    movamp = np.interp(times, records['time'], records['movamp'])
+    smile = np.interp(times, records['time'], records['smile'])
+    missing = np.isnan(smile)
+    smiling = np.where(missing, 0, smile) > 0.5
+    if missing.any():
+        smiling = smiling.astype(object)
+        smiling[missing] = np.nan
+    return movamp, smiling
+
+def do_cv_annotation(video_path, records_path, key=None, time_ranges=None):
+    """returns records (time, movement amplitude z-score, smile score), memory-mapped
+    from records_path, from Rob Voigt's computer vision annotation script. An 
+    interrupted annotation resumes where it left off, and finished records with the
+    same key are used as they are. If time_ranges are given, only video within them
+    is annotated
     """
-    cv_results = do_smiles_movamp(os.path.realpath(video_path), smiles_data_path, face_file, smile_file)
+    # worker processes of a pool can't have pools of their own
+    workers = 1 if multiprocessing.current_process().daemon else cv_workers
+    stats = {}
+    cv_results = do_smiles_movamp(os.path.realpath(video_path), smiles_data_path, face_file, smile_file,
+                                  workers=workers, stats=stats, records_path=records_path,
+                                  key=key, time_ranges=time_ranges, **cv_settings)
+    logging.info("Faces in {}: detected in {} frames ({} without a face, {} after "
+                 "tracking was lost), tracked in {}".format(os.path.basename(video_path),
+        stats.get('detected', 0), stats.get('no_face', 0), stats.get('lost', 0),
+        stats.get('tracked', 0)))
     return cv_results
 
 def add_metadata_from_path(df, metadata_path, df_keys, metadata_keys):
@@ -98,31 +205,27 @@ def add_metadata_from_path(df, metadata_path, df_keys, metadata_keys):
     
 def points_to_interval_indexes(points, lower, upper):
     """Returns, for each timepoint in points, the index of the (first) interval in
-    zip(lower, upper) which it falls within, or None if None. Right now just a vectorization
-    of value_in_which_interval"""
-    return [ value_in_which_interval(pt, lower, upper) for pt in points ]
+    zip(lower, upper) which it falls within, or None if None. Builds an 
+    IntervalIndex once and queries all points at once"""
+    return [ None if index < 0 else index for index in 
+             IntervalIndex(lower, upper).first(points) ]
     
+def matching_interval_indexes(points, lower, upper, index=None):
+    """Returns a Series (indexed like index, if given) of the positions of the (first)
+    interval in zip(lower, upper) that each of points falls within; points that fall
+    within no interval are dropped"""
+    matches = pd.Series(IntervalIndex(lower, upper).first(points), index=index)
+    return matches[matches >= 0]
 
 def value_in_which_interval(value, lower, upper, return_all=False):
-    upper = pd.Series(upper, dtype=np.float64)
-    lower = pd.Series(lower, dtype=np.float64)
-    value = float(value)
-#     logging.debug("Trying to find: {}, type {}".format(value, type(value)))
-#     logging.debug("Head greater/less:\n{}".format(pd.DataFrame({
-#                 'low': [low < value for low in lower.values],
-#                 'lowval': lower.values,
-#                 'high': (upper.values > value),
-#                 'highval': upper.values,
-#                 'c': value }).head()))
-    results = list(np.where(pd.concat([lower < value, upper > value], axis=1).all(1))[0])
-#    logging.debug("All matches null: {}".format(all([r is None or r is np.nan for r in results])))
+    """Position of the first interval in zip(lower, upper) that value falls within
+    (None if none), or a list of all of them if return_all is True. To look up 
+    many values, build an IntervalIndex once instead"""
+    interval_index = IntervalIndex(lower, upper)
     if return_all:
-        return results
+        return list(interval_index.all([value])[0])
     else:
-        try:
-            return results[0]
-        except IndexError:
-            return None
+        return points_to_interval_indexes([value], lower, upper)[0]
 
 def working_dir():
     tmp_path = os.path.realpath(tmp_results_dir)
@@ -130,57 +233,139 @@ def working_dir():
         distutils.dir_util.mkpath(tmp_path)
     return tmp_path
 
+def case_stage_keys(audio_path, alignments_path, video_path=None, transcript_path=None,
+                    creak_results_path=None, do_creak=True, do_cv=True,
+                    from_long_sound=False, acoustic_backend="praat",
+                    interlocutor_audio_path=None, interlocutor_alignments_path=None):
+    """Cache keys (see utilities.result_cache) for the stages of case_pipeline: 'cv',
+    'acoustic', and the whole 'case'. Each depends on the stage's inputs, settings 
+    and scripts, and on the keys of the stages it builds on"""
+    
+    keys = collections.OrderedDict()
+    cv_inputs = [video_path, os.path.join(smiles_data_path, face_file), 
+                 os.path.join(smiles_data_path, smile_file), 
+                 os.path.join(smiles_data_path, "get_smiles.py")]
+    cv_params = dict(cv_settings)
+    if cv_speech_margin is not None:
+        # the speech (and offset) that decide which video CV is run on
+        cv_inputs.extend([audio_path, alignments_path, interlocutor_audio_path,
+                          interlocutor_alignments_path])
+        cv_params['speech_margin'] = cv_speech_margin
+    keys['cv'] = result_cache.stage_key('cv', cv_inputs, cv_params)
+    
+    acoustic_scripts = [ os.path.join(script_dir, "acoustic_analysis_livingroom.py") ]
+    if acoustic_backend == "numpy":
+        acoustic_scripts.append(os.path.join(script_dir, "acoustic_analysis_numpy.py"))
+    else:
+        acoustic_scripts.extend([ os.path.join(script_dir, "utilities", script) for 
+            script in ["split_wav_file.praat", "praat_voice_measures.praat", 
+                       "praat_voice_measures_longsound.praat", 
+                       "voice_measures_procedures.praat"] ])
+    keys['acoustic'] = result_cache.stage_key('acoustic', 
+        [audio_path, alignments_path] + acoustic_scripts,
+        dict(backend=acoustic_backend, from_long_sound=from_long_sound, 
+             phone_tier=acous.phone_tier, split_margin=acous.split_margin, 
+             settings=acous.voice_analysis_arguments()))
+    
+    keys['case'] = result_cache.stage_key('case',
+        [alignments_path, transcript_path, creak_results_path if do_creak else None,
+         os.path.join(script_dir, "pipeline_main.py")],
+        dict(do_creak=do_creak, do_cv=do_cv),
+        [keys['acoustic'], keys['cv'] if do_cv else None])
+    return keys
+
 def get_unique_id(session_id, speaker_id):
     return "INT{0:03d}_{1:03d}".format(session_id, speaker_id)
     
-def add_unit_ids(df):
+# unit ID columns, with the columns they are made from: the unit's start time, and
+# a label (cleaned up with label_re, if given)
+unit_id_columns = collections.OrderedDict([
+    ('chunk_id', ('chunk_original_timestamp', None, None)),
+    ('segment_id', ('segment_original_start', 'Segment label', None)),
+    ('word_id', ('word_start', 'word_label', nonalphanum_re)),
+    ('line_id', ('line_start', None, None))])
+# integer unit IDs are (speaker/session number) * unit_code_scale + start in ms, so
+# units of a speaker/session that start in the same ms share one; units with no
+# start time get the last code of their speaker/session
+unit_code_scale = 10 ** 9
+
+def _format_uniques(values, format_value):
+    """format_value applied to each distinct value in values (only once each)"""
+    codes, uniques = pd.factorize(np.asarray(values))
+    formatted = np.array([ format_value(value) for value in uniques ] + 
+                         [ format_value(np.nan) ], dtype=object)
+    # missing values have code -1, which picks the last element
+    return formatted[codes]
+
+def speaker_session_numbers(speaker_session_ids):
+    """Session and speaker numbers of speaker_session_ids (INTXXX_YYY), as XXXYYY"""
+    codes, uniques = pd.factorize(np.asarray(speaker_session_ids))
+    numbers = np.array([ long(re.sub(unique_id_pattern, r"\1\2", unique_id)[len("INT"):])
+                         for unique_id in uniques ], dtype=np.int64)
+    return numbers[codes]
+
+def unit_id_strings(df, unit):
+    """Human-readable IDs (label_startms_INTXXX_YYY) for unit (a key of 
+    unit_id_columns) of each row of df"""
+    time_col, label_col, label_re = unit_id_columns[unit]
+    ids = _format_uniques(np.floor(df[time_col].values.astype(float) * 1000), 
+                          lambda ms: "{:.0f}".format(ms))
+    ids = ids + "_" + np.asarray(df['speaker_session_id'].values, dtype=object)
+    if label_col is not None:
+        clean_label = (lambda label: label_re.sub("", label)) if label_re else \
+            (lambda label: label)
+        ids = _format_uniques(df[label_col].values, 
+                              lambda label: clean_label("{}".format(label))) + "_" + ids
+    return ids
+
+def unit_id_codes(df, unit):
+    """Integer IDs (see unit_code_scale) for unit of each row of df"""
+    time_col = unit_id_columns[unit][0]
+    start_ms = np.floor(df[time_col].values.astype(float) * 1000)
+    start_ms = np.where(np.isnan(start_ms), unit_code_scale - 1, start_ms)
+    return speaker_session_numbers(df['speaker_session_id'].values) * unit_code_scale + \
+        start_ms.astype(np.int64)
+
+def add_unit_ids(df, id_format="string"):
     """Takes df and tries to make columns chunk_id, segment_id, word_id, line_id
     which have unique values for every unique chunk, segment, word and line respectively.
     Requires that df have columns speaker_session_id, chunk_original_timestamp,
     `Segment label`, `Segment start`, word_start, word_label, and line_start.
     
-    Returns modified df"""
+    id_format is "string" for human-readable IDs, "categorical" for the same as 
+    pandas categoricals, or "code" for int64 IDs (see unit_code_scale), which 
+    unit_id_lookup translates back to the human-readable ones.
     
-    # chunk_id
-    try:
-        df['chunk_id'] = df.apply(lambda x: "{:.0f}_{}".format(
-                                    np.floor(x['chunk_original_timestamp'] * 1000),
-                                    x['speaker_session_id']), axis=1)
-        
-        
-    except KeyError:
-        logging.warning("Could not set chunk id; columns missing", exc_info=True)
+    Returns modified df"""
     
-    # segment id
-    try:
-        df['segment_id'] = df.apply(lambda x: "{}_{:.0f}_{}".format(
-                                x['Segment label'],
-                                np.floor(x['segment_original_start'] * 1000),
-                                x['speaker_session_id']), axis=1)
-    except KeyError:
-        logging.warning("Could not set segment id; columns missing", exc_info=True)
-        
-    # word id
-    try:
-        df['word_id'] = df.apply(lambda x: "{}_{:.0f}_{}".format(
-                nonalphanum_re.sub("", x['word_label']),
-                np.floor(x['word_start'] * 1000),
-                x['speaker_session_id']), axis=1)
-    except KeyError:
-        logging.warning("Could not set word id; columns missing", exc_info=True)
-        
-    # line id
-    try:
-        df['line_id'] = df.apply(lambda x: "{:.0f}_{}".format(
-                                np.floor(x['line_start'] * 1000),
-                                x['speaker_session_id']), axis=1)
-    except KeyError:
-        logging.warning("Could not set line id; columns missing", exc_info=True)
+    for unit in unit_id_columns:
+        try:
+            if id_format == "code":
+                df[unit] = unit_id_codes(df, unit)
+            elif id_format == "categorical":
+                df[unit] = pd.Categorical(unit_id_strings(df, unit))
+            else:
+                df[unit] = unit_id_strings(df, unit)
+        except KeyError:
+            logging.warning("Could not set {}; columns missing".format(unit), 
+                            exc_info=True)
         
     return df        
+
+def unit_id_lookup(df):
+    """Table of the human-readable ID (id) of each integer unit ID (code) in df 
+    (as made by add_unit_ids with id_format "code"), for each unit"""
+    lookups = []
+    for unit in unit_id_columns:
+        if unit not in df.columns:
+            continue
+        units = df.drop_duplicates(unit)
+        lookups.append(pd.DataFrame({'unit': unit, 'code': units[unit].values,
+                                     'id': unit_id_strings(units, unit)},
+                                    columns=['unit', 'code', 'id']))
+    return pd.concat(lookups, ignore_index=True)
         
-            
-def add_offsets(df,audio_dir):
+def add_offsets(df,audio_dir,offsets_path=offsets_path):
     """Takes a df where speaker_session_id, session_id, and interlocutor_id and 
     chunk_original_timestamp are defined, and adds columns offset_secs and 
     chunk_timestamp_with_offset, using the automatically detected offset between 
@@ -190,29 +375,45 @@ def add_offsets(df,audio_dir):
     selecting one of the speakers as the reference point (with offset_secs=0). 
     offset_to_interlocutor_native is the offset from the speaker's native timescale to 
     their interlocutor's timescale. For any pair of interlocutors a and b, 
-    offset_to_native_a = -offset_to_native_b"""
+    offset_to_native_a = -offset_to_native_b
+    
+    Also adds offset_confidence, and offset_low_confidence, which is True for 
+    sessions whose offset confidence is below min_offset_confidence (unless the
+    offset was set by hand).
+    
+    Offsets are stored in the table at offsets_path and only computed for sessions
+    (or recordings) not already there"""
     spkr_sess_df = df.loc[:,['speaker_session_id','session_id','speaker_id',
                              'interlocutor_id']].drop_duplicates()
-    id_nos_df = spkr_sess_df.loc[:,['speaker_session_id','session_id',
-                                    'interlocutor_id']]
-    logging.debug(id_nos_df.values)
-    spkr_sess_df['spkr_audio'], spkr_sess_df['interlocutor_audio'] = zip(*[ 
-        (unique_id_to_audio_path(id_row['speaker_session_id'],audio_dir), 
-         unique_id_to_audio_path("INT{0}_{1}".format(id_row['session_id'], 
-                                 id_row['interlocutor_id']), audio_dir)) 
-        for index, id_row in id_nos_df.iterrows() ])
     # reduce spkr_sess_df to a df with 1 row per session, with one speaker chosen as 
     # the reference point for each session
-    sess_groups = spkr_sess_df.groupby('session_id', as_index=False)
-    sess_df = spkr_sess_df.loc[[ session_group[0] for session_group in sess_groups.groups.itervalues() ], :]
+    sess_df = spkr_sess_df.drop_duplicates('session_id')
+    logging.debug(sess_df.values)
+    sess_df['spkr_audio'], sess_df['interlocutor_audio'] = zip(*[ 
+        (unique_id_to_audio_path(speaker_session_id, audio_dir), 
+         unique_id_to_audio_path("INT{0}_{1}".format(session_id, interlocutor_id), 
+                                 audio_dir)) 
+        for speaker_session_id, session_id, interlocutor_id in 
+        sess_df[['speaker_session_id','session_id','interlocutor_id']].values ])
     # get audio offsets: amount of time that inter_wav starts after spkr_wav
-    sess_df['offset_secs'] = [ get_offset_wav(spkr_wav, inter_wav) for spkr_wav, inter_wav in
-        sess_df.loc[:, ['spkr_audio','interlocutor_audio']].values ]
+    stored_offsets = session_offsets(
+        sess_df[['session_id','spkr_audio','interlocutor_audio']].values, offsets_path)
+    sess_df['offset_secs'] = stored_offsets['offset_secs'].values
+    sess_df['offset_confidence'] = stored_offsets['offset_confidence'].values
+    sess_df['offset_low_confidence'] = ((sess_df['offset_confidence'] < min_offset_confidence) &
+                                        ~stored_offsets['offset_manual'].values)
+    for session_id, confidence in sess_df.loc[sess_df['offset_low_confidence'], 
+                                              ['session_id', 'offset_confidence']].values:
+        logging.warning("Low confidence ({:.1f}) in audio offset for session {}".format(
+            confidence, session_id))
     # adjusted timestamps: spkr_time = orig + offset, inter_time = orig + 0
-    spkr_df = sess_df[['session_id','speaker_id','offset_secs']]
+    spkr_df = sess_df[['session_id','speaker_id','offset_secs','offset_confidence',
+                       'offset_low_confidence']]
     spkr_df.loc[:,'offset_to_interlocutor_native'] = spkr_df.offset_secs
-    inter_df = sess_df[['session_id','interlocutor_id','offset_secs']]
-    inter_df.columns = ['session_id','speaker_id','offset_secs']
+    inter_df = sess_df[['session_id','interlocutor_id','offset_secs','offset_confidence',
+                        'offset_low_confidence']]
+    inter_df.columns = ['session_id','speaker_id','offset_secs','offset_confidence',
+                        'offset_low_confidence']
     inter_df.loc[:,'offset_to_interlocutor_native'] = -inter_df.offset_secs
     inter_df.loc[:, 'offset_secs'] = 0
     
@@ -251,10 +452,9 @@ def add_alignments_to_acoustic(df,alignments_path):
     # below, match segment midpoints with intervals for words
     # this method checks where segment midpoints fall, may be slow
     words_table = alignments_table.loc[:,['word_start','word_end','word_label']].drop_duplicates()
-    segment_indices = pd.Series([ value_in_which_interval(midpt, 
+    segment_indices = matching_interval_indexes(df['segment_original_midpoint'], 
         words_table['word_start'].astype(float), 
-        words_table['word_end'].astype(float)) for midpt in
-        df['segment_original_midpoint'] ], index=df.index).dropna()
+        words_table['word_end'].astype(float), index=df.index)
     matching_words = words_table.iloc[segment_indices,:].set_index(segment_indices.index)
     logging.debug(df.shape)
     logging.debug(matching_words.shape)
@@ -274,9 +474,8 @@ def add_transcript_data_to_acoustic(df,transcript_path):
             names=['speaker','speaker','line_start','line_end','line_label'])
         trs_start = transcript_table.iloc[:,transcript_start_col]
         trs_end = transcript_table.iloc[:,transcript_end_col]
-        trs_indices = pd.Series([ value_in_which_interval(midpt, trs_start, trs_end)
-            for midpt in df['segment_original_midpoint'] ], 
-            index=df.index).dropna()
+        trs_indices = matching_interval_indexes(df['segment_original_midpoint'],
+            trs_start, trs_end, index=df.index)
     
         logging.debug("{} matching lines from transcript".format(len(trs_indices)))
         logging.debug("{} rows, {} columns in transcript table".format(
@@ -299,36 +498,36 @@ def add_interlocutor_cv_data(df):
         #logging.debug("Type: {}".format(type(x)))
         #logging.debug("Columns: session_id={}, interlocutor_id={}".format(
         #    'session_id' in x.columns, 'interlocutor_id' in x.columns))
-        cv_table_path = os.path.join(tmp_results_dir, 
-            get_unique_id(long(x['session_id'].iloc[0]), 
-                          long(x['interlocutor_id'].iloc[0])) + 
-            cv_decorator + ".tsv")
+        records_path = cv_records_path(get_unique_id(long(x['session_id'].iloc[0]), 
+                                                     long(x['interlocutor_id'].iloc[0])),
+                                       tmp_results_dir)
         try:
-            cv_df = pd.read_table(cv_table_path, sep="\t")
-        except IOError:
+            cv_records = read_records(records_path)
+        except (IOError, OSError):
             logging.warning("Interlocutor CV data not found for {}".format(
                 x['speaker_session_id'].iloc[0]), exc_info=True)
             return pd.DataFrame({'interlocutor_movamp': [np.nan] * x.shape[0],
                                  'interlocutor_smile':  [np.nan] * x.shape[0]})
         translated_time = x['chunk_original_timestamp'] + \
                             x['offset_to_interlocutor_native']
-        x['interlocutor_movamp'] = pd.Series(
-            np.interp(translated_time, cv_df['time'], cv_df['movamp']), 
-            index=x.index)
-        x['interlocutor_smile'] = pd.Series(
-            np.interp(translated_time, cv_df['time'], cv_df['smile']) > 0.5, 
-            index=x.index)
+        movamp, smiling = sample_cv_records(cv_records, translated_time)
+        x['interlocutor_movamp'] = pd.Series(movamp, index=x.index)
+        x['interlocutor_smile'] = pd.Series(smiling, index=x.index)
         return x[['interlocutor_movamp','interlocutor_smile']]
         
     df = pd.concat([df, interlocutor_grps.apply(interp_cv)], axis=1)
     return df
     
-def add_phonological_context(df, alignments_dir=livingroom_root + "annotations"):
+def add_phonological_context(df, alignments_dir=livingroom_root + "annotations",
+                             batched=True):
     """df has columns segment_original_midpoint, speaker_session_id. Split df on
     speaker_session_id, and determine the preceding and following context (phone label)
     for each unique value of segment_original_midpoint, by finding it in the table
     of intervals returned for that case by 
-    praat_utilities.textgrid_table.get_neighbors_tg_tier"""
+    praat_utilities.textgrid_table.get_neighbors_tg_tier
+    
+    If batched is True, all midpoints for a speaker/session are looked up at once
+    with textgrid_table.get_neighbors_from_midpoints; otherwise, one at a time."""
     
     def add_context(x):
         # get phonological context from alignments
@@ -337,9 +536,14 @@ def add_phonological_context(df, alignments_dir=livingroom_root + "annotations")
         phone_tier = 1
         
         unique_segments = x[['Filename','segment_original_midpoint']].drop_duplicates()
-        environments = pd.DataFrame([ textgrid_table.get_neighbors_from_midpoint(tg_path, midpt,
-            phone_tier, utilities_dir=os.path.join(script_dir, "praat_utilities")) for 
-            segment_filename, midpt in unique_segments.values ],
+        if batched:
+            contexts = textgrid_table.get_neighbors_from_midpoints(tg_path, 
+                unique_segments['segment_original_midpoint'].values, phone_tier)
+        else:
+            contexts = [ textgrid_table.get_neighbors_from_midpoint(tg_path, midpt,
+                phone_tier, utilities_dir=os.path.join(script_dir, "praat_utilities")) for 
+                segment_filename, midpt in unique_segments.values ]
+        environments = pd.DataFrame(contexts,
             columns=['preceding_context','following_context'], index=unique_segments.index)
         environments = pd.concat([environments, unique_segments],axis=1)
         #logging.debug(environments.columns)
@@ -363,13 +567,26 @@ def add_phonological_context(df, alignments_dir=livingroom_root + "annotations")
 
 def case_pipeline(unique_id, audio_path, alignments_path, video_path=None, 
                   transcript_path=None, creak_results_path=None,
-                  do_creak=True, do_cv=True, do_acoustic=True):
+                  do_creak=True, do_cv=True, do_acoustic=True,
+                  working_wav_dir=tmp_wav_dir, from_long_sound=False,
+                  acoustic_backend="praat", interlocutor_audio_path=None,
+                  interlocutor_alignments_path=None):
     """Runs the pipeline on a single 'case' (unique speaker/session combination)
     collecting requested data. Right now, that data includes acoustic measurements,
     creak detection output, and computer vision information. If acoustic data are 
     requested, then metadata about segment, 
     word, and line from which each measurement originates are all added as well.
     
+    working_wav_dir is emptied and used as scratch space for the acoustic measurements,
+    so no two cases running at once may share it. If from_long_sound is True, segments
+    are measured straight from the audio file and working_wav_dir isn't used.
+    acoustic_backend is "praat" for the Praat measurement scripts or "numpy" for the
+    in-process measurements of acoustic_analysis_numpy.
+    
+    If cv_speech_margin is set, CV is only run near the speech in the speaker's
+    alignments and in the interlocutor's (interlocutor_alignments_path, lined up
+    using the offset between the two audio files), and is missing elsewhere.
+    
     Returns a pandas dataframe if do_acoustic is True, with all requested data merged
     together intelligently. If do_acoustic is False, then attempts to return a 
     dict with other requested information included as individual pandas dataframes.
@@ -379,12 +596,16 @@ def case_pipeline(unique_id, audio_path, alignments_path, video_path=None,
     
     logging.info("Case pipeline: " + unique_id)
 
-    working_table_path = os.path.join(working_dir(), unique_id + ".tsv")
-    try:
-        acous_df = pd.read_table(working_table_path, sep="\t")
-        return acous_df
-    except:
-        logging.debug("No results yet exist for {}".format(unique_id))
+    # read when the pipeline runs, so that output_format can be set after import
+    result_cache.cache_format = output_format
+    stage_keys = case_stage_keys(audio_path, alignments_path, video_path, 
+        transcript_path, creak_results_path, do_creak, do_cv, from_long_sound,
+        acoustic_backend, interlocutor_audio_path, interlocutor_alignments_path)
+    if do_acoustic:
+        acous_df = result_cache.load_result('case', stage_keys['case'], 
+                                            description=unique_id)
+        if acous_df is not None:
+            return corpus_schema.apply_schema(acous_df, categoricals=False)
 
     logging.debug(("Audio at {audio}\nAlignments at {alignments}\n"
                   "Video at {video}\nTranscript at {transcript}\n"
@@ -415,20 +636,21 @@ def case_pipeline(unique_id, audio_path, alignments_path, video_path=None,
             logging.error("Creak detection failed", exc_info=True)
     if do_cv:
         logging.info("Doing computer vision")
-        cv_table_path = os.path.join(working_dir(), unique_id + cv_decorator + ".tsv")
+        # the CV records are kept in the working directory (and read from there by
+        # add_interlocutor_cv_data); they are redone only if the stage's key changes
         try:
-            cv_results = pd.read_table(cv_table_path, sep='\t')
-            results_dict['cv'] = cv_results
-        except IOError:
-            try:
-                cv_results = do_cv_annotation(video_path)
-                cv_results = pd.DataFrame(zip(*cv_results), columns=['time','movamp','smile'])
-                results_dict['cv'] = cv_results
-                cv_results.to_csv(cv_table_path, sep='\t', index=False)
-            except KeyboardInterrupt:
-                raise
-            except:
-                logging.error("Computer vision failed", exc_info=True)
+            time_ranges = None
+            if cv_speech_margin is not None:
+                time_ranges = cv_time_ranges(case_session(unique_id)[len("INT"):], 
+                    audio_path, alignments_path, interlocutor_audio_path, 
+                    interlocutor_alignments_path, cv_speech_margin)
+            cv_results = do_cv_annotation(video_path, cv_records_path(unique_id),
+                                          key=stage_keys['cv'], time_ranges=time_ranges)
+            results_dict['cv'] = pd.DataFrame(cv_results)
+        except KeyboardInterrupt:
+            raise
+        except:
+            logging.error("Computer vision failed", exc_info=True)
 
     # presumably every call to the case pipeline will request acoustic measurements, so right 
     # now the behavior of the pipeline is mostly defined in this conditional
@@ -436,19 +658,22 @@ def case_pipeline(unique_id, audio_path, alignments_path, video_path=None,
     # in the dictionary results_dict and not merged into a single table
     if do_acoustic:
         logging.info("Doing acoustic annotation")
-        try:
-            # use saved results if possible
-            acoustic_results_path = os.path.join(working_dir(), unique_id + 
-                                                 acoustic_decorator + ".tsv")
-            acous_df = pd.read_table(acoustic_results_path,sep="\t")
+        # use saved results if possible
+        acous_df = result_cache.load_result('acoustic', stage_keys['acoustic'], 
+                                            description=unique_id)
+        if acous_df is not None:
             logging.info("Using saved measurements")
-        except IOError:
+            acous_df = acous.typed_measurements(acous_df)
+        else:
             try:
                 logging.info("Making acoustic measurements")
-                acous_df = pd.read_table(StringIO.StringIO(
-                    acous.do_acoustic_annotation(audio_path, alignments_path, 
-                                                 working_wav_dir=tmp_wav_dir)), 
-                    na_values="--undefined--")
+                if acoustic_backend == "numpy":
+                    acous_df = acous_numpy.measure_case(audio_path, alignments_path,
+                                                        wide=True)
+                else:
+                    acous_df = acous.do_acoustic_annotation(audio_path, alignments_path, 
+                                                            working_wav_dir=working_wav_dir,
+                                                            from_long_sound=from_long_sound)
             except TypeError:
                 logging.error(("Could not do acoustic annotation, "
                                  "possibly because alignments missing"), exc_info=True)
@@ -458,23 +683,17 @@ def case_pipeline(unique_id, audio_path, alignments_path, video_path=None,
                                  "possibly because alignments missing"), exc_info=True)
                 return None
         
-            acous_df.to_csv(acoustic_results_path, sep="\t")
+            result_cache.store_result(acous_df, 'acoustic', stage_keys['acoustic'])
 
         logging.info("Acoustic measurements retrieved")
 
-        # convert from (hybrid) long to wide
-        logging.info("Reshaping data")
-        acous_df['chunk_id'] = acous_df['Filename'] +  acous_df['Chunk'].map(str)
-        other_metadata = acous_df.loc[:,['chunk_id', 'Filename', 'Segment label', 'Segment start', 
-            'Segment end', 'Chunk', 'Window_start', 'Window_end']].drop_duplicates()
-        other_metadata = other_metadata.set_index('chunk_id')
-        acous_df = acous_df.pivot(index='chunk_id', columns='Measure', values='Value')
-        
-        acous_df = pd.merge(acous_df, other_metadata,left_index=True,right_index=True)
-
-        # add in original timestamp, based on Filename field (possibly fragile--beware)
+        # add in original timestamp, based on Filename field (possibly fragile--beware).
+        # there are many windows per file, so only parse each filename once
         logging.info("Calculating timestamps")
-        acous_df['segment_start_padded'] = acous_df['Filename'].map(lambda x: re.sub(r"^.*_([0-9]+).*?$", r"\1", x)).map(float)
+        filename_codes, filenames = pd.factorize(acous_df['Filename'])
+        filename_starts = pd.Series(filenames).str.replace(r"^.*_([0-9]+).*?$", 
+                                                           r"\1").astype(float)
+        acous_df['segment_start_padded'] = filename_starts.values[filename_codes]
         acous_df['segment_original_start'] = acous_df['segment_start_padded'] / 1000 + acous_df['Segment start']
         acous_df['segment_original_end'] = acous_df['segment_original_start'] + (acous_df['Segment end'] - acous_df['Segment start'])
         acous_df['segment_original_midpoint'] = acous_df['segment_original_start'] + (acous_df['Segment end'] - acous_df['Segment start']) / 2
@@ -497,10 +716,8 @@ def case_pipeline(unique_id, audio_path, alignments_path, video_path=None,
         # CV results
         try:
             # interpolate values of movamp and smile according to time
-            acous_df['movamp_interp'] = np.interp(acous_df['chunk_original_timestamp'], 
-                                                  cv_results.time, cv_results.movamp)
-            acous_df['smiles_interp'] = np.interp(acous_df['chunk_original_timestamp'], 
-                                                  cv_results.time, cv_results.smile) > 0.5
+            acous_df['movamp_interp'], acous_df['smiles_interp'] = sample_cv_records(
+                cv_results, acous_df['chunk_original_timestamp'])
         except NameError:
             logging.warning("No computer vision annotation information added", exc_info=True)
 
@@ -509,9 +726,8 @@ def case_pipeline(unique_id, audio_path, alignments_path, video_path=None,
         logging.debug(acous_df.shape)
         try:
             acous_df = acous_df.sort('chunk_original_timestamp')
-            acous_df['creak_binary'] = [ interval is not None for interval in 
-                points_to_interval_indexes(acous_df['chunk_original_timestamp'], 
-                                           creak_results['start'], creak_results['end']) ]
+            acous_df['creak_binary'] = IntervalIndex(creak_results['start'], 
+                creak_results['end']).contains(acous_df['chunk_original_timestamp'])
         except NameError:
             logging.warning("No creak detection information added", exc_info=True)
         
@@ -524,15 +740,27 @@ def case_pipeline(unique_id, audio_path, alignments_path, video_path=None,
         acous_df = add_transcript_data_to_acoustic(acous_df,transcript_path)
         logging.debug(acous_df.shape)
                 
-        # save a copy in the temporary directory
-        acous_df.to_csv(working_table_path, sep="\t")
-        logging.debug("Saved a copy of this case's results to {}".format(
-            working_table_path))
+        # compact dtypes (categoricals are left until cases are combined)
+        acous_df = corpus_schema.apply_schema(acous_df, categoricals=False)
+        # save a copy in the cache
+        result_cache.store_result(acous_df, 'case', stage_keys['case'])
         return acous_df
 
     # if acoustic measurements are not requested, return the dictionary of other results
     return results_dict
 
+# columns of the tables case_pipeline returns, in order. The creak, CV and transcript
+# columns are missing for cases whose creak, CV or transcript steps fail
+case_columns = ([ column for column in acous.window_columns 
+                  if column not in ('Segment start', 'Segment end') ] + 
+                acous_numpy.measure_order + 
+                ['segment_start_padded', 'segment_original_start', 'segment_original_end',
+                 'segment_original_midpoint', 'chunk_original_timestamp', 
+                 'segment_duration', 'analysis_padding', 'speaker_session_id',
+                 'preceding_context', 'following_context', 'movamp_interp', 
+                 'smiles_interp', 'creak_binary', 'word_start', 'word_end', 'word_label',
+                 'line_start', 'line_end', 'line_label'])
+
 def get_cases_from_directory(case_path, case_filename_pattern=livingroom_filename_pattern, case_id_pattern=r"\2_\3"):
     """return a list of unique case IDs ('INTYYY_XXX') based on files matching 
     the regex in case_filename_pattern in the directory given in case_path"""
@@ -567,69 +795,230 @@ def unique_id_to_data_path(unique_id, data_dir=livingroom_root + "audio",
         return None
 
 
+def corpus_manifest_path():
+    """manifest_path, or its default for the current output_format"""
+    if manifest_path is not None:
+        return manifest_path
+    return table_io.table_path(os.path.join(pipeline_tmp_root, "manifest"), 
+                               output_format)
+
+def corpus_manifest(directories=(), refresh=False):
+    """The manifest of the corpus's data files, covering at least directories. 
+    The manifest is loaded from corpus_manifest_path() once per run, scanning only 
+    directories it doesn't cover yet (or all directories that have changed, if
+    refresh is True), and saved again if anything was scanned"""
+    
+    global _manifest, _manifest_index
+    if _manifest is None:
+        _manifest = manifest.load_manifest(corpus_manifest_path())
+        refresh = True
+    if _manifest is None:
+        to_scan = list(directories)
+    elif refresh:
+        to_scan = list(set(_manifest['directory']) | 
+                       set(os.path.abspath(directory) for directory in directories))
+    else:
+        covered = set(_manifest['directory'])
+        to_scan = [ directory for directory in directories if 
+                    os.path.abspath(directory) not in covered ]
+    if to_scan or _manifest is None:
+        previous = _manifest
+        _manifest = manifest.refresh_manifest(_manifest, to_scan)
+        _manifest_index = manifest.manifest_index(_manifest)
+        if previous is None or not _manifest.equals(previous):
+            try:
+                manifest.save_manifest(_manifest, corpus_manifest_path())
+            except (IOError, OSError):
+                logging.warning("Could not save manifest", exc_info=True)
+    return _manifest
+
+def unique_id_to_manifest_path(unique_id, data_dir, extension):
+    """Like unique_id_to_data_path with a livingroom_pattern_template pattern for 
+    files with extension, but answered from the corpus manifest"""
+    corpus_manifest([data_dir])
+    return manifest.find_path(_manifest_index, data_dir, unique_id, extension)
+
 def unique_id_to_audio_path(unique_id, data_dir=livingroom_root + "audio"):
-    return unique_id_to_data_path(unique_id, data_dir=data_dir, data_filename_pattern=
-                                  livingroom_pattern_template + ".(wav)$")
+    return unique_id_to_manifest_path(unique_id, data_dir, "wav")
 
 def unique_id_to_video_path(unique_id, data_dir=livingroom_root + "video"):
-    return unique_id_to_data_path(unique_id, data_dir=data_dir, data_filename_pattern=
-                                  livingroom_pattern_template + ".(mov)$")
+    return unique_id_to_manifest_path(unique_id, data_dir, "mov")
 
 def unique_id_to_alignments_path(unique_id, data_dir=livingroom_root + "annotations"):
-    return unique_id_to_data_path(unique_id, data_dir=data_dir, data_filename_pattern=
-                                  livingroom_pattern_template + ".(TextGrid)$")
+    return unique_id_to_manifest_path(unique_id, data_dir, "TextGrid")
 
 def unique_id_to_transcript_path(unique_id, data_dir=livingroom_root + "annotations"):
-    return unique_id_to_data_path(unique_id, data_dir=data_dir, data_filename_pattern=
-                                  livingroom_pattern_template + ".(txt)$")
+    return unique_id_to_manifest_path(unique_id, data_dir, "txt")
+
+def unique_id_to_creak_path(unique_id, data_dir=creak_tmp_dir):
+    return unique_id_to_manifest_path(unique_id, data_dir, "txt")
+
+def unique_id_to_interlocutor_id(unique_id, data_dir=livingroom_root + "annotations",
+                                 extension="TextGrid"):
+    """Case ID of the other speaker in unique_id's session (the first with a file 
+    with extension in data_dir, by the corpus manifest), or None if there is none"""
+    corpus_manifest([data_dir])
+    session = case_session(unique_id)
+    interlocutors = [ case_id for case_id in 
+                      manifest.manifest_cases(_manifest, data_dir, [extension]) 
+                      if case_id != unique_id and case_session(case_id) == session ]
+    return interlocutors[0] if interlocutors else None
+
+def case_arguments(case_id, video_path=livingroom_root + "video", 
+                   audio_path=livingroom_root + "audio", 
+                   alignments_path=livingroom_root + "annotations"):
+    """Positional and keyword arguments to case_pipeline for case_id"""
+    interlocutor_id = unique_id_to_interlocutor_id(case_id, alignments_path)
+    interlocutor_paths = {}
+    if interlocutor_id is not None:
+        interlocutor_paths = dict(
+            interlocutor_audio_path=unique_id_to_audio_path(interlocutor_id, audio_path),
+            interlocutor_alignments_path=unique_id_to_alignments_path(interlocutor_id,
+                                                                      alignments_path))
+    return ((case_id, 
+             unique_id_to_audio_path(case_id, audio_path), 
+             unique_id_to_alignments_path(case_id,alignments_path)),
+            dict(video_path=unique_id_to_video_path(case_id, video_path), 
+                 transcript_path=unique_id_to_transcript_path(case_id,alignments_path),
+                 creak_results_path=unique_id_to_creak_path(case_id),
+                 do_creak=True, do_cv=True, do_acoustic=True, **interlocutor_paths))
+
+def guarded_case_pipeline(case_args):
+    """Run case_pipeline(*args, **kwargs) for case_args = (args, kwargs). Failures 
+    are logged and give None, like a case with missing resources, so that one bad 
+    case doesn't stop a run"""
+    args, kwargs = case_args
+    try:
+        return case_pipeline(*args, **kwargs)
+    except KeyboardInterrupt:
+        raise
+    except:
+        logging.error("Case pipeline failed for {}".format(args[0]), exc_info=True)
+        return None
+
+def isolated_case_pipeline(case_args):
+    """guarded_case_pipeline, in a scratch WAV directory of its own that is removed 
+    afterwards. For use in a process pool"""
+    args, kwargs = case_args
+    scratch_dir = tempfile.mkdtemp(prefix=os.path.basename(tmp_wav_dir) + "_", 
+                                   dir=pipeline_tmp_root)
+    try:
+        return guarded_case_pipeline((args, dict(kwargs, working_wav_dir=scratch_dir)))
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+def iter_case_results(case_list, video_path=livingroom_root + "video", 
+                      audio_path=livingroom_root + "audio", 
+                      alignments_path=livingroom_root + "annotations",
+                      workers=1):
+    """Run case_pipeline on every case in case_list, yielding (case ID, result) 
+    pairs in the order of case_list as each case finishes. If workers > 1, cases 
+    are run in a pool of that many processes, each case with its own scratch 
+    directory"""
+
+    all_case_args = [ case_arguments(case_id, video_path, audio_path, alignments_path)
+                      for case_id in case_list ]
+    if workers > 1:
+        # make shared directories up front, rather than racing to in the workers
+        working_dir()
+        pool = multiprocessing.Pool(workers)
+        try:
+            for case_id, case_result in itertools.izip(case_list, 
+                    pool.imap(isolated_case_pipeline, all_case_args, chunksize=1)):
+                yield case_id, case_result
+        except BaseException:
+            # the consumer stopped early (GeneratorExit), failed, or was interrupted:
+            # don't wait for the cases still queued
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+    else:
+        for case_id, case_args in zip(case_list, all_case_args):
+            yield case_id, guarded_case_pipeline(case_args)
+
+def add_session_speaker_ids(results):
+    """Split speaker_session_id into session_id and speaker_id fields"""
+    results['session_id'], results['speaker_id'] = zip(
+        *map(lambda x: x.strip('INT').split('_'), results['speaker_session_id']))
+    return results
 
 def cases_pipeline(case_list, video_path=livingroom_root + "video", 
                        audio_path=livingroom_root + "audio", 
-                       alignments_path=livingroom_root + "annotations"):
+                       alignments_path=livingroom_root + "annotations",
+                       workers=1):
+    """Run case_pipeline on every case in case_list, and combine the results. 
+    If workers > 1, cases are run in a pool of that many processes, each case with
+    its own scratch directory; results are combined in the order of case_list either 
+    way"""
 
-    results_by_case = dict([ (case_id, case_pipeline(case_id, 
-        unique_id_to_audio_path(case_id, audio_path), 
-        unique_id_to_alignments_path(case_id,alignments_path),
-        video_path=unique_id_to_video_path(case_id, video_path), 
-        transcript_path=unique_id_to_transcript_path(case_id,alignments_path),
-        creak_results_path=unique_id_to_data_path(case_id, creak_tmp_dir, 
-                livingroom_pattern_template + ".(txt)$"),
-        do_creak=True, do_cv=True, do_acoustic=True)) for case_id in case_list ])
+    results_by_case = collections.OrderedDict(iter_case_results(case_list, 
+        video_path, audio_path, alignments_path, workers))
     
     # add unique identifier and split into speaker and session ID fields as well
     results = pd.concat([ pd.DataFrame(df) for key, df in results_by_case.iteritems() 
                         if df is not None ], axis=0)
-    results['session_id'], results['speaker_id'] = zip(
-        *map(lambda x: x.strip('INT').split('_'), results['speaker_session_id']))
+    return add_session_speaker_ids(results)
 
-    return results
+def case_session(case_id):
+    """Session part of a case ID"""
+    return re.match(unique_id_pattern, case_id).group(1)
+
+def sessions_pipeline(case_list, video_path=livingroom_root + "video", 
+                      audio_path=livingroom_root + "audio", 
+                      alignments_path=livingroom_root + "annotations",
+                      workers=1):
+    """Like cases_pipeline, but yields the combined results of one session at a time
+    (as (session ID, results) pairs), so that only one session's results need to be 
+    in memory. Sessions are yielded in the order in which they first appear in 
+    case_list; sessions with no results are skipped"""
+
+    sessions = collections.OrderedDict()
+    for case_id in case_list:
+        sessions.setdefault(case_session(case_id), []).append(case_id)
+    ordered_cases = [ case_id for session_cases in sessions.itervalues() for 
+                      case_id in session_cases ]
+
+    session_results = []
+    remaining_cases = dict((session, len(session_cases)) for session, session_cases 
+                           in sessions.iteritems())
+    for case_id, case_result in iter_case_results(ordered_cases, video_path, 
+                                                  audio_path, alignments_path, workers):
+        session = case_session(case_id)
+        if case_result is not None:
+            session_results.append(pd.DataFrame(case_result))
+        remaining_cases[session] -= 1
+        if remaining_cases[session] == 0:
+            if session_results:
+                yield session, add_session_speaker_ids(
+                    pd.concat(session_results, axis=0))
+            session_results = []
+
+def directory_cases(video_path=livingroom_root + "video", exclude_cases=[]):
+    case_list = manifest.manifest_cases(corpus_manifest([video_path]), video_path, 
+                                        extensions=['wav', 'mov', 'eaf'])
+    return [ case for case in case_list if case not in exclude_cases ]
 
 def directory_pipeline(video_path=livingroom_root + "video", 
                        audio_path=livingroom_root + "audio", 
                        alignments_path=livingroom_root + "annotations",
-                       exclude_cases=[]):
+                       exclude_cases=[], workers=1):
     """ Run pipeline on a whole directory, specified in video_path"""
     
-    case_list = [ case for case in get_cases_from_directory(video_path) if case not in
-                    exclude_cases ]
-                    
-    return cases_pipeline(case_list, video_path, audio_path, alignments_path)
-     
+    return cases_pipeline(directory_cases(video_path, exclude_cases), 
+                          video_path, audio_path, alignments_path, workers=workers)
 
-def main(exit_survey_path=os.path.join(pipeline_tmp_root, "metadata",
-            "Living_Room_Participant_Survey.csv"),
-         exit_survey_headings=os.path.join(pipeline_tmp_root, "metadata",
-            "qualtricsheadings.txt"),
-         session_info_path=os.path.join(pipeline_tmp_root, "metadata",
-            "Session_Information_Post.csv"),
-         session_info_headings=os.path.join(pipeline_tmp_root, "metadata",
-            "sessioninfoheadings.txt")):
-    # measurements
-    results = directory_pipeline()
-    logging.info("Measurements gathered")
+def enrich_results(results, exit_survey_path, exit_survey_headings,
+                   session_info_path, session_info_headings, 
+                   audio_dir=os.path.join(livingroom_root, "audio")):
+    """Add unit IDs, survey and session metadata, offsets and interlocutor data to
+    results from cases_pipeline, and give them the compact dtypes of 
+    utilities.corpus_schema. Works on any set of whole sessions"""
+    
     # add ids for hierarchical units
     logging.info("Adding IDs for prosodic units")
-    results = add_unit_ids(results)
+    results = add_unit_ids(results, unit_id_format)
     # metadata
     logging.info("Adding survey and session metadata")
     results = adorn_with_session_info(results,
@@ -637,15 +1026,74 @@ def main(exit_survey_path=os.path.join(pipeline_tmp_root, "metadata",
         session_info_path, session_info_headings)
     # get better timestamps
     logging.info("Getting audio offsets")
-    results = add_offsets(results, os.path.join(livingroom_root, "audio"))
+    results = add_offsets(results, audio_dir)
     
     # calculate some derived columns for interlocutor activity
     logging.info("Getting interlocutor CV information")
     results = add_interlocutor_cv_data(results)
+    return corpus_schema.apply_schema(results)
+
+def output_columns(exit_survey_path, exit_survey_headings):
+    """Every column enrich_results can give results from cases_pipeline, in order"""
+    return (case_columns + ['session_id', 'speaker_id'] + list(unit_id_columns) + 
+            session_info_columns(exit_survey_path, exit_survey_headings) +
+            ['offset_secs', 'offset_confidence', 'offset_low_confidence',
+             'offset_to_interlocutor_native', 'chunk_timestamp_with_offset',
+             'interlocutor_movamp', 'interlocutor_smile'])
+
+@contextlib.contextmanager
+def unit_id_writer(output_path):
+    """A TableWriter for the table of unit IDs (see unit_id_lookup) written next to
+    output_path, if unit_id_format is "code", or else None. There is none for output
+    to stdout, since the codes can't be looked up then, which is warned about"""
+    if unit_id_format != "code":
+        yield None
+    elif output_path == "-":
+        logging.warning("Unit IDs are written as codes, but the table of their "
+                        "human-readable IDs is only written for output to a file")
+        yield None
+    else:
+        base_path, extension = os.path.splitext(output_path)
+        with table_io.TableWriter(base_path + "_unit_ids" + extension) as unit_ids:
+            yield unit_ids
+
+
+def main(exit_survey_path=os.path.join(pipeline_tmp_root, "metadata",
+            "Living_Room_Participant_Survey.csv"),
+         exit_survey_headings=os.path.join(pipeline_tmp_root, "metadata",
+            "qualtricsheadings.txt"),
+         session_info_path=os.path.join(pipeline_tmp_root, "metadata",
+            "Session_Information_Post.csv"),
+         session_info_headings=os.path.join(pipeline_tmp_root, "metadata",
+            "sessioninfoheadings.txt"),
+         workers=1, output_path=None):
+    """Run the whole pipeline. If output_path is None, returns the results as one 
+    table. Otherwise, results are enriched and written to output_path (see 
+    utilities.table_io.TableWriter; "-" for stdout) one session at a time, so that 
+    memory use is bounded by the largest session, and output_path is returned"""
+    
+    metadata_paths = (exit_survey_path, exit_survey_headings, 
+                      session_info_path, session_info_headings)
+    if output_path is None:
+        # measurements
+        results = directory_pipeline(workers=workers)
+        logging.info("Measurements gathered")
+        return enrich_results(results, *metadata_paths)
     
-    return results   
+    # fixed up front, since a session's results lack the columns of any step that 
+    # failed for all of its cases
+    columns = output_columns(exit_survey_path, exit_survey_headings)
+    with table_io.TableWriter(output_path, columns=columns,
+                              dtypes=corpus_schema.write_dtypes()) as output, \
+         unit_id_writer(output_path) as unit_ids:
+        for session, results in sessions_pipeline(directory_cases(), workers=workers):
+            logging.info("Measurements gathered for session {}".format(session))
+            results = enrich_results(results, *metadata_paths)
+            output.append(results)
+            if unit_ids is not None:
+                unit_ids.append(unit_id_lookup(results))
+    return output_path
 
 
 if __name__ == '__main__':
-    results = main()
-    print results.to_csv(sep="\t", index=False, encoding='utf-8')
+    main(output_path=sys.argv[1] if len(sys.argv) > 1 else "-")
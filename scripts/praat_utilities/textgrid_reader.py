@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""textgrid_reader.py
+
+In-process reader for Praat TextGrid files (long and short text formats), so that
+reading alignments doesn't require starting up Praat. Tiers are returned as NumPy
+arrays of interval starts, ends, and labels. Parsed files are kept in a small LRU
+cache keyed on path and modification time, so each TextGrid is only read once per run
+unless it changes on disk.
+"""
+
+import os
+import re
+import codecs
+import collections
+import logging
+
+import numpy as np
+
+# one tier of a TextGrid. For point tiers (TextTier), starts and ends are both the
+# times of the points and labels are the marks
+Tier = collections.namedtuple('Tier', ['name', 'tier_class', 'xmin', 'xmax',
+                                       'starts', 'ends', 'labels'])
+
+# how many parsed TextGrids to keep around
+textgrid_cache_size = 64
+_textgrid_cache = collections.OrderedDict()
+
+# Praat's text format is a sequence of numbers, quoted strings and <flags>;
+# everything else (keys like 'xmin =', indexes like 'item [1]:', comments) is noise.
+# the long format is the short format with annotations, so both read the same way
+_token_re = re.compile(r'"((?:[^"]|"")*)"|\[[^\]\n]*\]|!.*|<([a-z]+)>|'
+                       r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+# whitespace as Praat's regexes understand it
+_praat_space_re = re.compile(r"[ \t\n\r\f\v]+")
+
+
+def _decode(raw):
+    """Praat writes TextGrids as ASCII, UTF-8, or UTF-16 (with BOM)"""
+    if raw.startswith(codecs.BOM_UTF16_BE) or raw.startswith(codecs.BOM_UTF16_LE):
+        return raw.decode('utf-16')
+    if raw.startswith(codecs.BOM_UTF8):
+        raw = raw[len(codecs.BOM_UTF8):]
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('latin-1')
+
+def _tokens(text):
+    for match in _token_re.finditer(text):
+        string, flag, number = match.groups()
+        if string is not None:
+            yield string.replace('""', '"')
+        elif flag is not None:
+            yield '<' + flag + '>'
+        elif number is not None:
+            yield float(number)
+
+def parse_textgrid(text):
+    """Parse the contents of a text (long or short format) TextGrid file.
+    Returns a list of Tier tuples, in the order in which they appear in the file"""
+
+    tokens = _tokens(text)
+    next_token = tokens.next
+    try:
+        file_type, object_class = next_token(), next_token()
+        if file_type != "ooTextFile" or object_class != "TextGrid":
+            raise ValueError("Not a text TextGrid: {} {}".format(file_type, object_class))
+        next_token(), next_token()      # xmin, xmax of the whole TextGrid
+        if next_token() != "<exists>":
+            return []
+        n_tiers = int(next_token())
+
+        tiers = []
+        for i_tier in range(n_tiers):
+            tier_class, name = next_token(), next_token()
+            xmin, xmax = float(next_token()), float(next_token())
+            n_items = int(next_token())
+            if tier_class == "IntervalTier":
+                items = [ (next_token(), next_token(), next_token())
+                          for i_item in range(n_items) ]
+                starts = np.array([ item[0] for item in items ], dtype=np.float64)
+                ends = np.array([ item[1] for item in items ], dtype=np.float64)
+            elif tier_class == "TextTier":
+                items = [ (next_token(), next_token()) for i_item in range(n_items) ]
+                starts = np.array([ item[0] for item in items ], dtype=np.float64)
+                ends = starts.copy()
+            else:
+                raise ValueError("Unknown tier class: {}".format(tier_class))
+            labels = np.empty(n_items, dtype=object)
+            labels[:] = [ item[-1] for item in items ]
+            tiers.append(Tier(name, tier_class, xmin, xmax, starts, ends, labels))
+    except StopIteration:
+        raise ValueError("TextGrid ended prematurely")
+    return tiers
+
+def read_textgrid(textgrid_path):
+    """Return the tiers of the TextGrid at textgrid_path as a list of Tier tuples.
+    Results are cached by path and modification time."""
+
+    textgrid_path = os.path.abspath(textgrid_path)
+    cache_key = (textgrid_path, os.path.getmtime(textgrid_path))
+    try:
+        tiers = _textgrid_cache.pop(cache_key)
+    except KeyError:
+        logging.debug("Parsing TextGrid {}".format(textgrid_path))
+        with open(textgrid_path, 'rb') as tg_file:
+            tiers = parse_textgrid(_decode(tg_file.read()))
+    # most recently used goes at the end, evict from the front
+    _textgrid_cache[cache_key] = tiers
+    while len(_textgrid_cache) > textgrid_cache_size:
+        _textgrid_cache.popitem(last=False)
+    return tiers
+
+def clear_textgrid_cache():
+    _textgrid_cache.clear()
+
+def get_tier(textgrid_path, tier_number):
+    """Tier tuple for tier_number (counting from 1, as in Praat)"""
+    return read_textgrid(textgrid_path)[int(tier_number) - 1]
+
+def interval_at_time(tier, times):
+    """Vectorized equivalent of Praat's 'Get interval at time': for each of times,
+    the 1-based index of the interval of tier containing it (start <= t < end, or
+    the last interval if t is the end of the tier), 0 if there is none"""
+
+    times = np.asarray(times, dtype=np.float64)
+    if len(tier.starts) == 0:
+        return np.zeros(times.shape, dtype=np.int64)
+    indexes = np.searchsorted(tier.starts, times, side='right')
+    last = indexes - 1
+    inside = (indexes > 0) & (times < tier.ends[np.maximum(last, 0)])
+    inside |= (indexes == len(tier.starts)) & (times == tier.xmax)
+    return np.where(inside, indexes, 0)
+
+def normalize_label(label):
+    """Collapse runs of whitespace, as the Praat table scripts do"""
+    return _praat_space_re.sub(" ", label)
+
+def format_number(x):
+    """Format a number the way Praat does when interpolating it into a string"""
+    formatted = "%.15g" % x
+    if float(formatted) != x:
+        formatted = "%.17g" % x
+    return formatted
@@ -4,15 +4,26 @@ import os
 import subprocess
 import itertools
 
+import numpy as np
+
+import textgrid_reader
+from textgrid_reader import normalize_label, format_number
+
 
 def get_table_from_tg(textgrid_path, target_tier, other_tiers=None, praat_path = "praat",
-utilities_dir = "praat_utilities/"):
+utilities_dir = "praat_utilities/", use_praat=False):
     """ From the TextGrid in texgrid_path find which of the other 
     tiers in other_tiers overlap the midpoint of each nonempty interval in target_tier
     Output a table with the start, end, and label of each nonempty interval in the target,
     Along with the same information for each overlapping tier in the other tiers (all
     if other_tiers is None)
+    
+    Unless use_praat is True, the TextGrid is read in-process by textgrid_reader
+    rather than by textgrid_table.praat; the output is the same either way.
     """
+    
+    if not use_praat:
+        return _table_from_tg(textgrid_path, target_tier, other_tiers)
      
     num_tiers = subprocess.check_output([praat_path, 
         os.path.join(utilities_dir, "textgrid_numtiers.praat"), 
@@ -29,10 +40,12 @@ utilities_dir = "praat_utilities/"):
     return list(map(lambda x: x.split('\t'), tg_table.split('\n')))
 
 def get_neighbors_tg_tier(textgrid_path, target_tier, praat_path = "praat", 
-                          utilities_dir="praat_utilities/"):
+                          utilities_dir="praat_utilities/", use_praat=False):
     """Get left and right neighbors for each interval of target_tier in the TextGrid
     in textgrid_path, return as list of tuples (label, start, end, prev, next)"""
     
+    if not use_praat:
+        return _neighbors_tg_tier(textgrid_path, target_tier)
     
     tg_table = subprocess.check_output([praat_path, 
         os.path.join(utilities_dir, "textgrid_table_neighbors.praat"), 
@@ -41,10 +54,12 @@ def get_neighbors_tg_tier(textgrid_path, target_tier, praat_path = "praat",
     return list(map(lambda x: x.split('\t'), tg_table.split('\n')))
     
 def get_neighbors_from_midpoint(textgrid_path, target_midpoint, target_tier, praat_path = "praat", 
-                          utilities_dir="praat_utilities/"):
+                          utilities_dir="praat_utilities/", use_praat=False):
     """Get left and right neighbors for interval at midpoint in target_tier in the TextGrid
     in textgrid_path, return as list (prev, next)"""
     
+    if not use_praat:
+        return _neighbors_from_midpoint(textgrid_path, target_midpoint, target_tier)
     
     tg_table = subprocess.check_output([praat_path, 
         os.path.join(utilities_dir, "tg_neighbors_from_midpoint.praat"), 
@@ -53,4 +68,100 @@ def get_neighbors_from_midpoint(textgrid_path, target_midpoint, target_tier, pra
     
     results = tg_table.split('\t')
 
-    return results
\ No newline at end of file
+    return results
+
+def get_neighbors_from_midpoints(textgrid_path, target_midpoints, target_tier):
+    """Batched get_neighbors_from_midpoint: get left and right neighbors for the 
+    interval at each of target_midpoints in target_tier, in one pass over the tier.
+    Return as list of lists (prev, next), in the order of target_midpoints"""
+    
+    tier = textgrid_reader.get_tier(textgrid_path, target_tier)
+    target_midpoints = np.asarray(target_midpoints, dtype=np.float64)
+    i_ints = textgrid_reader.interval_at_time(tier, target_midpoints)
+    if (i_ints == 0).any():
+        raise ValueError("No interval at time {} on tier {} of {}".format(
+            target_midpoints[i_ints == 0][0], target_tier, textgrid_path))
+    
+    # pad labels with "" on both sides, so that the first interval's previous
+    # and the last interval's next label come out empty
+    padded_labels = np.concatenate([[u""], tier.labels, [u""]])
+    prev_labels = padded_labels[i_ints - 1]
+    next_labels = padded_labels[i_ints + 1]
+    return [ [_utf8(prev_label), _utf8(next_label)] for prev_label, next_label in 
+             zip(prev_labels, next_labels) ]
+
+
+# In-process equivalents of the Praat scripts above. These mimic the scripts' output
+# (down to number formatting and the blank rows printed for empty intervals), so callers
+# get the same tables whichever way they ask
+
+def _utf8(label):
+    return label.encode('utf-8')
+
+def _table_from_tg(textgrid_path, target_tier, other_tiers=None):
+    tiers = textgrid_reader.read_textgrid(textgrid_path)
+    target_tier = int(target_tier)
+    if other_tiers is None:
+        other_tiers = [x for x in range(1, len(tiers) + 1) if x != target_tier]
+    # textgrid_table.praat goes through the other tiers in TextGrid order
+    other_tiers = sorted(set(int(x) for x in other_tiers))
+    
+    target = tiers[target_tier - 1]
+    midpoints = (target.ends - target.starts) / 2 + target.starts
+    matches = [ (tiers[tier_num - 1], 
+                 textgrid_reader.interval_at_time(tiers[tier_num - 1], midpoints) - 1)
+                for tier_num in other_tiers ]
+    
+    table = []
+    for i_int in range(len(target.starts)):
+        label = normalize_label(target.labels[i_int])
+        if label == "":
+            table.append([''])
+            continue
+        row = [_utf8(label), format_number(target.starts[i_int]), 
+               format_number(target.ends[i_int])]
+        for tier, matching_intervals in matches:
+            matching_interval = matching_intervals[i_int]
+            if matching_interval < 0:
+                raise ValueError("No interval at time {} on tier {}".format(
+                    midpoints[i_int], tier.name))
+            matching_label = normalize_label(tier.labels[matching_interval])
+            if matching_label == "":
+                matching_label = '""'
+            row.extend([_utf8(matching_label), 
+                        format_number(tier.starts[matching_interval]),
+                        format_number(tier.ends[matching_interval])])
+        table.append(row)
+    # the script's output ends in a newline
+    table.append([''])
+    return table
+
+def _neighbors_tg_tier(textgrid_path, target_tier):
+    tier = textgrid_reader.get_tier(textgrid_path, target_tier)
+    n_ints = len(tier.starts)
+    
+    table = []
+    for i_int in range(n_ints):
+        label = normalize_label(tier.labels[i_int])
+        if label == "":
+            table.append([''])
+            continue
+        prev_label = tier.labels[i_int - 1] if i_int != 0 else u""
+        next_label = tier.labels[i_int + 1] if i_int != n_ints - 1 else u""
+        table.append([_utf8(label), format_number(tier.starts[i_int]),
+                      format_number(tier.ends[i_int]), 
+                      _utf8(prev_label), _utf8(next_label)])
+    table.append([''])
+    return table
+
+def _neighbors_from_midpoint(textgrid_path, target_midpoint, target_tier):
+    tier = textgrid_reader.get_tier(textgrid_path, target_tier)
+    n_ints = len(tier.starts)
+    i_int = textgrid_reader.interval_at_time(tier, float(target_midpoint))
+    if i_int == 0:
+        raise ValueError("No interval at time {} on tier {} of {}".format(
+            target_midpoint, target_tier, textgrid_path))
+    
+    prev_label = tier.labels[i_int - 2] if i_int != 1 else u""
+    next_label = tier.labels[i_int] if i_int != n_ints else u""
+    return [_utf8(prev_label), _utf8(next_label)]
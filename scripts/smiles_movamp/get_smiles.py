@@ -4,91 +4,467 @@
 # and prints to stdout the following:
 # [time] \t [MA] \t [smiling?]
 #
-# usage: python get_smiles.py [video_file]
+# usage: python get_smiles.py [video_file] [analysis_fps] [detection_width] [detect_every]
+#
+# analysis_fps: analyze only this many frames per second (default: every frame). 
+#	Movement amplitude for an analyzed frame is still its difference from the frame 
+#	just before it, so it means the same thing at any analysis rate.
+# detection_width: look for faces in a grayscale copy of the frame scaled down to 
+#	this width (default: full size). Smiles are looked for in the full-size mouth
+#	region of each face.
+#
+# do_smiles_movamp can also split the video into time ranges and analyze them in 
+# a pool of worker processes (workers), each with its own capture and cascades.
+# Results are stitched back together in frame order before movement amplitudes are
+# z-scored, so they are the same as those of a single process.
+#
+# Results are written as they come, as float32 (time, MA, smile) records, to a 
+# binary file that is checkpointed every checkpoint_every records, so that an
+# interrupted run can pick up from its last checkpoint (see do_smiles_movamp).
+#
+# time_ranges: analyze only frames within these (start, end) times, in seconds, 
+#	skipping straight past everything else. Each skipped stretch is marked by a 
+#	record with NaN movement amplitude and smile at either end of it, so that 
+#	anything interpolated from the records there is missing rather than made up.
+#
+# detect_every: run the face cascade over the whole frame only every this many
+#	analyzed frames (default: every frame). In between, each face is tracked by 
+#	matching its appearance at the last detection within a window around where it
+#	was, and faces are detected again as soon as any match scores below 
+#	min_track_score. Pass a dict as stats to count detected and tracked frames.
 #
 #	Author: Rob Voigt
 # 
 
 import cv2, os, random, sys
+import json, multiprocessing, tempfile
 import numpy as np
 
 # cascade classifier locations
 face_file = 'haarcascade_frontalface_alt.xml'
 smile_file = 'smiled_01.xml'
 
-def do_smiles_movamp(test_file, data_dir, face_file, smile_file):
+# tracking: lowest acceptable template match (normalized correlation), and how far
+# (as a fraction of the face's size) a face is looked for around where it was
+min_track_score = 0.6
+track_margin = 0.5
+
+# per-frame results on disk: time, movement amplitude and smile (1 or 0), and how 
+# often (in records) they are checkpointed while a video is analyzed
+record_dtype = np.dtype([('time', np.float32), ('movamp', np.float32), 
+	('smile', np.float32)])
+checkpoint_every = 1000
+checkpoint_extension = '.checkpoint'
+zscore_block = 1000000
+
+# cv2.VideoCapture properties (by number, which works across OpenCV versions)
+CAP_PROP_POS_FRAMES = 1
+CAP_PROP_FRAME_WIDTH = 3
+CAP_PROP_FPS = 5
+CAP_PROP_FRAME_COUNT = 7
+
+def load_cascades(data_dir, face_file, smile_file):
 	face_path=os.path.join(data_dir, face_file)
 	smile_path=os.path.join(data_dir, smile_file)
 	assert os.path.isfile(face_path)
 	assert os.path.isfile(smile_path)
-	face_cascade = cv2.CascadeClassifier(face_path)
-	smile_cascade = cv2.CascadeClassifier(smile_path)
+	return cv2.CascadeClassifier(face_path), cv2.CascadeClassifier(smile_path)
 
-	cap = cv2.VideoCapture(test_file)
-	fps = float(cap.get(5))
+def sampled_frames(fps, analysis_fps=None):
+	"""Function telling whether a frame number is to be analyzed: the first frame
+	of each 1/analysis_fps seconds (every frame if analysis_fps is None)"""
+	if analysis_fps is None or analysis_fps >= fps:
+		return lambda frame_num: True
+	step = fps / float(analysis_fps)
+	return lambda frame_num: frame_num == 0 or \
+		int(frame_num / step) != int((frame_num - 1) / step)
 
-	if not cap.isOpened():
-		print 'error opening video file'
-		raise Exception('Error opening video file')
+def detection_image(frame_gray, detection_width=None):
+	"""frame_gray scaled down to detection_width (if it is wider), and the scale
+	factor back to frame_gray's coordinates"""
+	if detection_width is None or frame_gray.shape[1] <= detection_width:
+		return frame_gray, 1.0
+	scale = frame_gray.shape[1] / float(detection_width)
+	return cv2.resize(frame_gray, (int(detection_width), 
+		int(round(frame_gray.shape[0] / scale))), interpolation=cv2.INTER_AREA), scale
 
-	frame_num = -1
-	prior_frame = ''
-	times, mas, smilevals = [], [], []
+def find_smiles(frame_gray, faces, smile_cascade, scale=1.0):
+	"""Faces (x, y, w, h, given in coordinates scale times smaller than frame_gray's,
+	returned in frame_gray's) and, for each, the first smile found in the bottom 
+	half of the face (in face coordinates), or None"""
+	results = []
+	for (x,y,w,h) in faces:
+		x, y, w, h = [ int(round(v * scale)) for v in (x, y, w, h) ]
+		smile_roi_gray = frame_gray[y+(h/2):y+h, x:x+w]
+		smiles = smile_cascade.detectMultiScale(smile_roi_gray)
+		smile = None
+		for (ex, ey, ew, eh) in smiles[0:1]:
+			smile = (ex, ey+(h/2), ew, eh)
+		results.append(((x, y, w, h), smile))
+	return results
 
-	# total_frames = int(cap.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT))
+def detect_smiles(frame_gray, face_cascade, smile_cascade, detection_width=None):
+	"""Faces (x, y, w, h, in frame_gray's coordinates) and, for each, the first
+	smile found in the bottom half of the face (in face coordinates), or None. 
+	Faces are looked for in a copy of frame_gray scaled down to detection_width"""
+	detection_frame, scale = detection_image(frame_gray, detection_width)
+	faces = face_cascade.detectMultiScale(detection_frame, 1.3, 5)
+	return find_smiles(frame_gray, faces, smile_cascade, scale)
 
-	while True: 
-		frame_num += 1
+def track_face(detection_frame, template, face, margin=track_margin):
+	"""Where template (a face as it looked when detected) best matches 
+	detection_frame within margin times its size of face (x, y, w, h), and how 
+	well: (x, y, w, h), normalized correlation"""
+	x, y, w, h = face
+	left, top = max(0, int(x - margin * w)), max(0, int(y - margin * h))
+	right = min(detection_frame.shape[1], int(x + w + margin * w))
+	bottom = min(detection_frame.shape[0], int(y + h + margin * h))
+	window = detection_frame[top:bottom, left:right]
+	if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+		return face, 0.0
+	match = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+	min_score, score, min_loc, (match_x, match_y) = cv2.minMaxLoc(match)
+	return (left + match_x, top + match_y, w, h), score
 
-	#	  if frame_num < total_frames - 50:
-	#		cap.grab()
-	#		  continue
+def find_faces(detection_frame, face_cascade, tracked, detect_every=None, 
+		min_track_score=min_track_score, stats=None):
+	"""Faces (x, y, w, h) in detection_frame, by tracking those in tracked (the
+	state of the previous call, updated in place; start with an empty dict) or, 
+	every detect_every calls, when there are none, or when tracking one fails, by
+	running face_cascade. stats, if given, counts detections (and those that 
+	tracking failures forced) and tracked frames"""
+	if stats is None:
+		stats = {}
+	faces = tracked.get('faces')
+	if faces is not None and len(faces) > 0 and detect_every is not None and \
+			tracked['since_detection'] < detect_every:
+		matches = [ track_face(detection_frame, template, face) for template, face in 
+			zip(tracked['templates'], faces) ]
+		if all([ score >= min_track_score for face, score in matches ]):
+			tracked['faces'] = [ face for face, score in matches ]
+			tracked['since_detection'] += 1
+			stats['tracked'] = stats.get('tracked', 0) + 1
+			return tracked['faces']
+		stats['lost'] = stats.get('lost', 0) + 1
 
-		ret, frame = cap.read()
-	
+	faces = [ tuple(face) for face in face_cascade.detectMultiScale(detection_frame, 1.3, 5) ]
+	tracked['faces'] = faces
+	tracked['templates'] = [ detection_frame[y:y+h, x:x+w].copy() for x, y, w, h in faces ]
+	tracked['since_detection'] = 1
+	stats['detected'] = stats.get('detected', 0) + 1
+	if not faces:
+		stats['no_face'] = stats.get('no_face', 0) + 1
+	return faces
+
+def movement_amplitude(frame_gray, prior_frame):
+	"""Log of the summed (8-bit) difference between two grayscale frames"""
+	diff = frame_gray - prior_frame
+	return np.log(np.sum(np.absolute(diff)))
+
+def analyze_frames(cap, fps, face_cascade, smile_cascade, analysis_fps=None, 
+		detection_width=None, display=False, start_frame=0, end_frame=None,
+		detect_every=None, min_track_score=min_track_score, stats=None):
+	"""Yield (frame number, time, movement amplitude, smiling) for the analyzed
+	frames read from cap, from its current position until it runs out or reaches
+	end_frame. Frames not analyzed are only grabbed, not decoded, except for the
+	frame before each analyzed frame, which movement amplitude needs. Frames before
+	start_frame are only used for that. If display is True, show each analyzed frame
+	with its faces and smiles marked (press q to stop). See find_faces for 
+	detect_every, min_track_score and stats"""
+	is_sampled = sampled_frames(fps, analysis_fps)
+	is_analyzed = lambda frame_num: frame_num >= start_frame and is_sampled(frame_num)
+	frame_num = int(cap.get(CAP_PROP_POS_FRAMES)) - 1
+	prior_frame = None
+	tracked = {}
+
+	while True: 
+		frame_num += 1
+		if end_frame is not None and frame_num >= end_frame:
+			break
+		if not cap.grab():
+			break
+		if not (is_analyzed(frame_num) or is_analyzed(frame_num + 1)):
+			prior_frame = None
+			continue
+		ret, frame = cap.retrieve()
 		try:
 			frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 		except:
 			break
-	
+		if not is_analyzed(frame_num):
+			prior_frame = frame_gray
+			continue
+
 		time = frame_num / fps
-	
-		faces = face_cascade.detectMultiScale(frame_gray, 1.3, 5)
-	
-		smiling = False
-		for (x,y,w,h) in faces:
-			cv2.rectangle(frame, (x,y), (x+w, y+h), (255,0,0), 2)
-			eye_roi_gray = frame_gray[y:y+(h/2), x:x+w]
-			smile_roi_gray = frame_gray[y+(h/2):y+h, x:x+w]
-			roi_color = frame[y:y+h, x:x+w]
-			smiles = smile_cascade.detectMultiScale(smile_roi_gray)
-			for (ex, ey, ew, eh) in smiles[0:1]:
-				smiling = True
-				cv2.rectangle(roi_color, (ex,ey+(h/2)), (ex+ew, ey+eh+(h/2)), (0,255,0), 2)
-
-			
-		if prior_frame != '':
-			diff = frame_gray - prior_frame
-			MA = np.log(np.sum(np.absolute(diff)))
+		detection_frame, scale = detection_image(frame_gray, detection_width)
+		faces = find_smiles(frame_gray, find_faces(detection_frame, face_cascade, tracked,
+			detect_every, min_track_score, stats), smile_cascade, scale)
+		smiling = any([ smile is not None for face, smile in faces ])
+
+		if display:
+			for (x,y,w,h), smile in faces:
+				cv2.rectangle(frame, (x,y), (x+w, y+h), (255,0,0), 2)
+				if smile is not None:
+					ex, ey, ew, eh = smile
+					cv2.rectangle(frame[y:y+h, x:x+w], (ex,ey), (ex+ew, ey+eh), (0,255,0), 2)
+			cv2.imshow('smiles', frame)
+			if cv2.waitKey(1) & 0xFF == ord('q'): break
+
+		if prior_frame is not None:
+			MA = movement_amplitude(frame_gray, prior_frame)
 			if np.isnan(MA):
 				print >> sys.stderr, 'Error on frame %i' %frame_num
-				raise Exception('FUCK THE WORLD IS PAIN')
-			if not np.isinf(MA):
-				mas.append(MA)
-				times.append(time)
-				smilevals.append(smiling)
+				raise Exception('Movement amplitude is NaN on frame %i' %frame_num)
+			yield frame_num, time, MA, smiling
 		prior_frame = frame_gray
-		if cv2.waitKey(1) & 0xFF == ord('q'): break
 
-	cap.release()
-	cv2.destroyAllWindows()
+	if display:
+		cv2.destroyAllWindows()
+
+def open_video(test_file):
+	cap = cv2.VideoCapture(test_file)
+	if not cap.isOpened():
+		print 'error opening video file'
+		raise Exception('Error opening video file')
+	return cap
+
+def read_checkpoint(records_path):
+	"""The checkpoint of the records at records_path, or None if there isn't one"""
+	try:
+		with open(records_path + checkpoint_extension) as checkpoint_file:
+			return json.load(checkpoint_file)
+	except (IOError, ValueError):
+		return None
+
+def write_checkpoint(records_path, checkpoint):
+	# replace the checkpoint all at once, so that it is never half written
+	temp_path = records_path + checkpoint_extension + '.tmp'
+	with open(temp_path, 'w') as checkpoint_file:
+		json.dump(checkpoint, checkpoint_file)
+	os.rename(temp_path, records_path + checkpoint_extension)
+
+def remove_records(records_path):
+	for path in (records_path, records_path + checkpoint_extension):
+		if os.path.exists(path):
+			os.remove(path)
+
+def read_records(records_path):
+	"""Records (see record_dtype) written by do_smiles_movamp, memory-mapped. 
+	Raises IOError if they aren't there or aren't finished"""
+	checkpoint = read_checkpoint(records_path)
+	if checkpoint is None or not checkpoint.get('done'):
+		raise IOError('No finished CV records at %s' % records_path)
+	if os.path.getsize(records_path) == 0:
+		return np.zeros(0, dtype=record_dtype)
+	return np.memmap(records_path, dtype=record_dtype, mode='r')
+
+def frame_segments(time_ranges, fps):
+	"""Sorted, non-overlapping [first, last) frame ranges of the frames within 
+	time_ranges ((start, end) times in seconds); [[0, None]], the whole video, if 
+	time_ranges is None"""
+	if time_ranges is None:
+		return [[0, None]]
+	segments = []
+	for start, end in sorted(time_ranges):
+		first = max(0, int(np.ceil(start * fps)))
+		last = int(np.floor(end * fps)) + 1
+		if last <= first:
+			continue
+		if segments and first <= segments[-1][1]:
+			segments[-1][1] = max(segments[-1][1], last)
+		else:
+			segments.append([first, last])
+	return segments
+
+def analyze_range(range_args):
+	"""Analyze frames first_frame up to (not including) last_frame (None for the end
+	of the video) of a video, in a capture and with cascades of its own, appending a 
+	record (see record_dtype) for each to records_path as it goes. Only frames within
+	time_ranges (all frames, if None) are analyzed, and each stretch skipped is marked
+	with missing records. range_args is (test_file, data_dir, face_file, smile_file, 
+	first_frame, last_frame, analysis_fps, detection_width, detect_every, display, 
+	time_ranges, records_path, settings).
 	
-	mas_no_inf = np.ma.masked_invalid(mas)
-	ma_mean = np.mean(mas_no_inf)
-	ma_std = np.std(mas_no_inf)
-	zscore_mas = [(x - ma_mean)/ma_std for x in mas]
+	Every checkpoint_every records, the records are flushed and the last frame
+	analyzed is checkpointed; records left from an earlier run with the same 
+	settings are kept, and analysis resumes after their last checkpoint. Returns the
+	range's detection and tracking counts, over all runs"""
+	(test_file, data_dir, face_file, smile_file, first_frame, last_frame, 
+		analysis_fps, detection_width, detect_every, display, time_ranges, 
+		records_path, settings) = range_args
+	checkpoint = read_checkpoint(records_path)
+	if checkpoint is None or checkpoint['settings'] != settings or \
+			not os.path.exists(records_path):
+		checkpoint = dict(settings=settings, next_frame=first_frame, n_records=0, 
+			stats={}, done=False)
+	if checkpoint['done']:
+		return checkpoint['stats']
+
+	face_cascade, smile_cascade = load_cascades(data_dir, face_file, smile_file)
+	cap = open_video(test_file)
+	fps = float(cap.get(CAP_PROP_FPS))
+	resume_frame = checkpoint['next_frame']
+	stats = checkpoint['stats']
+	records_file = open(records_path, 'ab' if checkpoint['n_records'] else 'wb')
+	# anything written after the last checkpoint is redone
+	records_file.truncate(checkpoint['n_records'] * record_dtype.itemsize)
+	records_file.seek(0, os.SEEK_END)
+	pending = []
+
+	def save_checkpoint(next_frame, done=False):
+		np.array(pending, dtype=record_dtype).tofile(records_file)
+		records_file.flush()
+		os.fsync(records_file.fileno())
+		checkpoint.update(next_frame=next_frame, stats=stats, done=done,
+			n_records=checkpoint['n_records'] + len(pending))
+		write_checkpoint(records_path, checkpoint)
+		del pending[:]
+
+	try:
+		for seg_first, seg_last in frame_segments(time_ranges, fps):
+			if last_frame is not None and seg_first >= last_frame:
+				break
+			# segments before this range, or finished (and checkpointed) already
+			if seg_last is not None and (seg_last <= first_frame or resume_frame > seg_last):
+				continue
+			start = max(seg_first, first_frame, resume_frame)
+			end = last_frame if seg_last is None else \
+				seg_last if last_frame is None else min(seg_last, last_frame)
+			if seg_first > 0 and seg_first >= first_frame and resume_frame <= seg_first:
+				pending.append(((seg_first - 1) / fps, np.nan, np.nan))
+			if end is None or start < end:
+				# start one frame early, for the movement amplitude of the first frame
+				if start > 0:
+					cap.set(CAP_PROP_POS_FRAMES, start - 1)
+				for frame_num, time, MA, smiling in analyze_frames(cap, fps, 
+						face_cascade, smile_cascade, analysis_fps, detection_width, 
+						display, start_frame=start, end_frame=end,
+						detect_every=detect_every, stats=stats):
+					if not np.isinf(MA):
+						pending.append((time, MA, smiling))
+					if len(pending) >= checkpoint_every:
+						save_checkpoint(frame_num + 1)
+			if seg_last is not None and (last_frame is None or seg_last <= last_frame):
+				pending.append((seg_last / fps, np.nan, np.nan))
+		save_checkpoint(last_frame, done=True)
+	finally:
+		records_file.close()
+		cap.release()
+	return stats
+
+def frame_ranges(n_frames, n_ranges):
+	"""(first, last) frames of n_ranges consecutive ranges covering n_frames frames;
+	the last range runs to the end of the video, however long it really is"""
+	bounds = [ int(round(i * n_frames / float(n_ranges))) for i in range(n_ranges) ]
+	return zip(bounds, bounds[1:] + [None])
+
+def range_records_path(records_path, first_frame, last_frame):
+	return '%s.%i-%s' % (records_path, first_frame, 
+		'end' if last_frame is None else last_frame)
+
+def record_blocks(range_paths):
+	"""The records at range_paths, in order, zscore_block records at a time"""
+	for path in range_paths:
+		if os.path.getsize(path) == 0:
+			continue
+		records = np.memmap(path, dtype=record_dtype, mode='r')
+		for block_start in range(0, records.size, zscore_block):
+			yield np.array(records[block_start:block_start + zscore_block])
+
+def finish_records(range_paths, records_path):
+	"""Concatenate the records at range_paths, in order, into records_path, with 
+	their movement amplitudes z-scored (over all of them), one block at a time.
+	records_path is replaced all at once"""
+	# records marking skipped frames (NaN) don't count
+	n_records, ma_sum = 0, 0.0
+	for block in record_blocks(range_paths):
+		movamp = block['movamp'][np.isfinite(block['movamp'])]
+		n_records += movamp.size
+		ma_sum += movamp.sum(dtype=np.float64)
+	ma_mean = ma_sum / n_records if n_records else np.nan
+	ma_var = 0.0
+	for block in record_blocks(range_paths):
+		movamp = block['movamp'][np.isfinite(block['movamp'])]
+		ma_var += np.square(movamp - ma_mean).sum()
+	ma_std = np.sqrt(ma_var / n_records) if n_records else np.nan
+
+	temp_path = records_path + '.tmp'
+	with open(temp_path, 'wb') as records_file:
+		for block in record_blocks(range_paths):
+			block['movamp'] = (block['movamp'] - ma_mean) / ma_std
+			block.tofile(records_file)
+	os.rename(temp_path, records_path)
+
+def do_smiles_movamp(test_file, data_dir, face_file, smile_file, analysis_fps=None,
+		detection_width=None, display=False, workers=1, detect_every=None, stats=None,
+		records_path=None, key=None, time_ranges=None):
+	"""Records (time, z-scored movement amplitude, smile; see record_dtype) of the
+	analyzed frames of test_file, in time order, written to records_path (in a 
+	temporary file if None) and returned memory-mapped (or in memory, if 
+	records_path is None). Frames whose movement amplitude is infinite (no movement
+	at all) are left out. If time_ranges ((start, end) times in seconds) are given,
+	only frames within them are analyzed, and stretches skipped are marked missing
+	(see the top of this file).
+	
+	Each range of frames (see analyze_range) is written and checkpointed to a file
+	of its own next to records_path, so that a run that is stopped resumes where it
+	left off; finished records for the same video and settings (and key, which 
+	callers can use for anything else the results depend on) are used as they are.
+	stats, if given, is updated with the video's detection and tracking counts"""
+	if stats is None:
+		stats = {}
+	temporary = records_path is None
+	if temporary:
+		records_fd, records_path = tempfile.mkstemp(prefix='smiles_movamp-')
+		os.close(records_fd)
+	if time_ranges is not None:
+		time_ranges = [ [float(start), float(end)] for start, end in time_ranges ]
+	settings = dict(test_file=test_file, analysis_fps=analysis_fps, 
+		detection_width=detection_width, detect_every=detect_every, key=key,
+		time_ranges=time_ranges)
+	checkpoint = read_checkpoint(records_path)
+	if checkpoint is not None and checkpoint['done'] and \
+			checkpoint['settings'] == settings and os.path.exists(records_path):
+		stats.update(checkpoint['stats'])
+		return read_records(records_path)
+
+	parallel = workers > 1 and not display
+	if parallel:
+		probe = open_video(test_file)
+		n_frames = int(probe.get(CAP_PROP_FRAME_COUNT))
+		probe.release()
+		ranges = frame_ranges(n_frames, workers)
+	else:
+		ranges = [(0, None)]
+	range_paths = [ range_records_path(records_path, first, last) 
+		for first, last in ranges ]
+	all_range_args = [ (test_file, data_dir, face_file, smile_file, first, last, 
+		analysis_fps, detection_width, detect_every, display, time_ranges, range_path, 
+		dict(settings, first_frame=first, last_frame=last)) 
+		for (first, last), range_path in zip(ranges, range_paths) ]
+	if parallel:
+		pool = multiprocessing.Pool(workers)
+		try:
+			range_stats = pool.map(analyze_range, all_range_args, chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		range_stats = [ analyze_range(range_args) for range_args in all_range_args ]
+
+	for counts in range_stats:
+		for count, n in counts.iteritems():
+			stats[count] = stats.get(count, 0) + n
+	finish_records(range_paths, records_path)
+	write_checkpoint(records_path, dict(settings=settings, stats=stats, done=True))
+	for range_path in range_paths:
+		remove_records(range_path)
 
-	return [times, zscore_mas, smilevals]
+	records = read_records(records_path)
+	if temporary:
+		records = np.array(records)
+		remove_records(records_path)
+	return records
 
 
 
@@ -96,5 +472,12 @@ if __name__=='__main__':
 	# input file
 	script_dir = sys.path[0]
 	test_file = sys.argv[1]
-	for t, m, s in do_smiles_movamp(test_file, script_dir, face_file, smile_file):
-		print t, '\t', m, '\t', s	 
\ No newline at end of file
+	analysis_fps = float(sys.argv[2]) if len(sys.argv) > 2 else None
+	detection_width = int(sys.argv[3]) if len(sys.argv) > 3 else None
+	detect_every = int(sys.argv[4]) if len(sys.argv) > 4 else None
+	stats = {}
+	for t, m, s in do_smiles_movamp(test_file, script_dir, face_file, smile_file,
+			analysis_fps, detection_width, detect_every=detect_every, stats=stats):
+		print t, '\t', m, '\t', bool(s)
+	print >> sys.stderr, 'detected: %i, tracked: %i, lost: %i, no face: %i' % tuple(
+		stats.get(count, 0) for count in ('detected', 'tracked', 'lost', 'no_face'))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""audio.py
+Patrick Callier
+
+Memory-mapped access to WAV files, so that reading a few seconds (or a few thousand
+short segments) out of an hour-long session recording never loads the whole file.
+read_wav maps a file; time_range, samples_at and mono return views of (or only the
+requested part of) the mapped samples, and to_float normalizes whatever the file
+stores to floats in [-1, 1). Used for offset detection and by the in-process
+measurement backend.
+"""
+
+import numpy as np
+import scipy.io.wavfile as sp_wav
+
+
+def read_wav(wav_path):
+    """Sampling rate and samples of the WAV file at wav_path, memory-mapped.
+    Samples are as stored in the file: one row per sample, and one column per
+    channel if there is more than one"""
+    return sp_wav.read(wav_path, mmap=True)
+
+def n_samples(samples):
+    return samples.shape[0]
+
+def duration(rate, samples):
+    return n_samples(samples) / float(rate)
+
+def time_range(rate, samples, start=0, end=None):
+    """View of the samples from start to end seconds (clipped to the recording;
+    end None for the end of the recording). No samples are copied"""
+    first = max(0, int(round(start * rate)))
+    last = n_samples(samples) if end is None else int(round(end * rate))
+    return samples[first:max(first, last)]
+
+def samples_at(samples, indexes, channel=None, dtype=np.float64):
+    """Mono float samples (see mono and to_float) at the sample indexes, an array of
+    any shape; indexes outside the recording give 0. Only the samples asked for 
+    are read"""
+    indexes = np.asarray(indexes)
+    inside = (indexes >= 0) & (indexes < n_samples(samples))
+    values = samples[np.clip(indexes, 0, n_samples(samples) - 1)]
+    if samples.ndim > 1:
+        values = _mono_channels(values, channel)
+    return np.where(inside, to_float(values, dtype), 0)
+
+def _mono_channels(samples, channel):
+    # channels are the last axis
+    if channel is not None:
+        return samples[..., channel]
+    if samples.shape[-1] == 1:
+        return samples[..., 0]
+    return to_float(samples).mean(axis=-1)
+
+def mono(samples, channel=None):
+    """Mono version of samples (one row per sample, as from read_wav): channel 
+    (counting from 0) if given, which is a view; otherwise the average of the 
+    channels, as Praat makes when it converts to mono"""
+    if samples.ndim < 2:
+        return samples
+    return _mono_channels(samples, channel)
+
+def to_float(samples, dtype=np.float64):
+    """Samples as floats in [-1, 1) (integer formats are scaled by their range;
+    float formats are left as they are)"""
+    samples = np.asarray(samples)
+    if samples.dtype.kind in 'iu':
+        scale = float(2 ** (8 * samples.dtype.itemsize - 1))
+        offset = scale if samples.dtype.kind == 'u' else 0
+        return ((samples.astype(dtype) - offset) / scale).astype(dtype, copy=False)
+    return samples.astype(dtype, copy=False)
+
+def read_range(wav_path, start=0, end=None, channel=None, dtype=np.float64):
+    """Sampling rate and mono float samples (see mono and to_float) of wav_path from
+    start to end seconds. Only that range of the file is read"""
+    rate, samples = read_wav(wav_path)
+    return rate, to_float(mono(time_range(rate, samples, start, end), channel), dtype)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""corpus_schema.py
+Patrick Callier
+
+Compact dtypes for the columns of the pipeline's output (the corpus table), which
+otherwise holds its strings as Python objects and its measures as float64, and so
+takes several times the memory of the data. apply_schema sets:
+- float32 for the acoustic and CV measures (measure_cols) and for the binary columns
+  (binary_cols), which are 1, 0, or NaN where missing
+- small integers for session, speaker and interlocutor IDs (pandas' nullable integers
+  where the installed pandas has them, so that IDs can be missing)
+- categoricals for columns of repeated strings: labels, filenames and names
+  (categorical_cols), and any other string column (survey answers, etc.) with at most
+  categorical_max_ratio distinct values per row
+Times stay float64, since unit IDs are made from them to the millisecond, and unit
+IDs are never categorical, since tables are grouped by them.
+
+read_dtypes gives the dtypes to read a TSV table with, so that it takes its compact
+form as it is read (as far as the installed pandas can; apply_schema does the rest).
+"""
+
+import pandas as pd
+import numpy as np
+
+measure_cols = [
+'2k',
+'5k',
+'A1',
+'A1c',
+'A1hz',
+'A2',
+'A2c',
+'A2hz',
+'A3',
+'A3c',
+'A3hz',
+'CPP',
+'CPPS',
+'F0',
+'F1',
+'F2',
+'F3',
+'H1',
+'H1c',
+'H1hz',
+'H2',
+'H2c',
+'H2hz',
+'H4',
+'H4c',
+'H4hz',
+'HNR',
+'HNR05',
+'HNR15',
+'HNR25',
+'intensity',
+'movamp_interp',
+'p0db',
+'p0hz',
+'interlocutor_movamp']
+
+binary_cols = ['smiles_interp', 'interlocutor_smile', 'creak_binary']
+
+id_cols = ['session_id', 'speaker_id', 'interlocutor_id']
+
+categorical_cols = ['speaker_session_id', 'Filename', 'Segment label', 'segment_label',
+                    'preceding_context', 'following_context', 'word_label',
+                    'line_label', 'speaker_first', 'speaker_last',
+                    'interlocutor_first', 'interlocutor_last']
+
+# never categorical
+unit_id_cols = ['chunk_id', 'segment_id', 'word_id', 'line_id']
+
+measure_dtype = np.float32
+categorical_max_ratio = 0.5
+
+
+def nullable_ints():
+    """Whether the installed pandas has nullable integer dtypes"""
+    return hasattr(pd, 'Int16Dtype')
+
+def categorical_reads():
+    """Whether the installed pandas can read columns straight into categoricals"""
+    return hasattr(pd, 'api')
+
+def small_ints(ids):
+    """ids (numbers, or strings of them like '007') as small integers: nullable
+    Int16 if possible, int16 if nothing is missing; otherwise ids as they are"""
+    try:
+        numbers = ids.astype(float)
+    except (ValueError, TypeError):
+        return ids
+    if nullable_ints():
+        return numbers.astype('Int16')
+    if numbers.isnull().any():
+        return ids
+    return numbers.astype(np.int16)
+
+def apply_schema(df, categoricals=True):
+    """df, with the compact dtypes above (modified in place and returned). Columns
+    the schema doesn't cover are left as they are, except string columns of few
+    distinct values, which become categoricals if categoricals is True"""
+    for column in df.columns:
+        values = df[column]
+        if column in measure_cols or column in binary_cols:
+            if values.dtype != measure_dtype:
+                df[column] = values.astype(measure_dtype)
+        elif column in id_cols:
+            df[column] = small_ints(values)
+        elif not categoricals or column in unit_id_cols or values.dtype != object:
+            continue
+        elif column in categorical_cols or \
+                values.nunique() <= categorical_max_ratio * values.size:
+            df[column] = values.astype('category')
+    return df
+
+def write_dtypes():
+    """dtypes for writing the corpus table a piece at a time (see 
+    table_io.TableWriter), so that a column has the same type in every piece, even 
+    pieces in which it is missing or all NaN: the measures and binary columns as 
+    measure_dtype, and the string columns of categorical_cols as strings"""
+    dtypes = dict((column, measure_dtype) for column in measure_cols + binary_cols)
+    dtypes.update((column, object) for column in categorical_cols)
+    return dtypes
+
+def read_dtypes(columns=None, categoricals=True):
+    """dtype argument for reading a TSV table with (some of) the schema's columns.
+    Without categoricals, categorical_cols are read as strings (as is best for
+    tables read in pieces, whose categories would differ from piece to piece)"""
+    dtypes = dict((column, measure_dtype) for column in measure_cols)
+    if categoricals and categorical_reads():
+        dtypes.update((column, 'category') for column in categorical_cols)
+    if columns is not None:
+        dtypes = dict((column, dtype) for column, dtype in dtypes.iteritems()
+                      if column in columns)
+    return dtypes
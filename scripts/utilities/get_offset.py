@@ -3,61 +3,163 @@
 Patrick Callier
 
 Provides get_offset_wav, which gets offset in secs between two audio files
+
+By default, offsets are found coarse-to-fine: first by cross-correlating the
+(log RMS) amplitude envelopes of the two files at envelope_rate, which is cheap even
+for long recordings, then by cross-correlating the raw samples at full rate, but
+only over lags within refine_margin seconds of the envelope peak. The confidence of
+an offset is the peak-to-sidelobe ratio of the envelope cross-correlation: how many
+standard deviations the peak stands above the rest of the cross-correlation.
 """
 
 import numpy as np
 #import scipy as sp
-import scipy.io.wavfile as sp_wav
+import scipy.signal as sp_signal
+
+import audio
+
+# coarse-to-fine settings
+envelope_rate = 100
+refine_margin = 0.05
+refine_duration = 30
+# lags within this many seconds of the peak don't count as sidelobes
+sidelobe_exclusion = 1.0
+
+
+def cross_correlation(wav1, wav2):
+    """Cross-correlation of two 1d numpy arrays by FFT. Element k is the sum of
+    wav2[n + k] * wav1[n] over n, for lags k from 0 to wav1.size - 1, followed by
+    lags -(wav2.size - 1) to -1"""
 
-def get_offset_xcorr(wav1, wav2):
-    """Returns offset in samples between two 1d numpy arrays
-    using the peak of their cross-correlation
-    Much credit to http://stackoverflow.com/questions/4688715/find-time-shift-between-two-similar-waveforms
-    and eryksun's answer: http://stackoverflow.com/a/4696026/1233304"""
-    
     n_samples = 2 ** int(np.ceil(np.log2(wav1.size + wav2.size - 1)))
-    
+
     # zero padding
-    
-    
     spec1 = np.fft.rfft(wav1, n_samples)
     spec2 = np.fft.rfft(wav2, n_samples)
-    
-    
-    
+
     spec_prod = spec2 * np.conj(spec1)
-    xcorr = np.fft.irfft(spec_prod)
-    xcorr = np.hstack((xcorr[:wav1.size], xcorr[n_samples - wav2.size + 1:]))
-    
-    
+    xcorr = np.fft.irfft(spec_prod, n_samples)
+    return np.hstack((xcorr[:wav1.size], xcorr[n_samples - wav2.size + 1:]))
+
+def xcorr_lags(wav1_size, wav2_size):
+    """Lags of the elements of cross_correlation(wav1, wav2)"""
+    return np.hstack((np.arange(wav1_size), np.arange(-(wav2_size - 1), 0)))
+
+def get_offset_xcorr(wav1, wav2):
+    """Returns offset in samples between two 1d numpy arrays
+    using the peak of their cross-correlation
+    Much credit to http://stackoverflow.com/questions/4688715/find-time-shift-between-two-similar-waveforms
+    and eryksun's answer: http://stackoverflow.com/a/4696026/1233304"""
+
+    xcorr = cross_correlation(wav1, wav2)
     offset = np.argmax(xcorr)
     if offset < wav1.size:
         return offset
     else:
         return offset - xcorr.size
 
-def get_offset_wav(wav_filename1, wav_filename2, time_limit=300):
+def peak_to_sidelobe(xcorr, peak_index, exclusion):
+    """How many standard deviations the peak of xcorr (at peak_index) is above the
+    mean of the sidelobes: all of xcorr except within exclusion elements of the
+    peak. Lags wrap around, as they do in cross_correlation"""
+
+    distance = np.abs(np.arange(xcorr.size) - peak_index)
+    distance = np.minimum(distance, xcorr.size - distance)
+    sidelobes = xcorr[distance > exclusion]
+    if sidelobes.size < 2 or sidelobes.std() == 0:
+        return np.inf
+    return (xcorr[peak_index] - sidelobes.mean()) / sidelobes.std()
+
+def amplitude_envelope(data, rate, envelope_rate=envelope_rate):
+    """Log RMS amplitude of data in consecutive blocks of rate / envelope_rate
+    samples, with its mean removed"""
+
+    block_size = int(round(rate / float(envelope_rate)))
+    n_blocks = data.size // block_size
+    blocks = data[:n_blocks * block_size].reshape((n_blocks, block_size))
+    power = np.mean(np.square(blocks, dtype=np.float64), axis=1)
+    # keep silence from dominating the log
+    power_floor = 1e-10 * power.max() + 1e-30 if power.size else 1e-30
+    envelope = np.log(power + power_floor)
+    return envelope - envelope.mean()
+
+def refine_offset(data1, data2, coarse_offset, margin, duration):
+    """Offset in samples between data1 and data2, searching only within margin
+    samples of coarse_offset (in samples, same sense as get_offset_xcorr), using
+    up to duration samples of data1 where the two overlap"""
+
+    # data1[n] lines up with data2[n + offset]: find the range of n for which
+    # data2 has samples at every candidate offset
+    first = max(0, margin - coarse_offset)
+    last = min(data1.size, data2.size - coarse_offset - margin)
+    if last - first <= 0:
+        return coarse_offset
+    # take the middle of the overlap
+    length = min(duration, last - first)
+    start = first + (last - first - length) // 2
+    segment1 = data1[start:start + length].astype(np.float64)
+    segment2 = data2[start + coarse_offset - margin:
+                     start + coarse_offset + margin + length].astype(np.float64)
+    # element j of the valid correlation is lag coarse_offset - margin + j
+    xcorr = sp_signal.fftconvolve(segment2, segment1[::-1], mode='valid')
+    return coarse_offset - margin + int(np.argmax(xcorr))
+
+def get_offset_coarse_to_fine(data1, data2, rate, envelope_rate=envelope_rate,
+                              refine_margin=refine_margin,
+                              refine_duration=refine_duration):
+    """Offset in samples between two 1d numpy arrays (as in get_offset_xcorr), and
+    its confidence, found by cross-correlating amplitude envelopes, then refining
+    at full rate within refine_margin seconds of the envelope peak"""
+
+    envelope1 = amplitude_envelope(data1, rate, envelope_rate)
+    envelope2 = amplitude_envelope(data2, rate, envelope_rate)
+    xcorr = cross_correlation(envelope1, envelope2)
+    peak_index = np.argmax(xcorr)
+    confidence = peak_to_sidelobe(xcorr, peak_index, sidelobe_exclusion * envelope_rate)
+
+    block_size = int(round(rate / float(envelope_rate)))
+    coarse_offset = xcorr_lags(envelope1.size, envelope2.size)[peak_index] * block_size
+    margin = int(np.ceil(refine_margin * rate)) + block_size
+    offset = refine_offset(data1, data2, coarse_offset, margin,
+                           int(refine_duration * rate))
+    return offset, confidence
+
+def get_offset_wav(wav_filename1, wav_filename2, time_limit=300, coarse_to_fine=True,
+                   return_confidence=False):
     """Return offset in seconds between wav_filename1 and
     wav_filename2, which are recordings of the same event
-    with potentially different starting times. Returns the 
+    with potentially different starting times. Returns the
     number of seconds that wav_filename2 starts after wav_filename1
     (possibly negative).
-     
-    
+
+
     If time_limit is provided, clip files
-    to first time_limit seconds. This can substantially speed up 
-    offset detection"""
-    
-    rate1, data1 = sp_wav.read(wav_filename1)
-    rate2, data2 = sp_wav.read(wav_filename2)
+    to first time_limit seconds. This can substantially speed up
+    offset detection
+
+    If coarse_to_fine is False, the offset comes from one full-rate
+    cross-correlation of the (clipped) files. If return_confidence is True,
+    returns (offset, confidence), where confidence is the peak-to-sidelobe ratio
+    of the cross-correlation (see the top of this module)"""
+
+    rate1, data1 = audio.read_wav(wav_filename1)
+    rate2, data2 = audio.read_wav(wav_filename2)
     # the two files must have the same sampling rate
     assert(rate1==rate2)
-    
-    if time_limit is not None:
-        data1 = data1[0:rate1 * time_limit]
-        data2 = data2[0:rate2 * time_limit]
-                
-    offset_samples = get_offset_xcorr(data1, data2)
+
+    # only the part of each file within time_limit is ever read
+    data1 = audio.mono(audio.time_range(rate1, data1, 0, time_limit))
+    data2 = audio.mono(audio.time_range(rate2, data2, 0, time_limit))
+
+    if coarse_to_fine:
+        offset_samples, confidence = get_offset_coarse_to_fine(data1, data2, rate1)
+    else:
+        xcorr = cross_correlation(data1.astype(np.float64), data2.astype(np.float64))
+        peak_index = np.argmax(xcorr)
+        offset_samples = xcorr_lags(data1.size, data2.size)[peak_index]
+        confidence = peak_to_sidelobe(xcorr, peak_index, sidelobe_exclusion * rate1)
     offset_seconds = offset_samples / float(rate1)
-    
-    return offset_seconds
\ No newline at end of file
+
+    if return_confidence:
+        return offset_seconds, confidence
+    return offset_seconds
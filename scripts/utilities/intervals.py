@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""intervals.py
+Patrick Callier
+
+Provides IntervalIndex, for finding which of a set of (possibly overlapping)
+intervals a batch of timepoints falls within. Build it once per table of intervals
+(words, transcript lines, creak detections, ...) and query it with whole columns of
+timepoints at a time.
+"""
+
+import numpy as np
+
+
+class IntervalIndex(object):
+    """Index over intervals zip(lower, upper). A point p falls within an interval
+    if lower < p < upper (strictly). Query results are positions (counting from 0)
+    into lower/upper as passed in; intervals with missing bounds never match.
+    """
+
+    def __init__(self, lower, upper):
+        lower = np.asarray(lower, dtype=np.float64)
+        upper = np.asarray(upper, dtype=np.float64)
+        assert lower.shape == upper.shape
+        self.n_intervals = lower.size
+
+        valid = np.flatnonzero(~(np.isnan(lower) | np.isnan(upper)))
+        # sort by lower bound, breaking ties by position so that earlier intervals
+        # are found first
+        order = valid[np.lexsort((valid, lower[valid]))]
+        self.positions = order
+        self.lower = lower[order]
+        self.upper = upper[order]
+        # running maximum of the upper bounds: no interval before the first one whose
+        # running max exceeds p can contain p
+        self.upper_cummax = np.maximum.accumulate(self.upper) if order.size else self.upper
+
+    def _candidates(self, points):
+        """For each point, the range [lo, hi) of sorted intervals that could contain it"""
+        hi = np.searchsorted(self.lower, points, side='left')
+        lo = np.searchsorted(self.upper_cummax, points, side='right')
+        return lo, np.maximum(hi, lo)
+
+    def first(self, points):
+        """For each of points, the position of the first interval (in the original
+        order) containing it, or -1 if there is none"""
+
+        points = np.asarray(points, dtype=np.float64)
+        result = np.empty(points.shape, dtype=np.int64)
+        result.fill(self.n_intervals)
+        lo, hi = self._candidates(points)
+        # walk back through the candidates, all points at once; for non-overlapping
+        # intervals there's at most one candidate per point
+        active = np.flatnonzero(hi > lo)
+        candidate = hi[active] - 1
+        while active.size:
+            matched = self.upper[candidate] > points[active]
+            result[active[matched]] = np.minimum(result[active[matched]],
+                                                 self.positions[candidate[matched]])
+            candidate -= 1
+            still_active = candidate >= lo[active]
+            active = active[still_active]
+            candidate = candidate[still_active]
+        result[result == self.n_intervals] = -1
+        return result
+
+    def all(self, points):
+        """For each of points, a sorted array of the positions of all intervals
+        containing it (possibly empty)"""
+
+        points = np.asarray(points, dtype=np.float64)
+        lo, hi = self._candidates(points)
+        matches = []
+        for point, point_lo, point_hi in zip(points.ravel(), lo.ravel(), hi.ravel()):
+            in_range = np.arange(point_lo, point_hi)
+            contains = in_range[self.upper[in_range] > point]
+            matches.append(np.sort(self.positions[contains]))
+        return matches
+
+    def contains(self, points):
+        """Boolean array, True for each of points that falls within any interval"""
+        return self.first(points) >= 0
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""manifest.py
+Patrick Callier
+
+Index of the corpus's data files, so that finding a case's audio, video, alignments,
+transcript or creak results doesn't mean listing and regex-matching a whole (network
+mounted) directory every time. Each directory is scanned once; every filename that
+matches the corpus's naming scheme is parsed into its fields (date, session,
+speaker, gender, familiarity, condition, extension) and indexed by case ID.
+
+A manifest is a DataFrame with one row per file, which can be saved and loaded
+again. Refreshing a manifest only rescans the directories that have changed (by
+modification time) since they were last scanned.
+"""
+
+import os
+import re
+import logging
+
+import numpy as np
+import pandas as pd
+
+import table_io
+
+# Living Room file names: date, session, speaker, gender, FAM/STR, CHA/SOF, extension
+livingroom_manifest_pattern = (r"^(\d{8})_(INT\d{3})_(\d{3})([MF]?)_(FAM|STR)_(CHA|SOF)"
+                               r".([A-Za-z0-9]+)$")
+manifest_fields = ['date', 'session', 'speaker', 'gender', 'familiarity', 'condition',
+                   'extension']
+manifest_columns = ['directory', 'directory_mtime', 'filename', 'case_id'] + \
+                   manifest_fields
+
+
+def scan_directory(directory, filename_pattern=livingroom_manifest_pattern):
+    """Manifest of the files in directory whose names match filename_pattern (whose
+    groups are manifest_fields), in the order os.listdir gives them"""
+
+    directory = os.path.abspath(directory)
+    logging.debug("Scanning {}".format(directory))
+    filename_re = re.compile(filename_pattern)
+    directory_mtime = os.stat(directory).st_mtime
+    rows = []
+    for filename in os.listdir(directory):
+        match = filename_re.search(filename)
+        if match is not None:
+            fields = match.groups()
+            rows.append([directory, directory_mtime, filename,
+                         "{}_{}".format(fields[1], fields[2])] + list(fields))
+    return pd.DataFrame(rows, columns=manifest_columns)
+
+def refresh_manifest(manifest, directories,
+                     filename_pattern=livingroom_manifest_pattern):
+    """manifest (possibly None), updated to cover directories: directories not yet
+    in it, or modified since they were scanned, are (re)scanned"""
+
+    if manifest is None:
+        manifest = pd.DataFrame(columns=manifest_columns)
+    pieces = [manifest]
+    for directory in directories:
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            logging.debug("Not a directory: {}".format(directory))
+            continue
+        scanned = manifest['directory'].values == directory
+        if scanned.any() and \
+                manifest['directory_mtime'].values[scanned][0] == os.stat(directory).st_mtime:
+            continue
+        pieces = [ piece[piece['directory'].values != directory] for piece in pieces ]
+        pieces.append(scan_directory(directory, filename_pattern))
+    return pd.concat(pieces, ignore_index=True)[manifest_columns]
+
+def load_manifest(manifest_path):
+    """The manifest saved at manifest_path, or None if there isn't one"""
+    if not os.path.exists(manifest_path):
+        return None
+    return table_io.read_table(manifest_path,
+        dtype=dict((field, str) for field in manifest_fields + ['case_id']),
+        keep_default_na=False, na_values=[""])
+
+def save_manifest(manifest, manifest_path):
+    table_io.write_table(manifest, manifest_path)
+
+def manifest_index(manifest):
+    """Dict from (directory, case ID, extension) to the path of the first such file
+    in the manifest"""
+    index = {}
+    for directory, case_id, extension, filename in \
+            manifest[['directory', 'case_id', 'extension', 'filename']].values:
+        index.setdefault((directory, case_id, extension),
+                         os.path.join(directory, filename))
+    return index
+
+def find_path(index, directory, case_id, extension):
+    """Path of the file for case_id with extension in directory, from a
+    manifest_index, or None if there is none"""
+    return index.get((os.path.abspath(directory), case_id, extension))
+
+def manifest_cases(manifest, directory=None, extensions=None):
+    """Case IDs in the manifest (for files in directory, with one of extensions, if
+    given), in manifest order, once each"""
+    keep = np.ones(manifest.shape[0], dtype=bool)
+    if directory is not None:
+        keep &= manifest['directory'].values == os.path.abspath(directory)
+    if extensions is not None:
+        keep &= manifest['extension'].isin(extensions).values
+    return list(pd.unique(manifest['case_id'].values[keep]))
@@ -18,12 +18,24 @@ def normalize_id(x):
             long(float(filter(lambda(y): str.isdigit(y) or y==".", str(x)))))
     except ValueError:
         id = pd.np.nan
-    logging.debug("in: {}, out: {}".format(x, id))
     return id
+
+def normalize_ids(ids):
+    """normalize_id for a whole Series of IDs at once"""
+    digits = ids.astype(str).str.replace(r"[^0-9.]", "")
+    valid = digits.str.contains(r"^(?:\d+\.?\d*|\.\d+)$").fillna(False).astype(bool)
+    normalized = pd.Series(pd.np.nan, index=ids.index, dtype=object)
+    if valid.any():
+        normalized[valid] = digits[valid].astype(float).astype(long).astype(str).str.zfill(3)
+    return normalized
     
-def prepare_qualtrics(qualtrics_path, qualtrics_header_path="qualtricsheadings.txt"):
+def qualtrics_columns(qualtrics_header_path="qualtricsheadings.txt"):
+    """Column names of a Qualtrics export, from its header file"""
     with open(qualtrics_header_path) as qheader_file:
-        qualtrics_header = qheader_file.read().strip().split(",")
+        return qheader_file.read().strip().split(",")
+
+def prepare_qualtrics(qualtrics_path, qualtrics_header_path="qualtricsheadings.txt"):
+    qualtrics_header = qualtrics_columns(qualtrics_header_path)
         
     qualtrics_table = pd.read_table(qualtrics_path,sep=",",skiprows=[0,1],header=None,
                                     names=qualtrics_header)
@@ -33,17 +45,64 @@ def prepare_qualtrics(qualtrics_path, qualtrics_header_path="qualtricsheadings.t
         ['SessionID','ParticipantOneID','ParticipantTwoID','ParticipantID'] 
         if id_field in qualtrics_table.columns]
     for id_field in id_fields:
-        qualtrics_table[id_field] = map(normalize_id, qualtrics_table[id_field])
+        qualtrics_table[id_field] = normalize_ids(qualtrics_table[id_field])
             
     return qualtrics_table
 
+# session info columns for each role, in the order of session_participant_columns
+participant_roles = {
+    'ParticipantOne': ['ParticipantOneID', 'ParticipantOneFirstName', 
+                       'ParticipantOneLastName', 'ParticipantTwoID', 
+                       'ParticipantTwoFirstName', 'ParticipantTwoLastName'],
+    'ParticipantTwo': ['ParticipantTwoID', 'ParticipantTwoFirstName', 
+                       'ParticipantTwoLastName', 'ParticipantOneID', 
+                       'ParticipantOneFirstName', 'ParticipantOneLastName']}
+session_participant_columns = ['speaker_id', 'speaker_first', 'speaker_last', 
+                               'interlocutor_id', 'interlocutor_first', 
+                               'interlocutor_last']
+
+def session_participants(session_info):
+    """session_info (one row per session, with a ParticipantOne and a ParticipantTwo)
+    as one row per participant per session: session_id and 
+    session_participant_columns, for the participant as speaker"""
+    roles = []
+    for role in sorted(participant_roles):
+        role_table = session_info[['SessionID'] + participant_roles[role]]
+        role_table.columns = ['session_id'] + session_participant_columns
+        roles.append(role_table)
+    participants = pd.concat(roles, ignore_index=True)
+    for name_column in ['speaker_first', 'speaker_last', 'interlocutor_first', 
+                        'interlocutor_last']:
+        participants[name_column] = participants[name_column].astype(str)
+    return participants[participants['speaker_id'].notnull()].drop_duplicates(
+        ['session_id', 'speaker_id'])
+
+def backfill_legacy_ids(exit_survey, legacy_ids):
+    """Fill in missing SessionID and ParticipantID in exit_survey from the rows of 
+    legacy_ids with the same ResponseID"""
+    legacy_ids = legacy_ids.drop_duplicates('ResponseID').set_index('ResponseID')
+    for id_field in ['SessionID', 'ParticipantID']:
+        exit_survey[id_field] = exit_survey[id_field].where(
+            exit_survey[id_field].notnull(),
+            normalize_ids(exit_survey['ResponseID'].map(legacy_ids[id_field])))
+    return exit_survey
+
+def session_info_columns(exit_survey_path, exit_survey_header_path):
+    """Columns that adorn_with_session_info adds to a table, in order (as read by 
+    prepare_qualtrics, which renames repeated headings)"""
+    exit_survey = prepare_qualtrics(exit_survey_path, exit_survey_header_path)
+    return session_participant_columns[1:] + list(exit_survey.columns)
                          
 def adorn_with_session_info(df, exit_survey_path, exit_survey_header_path, 
-          session_info_path, session_info_header_path):
+          session_info_path, session_info_header_path, allow_missing=False):
     """ (Living Room-specific)
     Joins measurement data with exit survey and session info data
     df should have fields 'session_id' and 'speaker_id' which identify the speaker/session 
-    unique pair for each observation"""
+    unique pair for each observation. 
+    
+    Speaker/session pairs not in the session info are all reported at once, with a 
+    ValueError, unless allow_missing is True, in which case they are logged and get
+    no metadata"""
         
     exit_survey = prepare_qualtrics(exit_survey_path, exit_survey_header_path)
     session_info = prepare_qualtrics(session_info_path, session_info_header_path)
@@ -54,79 +113,42 @@ def adorn_with_session_info(df, exit_survey_path, exit_survey_header_path,
     # hand-coded data in data.legacy_ids
     backup_ids = pd.read_table(StringIO.StringIO(data.legacy_ids.ids), sep=",", 
                                dtype="string")
-    exit_survey_alternates = exit_survey[['ResponseID']].merge(
-        backup_ids, how='left', on='ResponseID')
-    exit_survey[['SessionID','ParticipantID']] = \
-        exit_survey[['SessionID','ParticipantID']].where(
-            pd.isnull(exit_survey[['SessionID', 'ParticipantID']])==False,
-            exit_survey_alternates[['SessionID', 'ParticipantID']])
-    logging.debug(exit_survey['SessionID'].values)
-    logging.debug("Session IDs: {}".format(session_info['SessionID'].values))
+    exit_survey = backfill_legacy_ids(exit_survey, backup_ids)
     
-    # main loop for adding metadata, iterates over unique speaker/session pairs
-    # The idea is to build up a one-row data frame with all the metadata for each 
-    # speaker/session from exit survey and session records, combine them
-    combined_result = pd.DataFrame()
-    for index, speaker_session in df.loc[:,['session_id','speaker_id']].drop_duplicates().iterrows():
-        speaker_session_df = pd.DataFrame()
-        
-        # add session-level metadata
-        # find speaker name
-        # note that 0-row data frame must be assigned to with iterable type
-        speaker_session_df['session_id'] = [speaker_session['session_id']]
-        speaker_session_df['speaker_id'] = speaker_session['speaker_id']
-        
-        
-        logging.debug("Session ID: {}".format(speaker_session_df['session_id'].values))
-        current_session_info = session_info[session_info['SessionID'].values == 
-                                            speaker_session_df['session_id'].values]
-
-        logging.debug("Spkr ID: {}\nPrtcpt One ID: {}\nPrtcpt Two ID: {}".format(
-                        speaker_session_df['speaker_id'],
-                        current_session_info['ParticipantOneID'],
-                        current_session_info['ParticipantTwoID']))
-
-        # find names of participant, and names + ID of interlocutor
-        if speaker_session_df['speaker_id'].values == current_session_info['ParticipantOneID'].values:
-            speaker_session_df['speaker_first'] = str(current_session_info['ParticipantOneFirstName'].values[0])
-            speaker_session_df['speaker_last'] = str(current_session_info['ParticipantOneLastName'].values[0])
-            speaker_session_df['interlocutor_id'] = str(current_session_info['ParticipantTwoID'].values[0])
-            speaker_session_df['interlocutor_first'] = str(current_session_info['ParticipantTwoFirstName'].values[0])
-            speaker_session_df['interlocutor_last'] = str(current_session_info['ParticipantTwoLastName'].values[0])
-        elif speaker_session_df['speaker_id'].values == current_session_info['ParticipantTwoID'].values:
-            speaker_session_df['speaker_first'] = str(current_session_info['ParticipantTwoFirstName'].values[0])
-            speaker_session_df['speaker_last'] = str(current_session_info['ParticipantTwoLastName'].values[0])
-            speaker_session_df['interlocutor_id'] = str(current_session_info['ParticipantOneID'].values[0])
-            speaker_session_df['interlocutor_first'] = str(current_session_info['ParticipantOneFirstName'].values[0])
-            speaker_session_df['interlocutor_last'] = str(current_session_info['ParticipantOneLastName'].values[0])
-        else:
-            logging.warning("Session information not found for speaker {}, session {}".
-                            format(speaker_session['speaker_id'], 
-                                   speaker_session['session_id']))
-            raise Exception()
-            
-        # clean up ID numbers (format as 3-digit zero-padded)
-        speaker_session_df['speaker_id'] = speaker_session_df['speaker_id'].map(
-            lambda x: "{:03d}".format(long(x)))
-        speaker_session_df['session_id'] = speaker_session_df['session_id'].map(
-            lambda x: "{:03d}".format(long(x)))
-        speaker_session_df['interlocutor_id'] = speaker_session_df['interlocutor_id'].map(
-            lambda x: "{:03d}".format(long(x)))
-        
-        # add exit_survey metadata
-        # acquire this speaker's row from exit_survey, add to speaker_session_df
-        matching_exit_rows = (exit_survey['ParticipantID'].values==
-                              speaker_session_df['speaker_id'].values) & \
-            (exit_survey['SessionID'].values==speaker_session_df['session_id'].values)
-        logging.debug("Number of matching rows from exit survey: {}".format(
-            sum(matching_exit_rows)))
-        exit_survey_row = exit_survey[matching_exit_rows]
-
-        exit_survey_row.index = speaker_session_df.index
-        speaker_session_df = pd.concat([speaker_session_df, exit_survey_row], axis=1)
-
-        combined_result = pd.concat([combined_result, speaker_session_df], axis=0,
-                                    ignore_index=True)
-
+    # one row per speaker/session, keyed by its IDs formatted as 3-digit zero-padded
+    speaker_sessions = df[['session_id', 'speaker_id']].drop_duplicates()
+    keys = pd.DataFrame({'session_key': normalize_ids(speaker_sessions['session_id']),
+                         'speaker_key': normalize_ids(speaker_sessions['speaker_id'])},
+                        index=speaker_sessions.index)
+    speaker_sessions = pd.concat([speaker_sessions, keys], axis=1)
+    
+    participants = session_participants(session_info)
+    participants = participants.rename(columns={'session_id': 'session_key', 
+                                                'speaker_id': 'speaker_key'})
+    combined_result = speaker_sessions.merge(participants, how='left', 
+                                             on=['session_key', 'speaker_key'])
+    missing = combined_result[combined_result['speaker_first'].isnull()]
+    if missing.shape[0] > 0:
+        message = "Session information not found for {} speaker/sessions: {}".format(
+            missing.shape[0], "; ".join("speaker {}, session {}".format(speaker, session) 
+                for session, speaker in missing[['session_id', 'speaker_id']].values))
+        if not allow_missing:
+            raise ValueError(message)
+        logging.warning(message)
+    
+    # add exit_survey metadata: this speaker's (first) row from exit_survey
+    exit_rows = exit_survey[exit_survey['ParticipantID'].notnull() & 
+                            exit_survey['SessionID'].notnull()]
+    exit_keys = exit_rows[['ParticipantID', 'SessionID']]
+    exit_keys.columns = ['speaker_key', 'session_key']
+    exit_rows = pd.concat([exit_keys, exit_rows], axis=1).drop_duplicates(
+        ['speaker_key', 'session_key'])
+    combined_result = combined_result.merge(exit_rows, how='left', 
+                                            on=['speaker_key', 'session_key'])
+    unmatched = combined_result['SessionID'].isnull() & combined_result['speaker_first'].notnull()
+    if unmatched.any():
+        logging.warning("No exit survey for {} speaker/sessions".format(unmatched.sum()))
+    
+    del combined_result['speaker_key']
+    del combined_result['session_key']
     return df.merge(combined_result, how='left', on=['speaker_id','session_id'])
-        
\ No newline at end of file
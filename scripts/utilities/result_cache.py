@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""result_cache.py
+Patrick Callier
+
+Content-addressed cache for the results of pipeline stages. Each stage's result is
+stored under a key hashed from everything it depends on: its input files (by content,
+or by size and modification time for big files like audio and video), its
+parameters (settings, script files), and the keys of the stages upstream of it. So
+changing an alignment only invalidates the stages that read that alignment, and
+nothing ever has to be deleted by hand to force recomputation.
+
+Results are stored as tables (in cache_format, see table_io), one file per stage
+and key, in cache_dir. When the cache grows past max_cache_bytes, the least recently used
+results are evicted.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+
+import table_io
+
+# where results go, and how big the cache may get
+cache_dir = os.path.join(tempfile.gettempdir(), "pipeline_cache")
+max_cache_bytes = 20 * 1024 ** 3
+# files smaller than this are fingerprinted by content, bigger ones by size and mtime
+content_hash_limit = 64 * 1024 ** 2
+# None for table_io's default format
+cache_format = None
+
+# fingerprints of unchanged files, keyed by (path, size, mtime)
+_fingerprints = {}
+
+
+def file_fingerprint(path, by_content=None):
+    """A string identifying the contents of the file at path: a hash of its contents
+    if by_content is True, or of its size and modification time if False. If
+    by_content is None, files up to content_hash_limit bytes are hashed by content.
+    Missing files (and path None) have a fingerprint too, so that their appearance
+    invalidates results"""
+
+    if path is None:
+        return "none"
+    path = os.path.realpath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing:" + path
+    if by_content is None:
+        by_content = stat.st_size <= content_hash_limit
+    if not by_content:
+        return "stat:{}:{}".format(stat.st_size, stat.st_mtime)
+
+    fingerprint_key = (path, stat.st_size, stat.st_mtime)
+    try:
+        return _fingerprints[fingerprint_key]
+    except KeyError:
+        pass
+    file_hash = hashlib.sha1()
+    with open(path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(1024 ** 2), ''):
+            file_hash.update(block)
+    fingerprint = "sha1:" + file_hash.hexdigest()
+    _fingerprints[fingerprint_key] = fingerprint
+    return fingerprint
+
+def stage_key(stage, input_paths=(), params=None, upstream_keys=(), big_inputs=False):
+    """Key for the result of stage, computed from input_paths (fingerprinted with
+    file_fingerprint, by size and mtime if big_inputs is True), params (a dict of
+    values with stable reprs; paths of scripts and other files the stage depends on
+    should be given as inputs instead) and the keys of upstream stages"""
+
+    key_hash = hashlib.sha1(stage)
+    for path in input_paths:
+        key_hash.update("\0input\0" + file_fingerprint(path,
+            by_content=False if big_inputs else None))
+    for name in sorted(params or {}):
+        key_hash.update("\0param\0{}={!r}".format(name, params[name]))
+    for upstream_key in upstream_keys:
+        key_hash.update("\0upstream\0" + str(upstream_key))
+    return key_hash.hexdigest()
+
+def cached_result_path(stage, key, directory=None):
+    return table_io.table_path(os.path.join(directory or cache_dir,
+        "{}-{}".format(stage, key)), cache_format)
+
+def load_result(stage, key, directory=None, description=""):
+    """The cached result of stage with key, as a DataFrame, or None if there isn't
+    one. Hits and misses are logged"""
+
+    result_path = cached_result_path(stage, key, directory)
+    if not os.path.exists(result_path):
+        logging.info("Cache miss: {} {} ({})".format(stage, description, key[:12]))
+        return None
+    result = table_io.read_table(result_path)
+    logging.info("Cache hit: {} {} ({})".format(stage, description, key[:12]))
+    # mark as recently used
+    try:
+        os.utime(result_path, None)
+    except OSError:
+        pass
+    return result
+
+def store_result(result, stage, key, directory=None, max_bytes=None):
+    """Save the DataFrame result as the result of stage with key, then evict old
+    results if the cache has grown past max_bytes (default max_cache_bytes).
+    Returns the path the result was saved to"""
+
+    directory = directory or cache_dir
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # another process may have made it
+            if not os.path.isdir(directory):
+                raise
+    result_path = cached_result_path(stage, key, directory)
+    # write somewhere else first, so that no one reads a partial result
+    temp_fd, temp_path = tempfile.mkstemp(prefix=".partial-", dir=directory)
+    os.close(temp_fd)
+    try:
+        table_io.write_table(result, temp_path, table_io.format_of(result_path))
+        os.rename(temp_path, result_path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    logging.debug("Cached {} at {}".format(stage, result_path))
+    evict(directory, max_bytes, keep=[result_path])
+    return result_path
+
+def evict(directory=None, max_bytes=None, keep=()):
+    """Remove least recently used results from the cache in directory until it is
+    no bigger than max_bytes (default max_cache_bytes), sparing the paths in keep.
+    Returns the number of results removed"""
+
+    directory = directory or cache_dir
+    if max_bytes is None:
+        max_bytes = max_cache_bytes
+    entries = []
+    for filename in os.listdir(directory):
+        if filename.startswith("."):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum([ size for mtime, size, path in entries ])
+    n_removed = 0
+    for mtime, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        logging.info("Evicted {} from cache".format(os.path.basename(path)))
+        total_bytes -= size
+        n_removed += 1
+    return n_removed
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""session_offsets.py
+Patrick Callier
+
+Persistent table of the offsets between the two recordings of each session, so
+that each offset is computed (with get_offset.get_offset_wav) once, not on every run
+of the pipeline. Offsets are keyed on the pair of audio files and their
+fingerprints (size and modification time), so replacing a recording recomputes its
+session's offset and nothing else.
+
+The table is a small TSV, one row per session, meant to be reviewed by hand. To
+override an offset, fill in manual_offset_secs for its row; manual offsets are used
+instead of computed ones (and are never low-confidence).
+
+The table is locked (with a lock file next to it) while offsets are looked up and
+while new ones are added, so that processes doing so at once (such as the pipeline's
+pool workers, see pipeline_main.cv_time_ranges) don't overwrite each other's new
+offsets. Offsets are computed without the lock, so two processes may both compute
+a new session's offset; the first one added is kept.
+"""
+
+import os
+import fcntl
+import logging
+import tempfile
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+import table_io
+from get_offset import get_offset_wav
+from result_cache import file_fingerprint
+
+offset_columns = ['session_id', 'speaker_audio', 'interlocutor_audio',
+                  'speaker_fingerprint', 'interlocutor_fingerprint',
+                  'offset_secs', 'offset_confidence', 'manual_offset_secs']
+
+
+def load_offsets(offsets_path):
+    """The table of offsets at offsets_path (empty if there isn't one yet)"""
+    if not os.path.exists(offsets_path):
+        return pd.DataFrame(columns=offset_columns)
+    offsets = table_io.read_table(offsets_path, table_format='tsv',
+                                  dtype={'session_id': str})
+    for column in offset_columns:
+        if column not in offsets.columns:
+            offsets[column] = np.nan
+    return offsets
+
+def save_offsets(offsets, offsets_path):
+    """Write the table of offsets to offsets_path (replacing it all at once)"""
+    directory = os.path.dirname(os.path.abspath(offsets_path))
+    temp_fd, temp_path = tempfile.mkstemp(prefix=".offsets-", dir=directory)
+    os.close(temp_fd)
+    table_io.write_table(offsets, temp_path, table_format='tsv')
+    os.rename(temp_path, offsets_path)
+
+def export_offsets(offsets_path, export_path):
+    """Copy the table of offsets to export_path, in the format its extension
+    implies (see table_io)"""
+    table_io.write_table(load_offsets(offsets_path), export_path)
+
+@contextlib.contextmanager
+def locked_offsets(offsets_path):
+    """Hold an exclusive lock on the table of offsets at offsets_path"""
+    with open(offsets_path + ".lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _audio_key(audio_path):
+    return os.path.realpath(audio_path), file_fingerprint(audio_path, by_content=False)
+
+def _stored_offsets(offsets):
+    """The offsets in the table offsets, as (offset, confidence, manual offset) keyed
+    by the speaker's and interlocutor's audio keys"""
+    stored = {}
+    for row in offsets[offset_columns].values:
+        stored[(row[1], row[3], row[2], row[4])] = tuple(row[5:8])
+    return stored
+
+def _find_offset(stored, speaker_key, interlocutor_key):
+    """The sign and stored offset for the pair of audio files (in either order), or 
+    None if it isn't stored"""
+    if speaker_key + interlocutor_key in stored:
+        return 1, stored[speaker_key + interlocutor_key]
+    if interlocutor_key + speaker_key in stored:
+        # the same pair, the other way around
+        return -1, stored[interlocutor_key + speaker_key]
+    return None
+
+def _previous_manual_offset(offsets, session_id, speaker_audio, interlocutor_audio):
+    """The manual offset of session_id in the table offsets, if any, for speaker_audio
+    then interlocutor_audio (so that overrides outlive the audio they were made for)"""
+    previous = offsets[(offsets['session_id'].astype(str) == str(session_id)) &
+                       offsets['manual_offset_secs'].notnull()]
+    if previous.shape[0] == 0:
+        return np.nan
+    row = previous.iloc[-1]
+    if (row['speaker_audio'] == interlocutor_audio or 
+            row['interlocutor_audio'] == speaker_audio):
+        return -row['manual_offset_secs']
+    return row['manual_offset_secs']
+
+def session_offsets(sessions, offsets_path):
+    """Offsets for sessions, a sequence of (session ID, speaker audio path,
+    interlocutor audio path) tuples: a DataFrame with one row per session and
+    columns session_id, offset_secs (the number of seconds that the interlocutor's
+    audio starts after the speaker's), offset_confidence and offset_manual. Offsets
+    not yet in the table at offsets_path (or whose audio has changed) are computed
+    and added to it, replacing the session's old row but keeping its manual offset.
+    The table is locked (see locked_offsets) to look offsets up and to add new 
+    ones, but not while they are computed; an offset another process added in the 
+    meantime is used instead of the one computed here"""
+
+    sessions = [ (session_id, _audio_key(speaker_audio), 
+                  _audio_key(interlocutor_audio), speaker_audio, interlocutor_audio)
+                 for session_id, speaker_audio, interlocutor_audio in sessions ]
+    with locked_offsets(offsets_path):
+        stored = _stored_offsets(load_offsets(offsets_path))
+
+    computed = {}
+    for session_id, speaker_key, interlocutor_key, speaker_audio, interlocutor_audio \
+            in sessions:
+        if (_find_offset(stored, speaker_key, interlocutor_key) is None and 
+                _find_offset(computed, speaker_key, interlocutor_key) is None):
+            logging.info("Computing audio offset for session {}".format(session_id))
+            offset, confidence = get_offset_wav(speaker_audio, interlocutor_audio,
+                                                return_confidence=True)
+            computed[speaker_key + interlocutor_key] = (session_id, offset, confidence)
+
+    if computed:
+        with locked_offsets(offsets_path):
+            offsets = load_offsets(offsets_path)
+            stored = _stored_offsets(offsets)
+            new_rows = []
+            for key, (session_id, offset, confidence) in computed.iteritems():
+                speaker_key, interlocutor_key = key[:2], key[2:]
+                if _find_offset(stored, speaker_key, interlocutor_key) is not None:
+                    # another process added it first
+                    continue
+                manual = _previous_manual_offset(offsets, session_id, 
+                                                 speaker_key[0], interlocutor_key[0])
+                if not pd.isnull(manual):
+                    logging.info("Keeping the manual audio offset of session {}".format(
+                        session_id))
+                new_rows.append(dict(session_id=session_id,
+                    speaker_audio=speaker_key[0], speaker_fingerprint=speaker_key[1],
+                    interlocutor_audio=interlocutor_key[0],
+                    interlocutor_fingerprint=interlocutor_key[1],
+                    offset_secs=offset, offset_confidence=confidence,
+                    manual_offset_secs=manual))
+                stored[key] = (offset, confidence, manual)
+            if new_rows:
+                # new offsets replace any outdated ones for the same sessions
+                new_rows = pd.DataFrame(new_rows, columns=offset_columns)
+                offsets = offsets[~offsets['session_id'].astype(str).isin(
+                    new_rows['session_id'].astype(str))]
+                save_offsets(pd.concat([offsets, new_rows], ignore_index=True), 
+                             offsets_path)
+
+    results = []
+    for session_id, speaker_key, interlocutor_key, _, _ in sessions:
+        sign, (offset, confidence, manual) = _find_offset(stored, speaker_key, 
+                                                          interlocutor_key)
+        if not pd.isnull(manual):
+            offset = manual
+        results.append((session_id, sign * offset, confidence, not pd.isnull(manual)))
+    return pd.DataFrame(results, columns=['session_id', 'offset_secs',
+                                          'offset_confidence', 'offset_manual'])
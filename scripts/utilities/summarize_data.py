@@ -7,59 +7,52 @@ Utility suite/script for getting a useful summary of pipeline output for analysi
 Will do a number of reductions and summaries, including:
 - one measurement per segment
 - maybe some outlier detection?
+
+Usage: summarize_data.py [--rollups] [--chunksize=N [--sort]] pipeline_output
+                         [summary_output]
+Tables are read and written in the format their extensions imply (see table_io);
+without summary_output, the summary goes to stdout as tab-separated values.
+With --rollups, summaries by word, line and speaker (see pipeline_rollups) are also
+written, next to summary_output, with _word, _line and _speaker added to its name.
+With --chunksize, the table is read and summarized N rows at a time, for tables too
+big for memory (see summarize_stream). Its lines (other than the rows outside any
+line) and segments must be runs of rows, as they are in pipeline output; --sort 
+sorts a table that isn't so first.
 """
 
+import os
 import sys
 import re
+import shutil
 import logging
+import tempfile
+from collections import OrderedDict
 logging.basicConfig(level=logging.DEBUG)
 import pandas as pd
 import numpy as np
 
+import table_io
+import corpus_schema
+from corpus_schema import measure_cols, binary_cols
 
-measure_cols = [
-'2k',
-'5k',
-'A1',
-'A1c',
-'A1hz',
-'A2',
-'A2c',
-'A2hz',
-'A3',
-'A3c',
-'A3hz',
-'CPP',
-'CPPS',
-'F0',
-'F1',
-'F2',
-'F3',
-'H1',
-'H1c',
-'H1hz',
-'H2',
-'H2c',
-'H2hz',
-'H4',
-'H4c',
-'H4hz',
-'HNR',
-'HNR05',
-'HNR15',
-'HNR25',
-'intensity',
-'movamp_interp',
-'p0db',
-'p0hz',
-'interlocutor_movamp']
-
-binary_cols = ['smiles_interp', 'interlocutor_smile', 'creak_binary']
 
 segment_re = re.compile(r"([^0-9]+)[012]?")
 stress_re = re.compile(r"[^0-9]+([012]?)")
 vowel_re = re.compile(r"[AEIOU][AEIOUYWH]")
 
+# streaming summaries (see summarize_stream): rows per piece, the groups that must be
+# whole within a piece, the column the table is ordered by, and the column that is 
+# missing for rows outside any line (which share a line_id per speaker session, 
+# wherever they are in it)
+stream_chunksize = 100000
+stream_group_cols = ['line_id', 'segment_id']
+stream_order_col = 'speaker_session_id'
+stream_loose_col = 'line_start'
+
+# levels of summary, finest first: (level name, grouping column)
+rollup_levels = [('segment', 'segment_id'), ('word', 'word_id'), ('line', 'line_id'),
+                 ('speaker', 'speaker_session_id')]
+
 
 def summarize_many_cols(df, cols_to_summarize, grouping_col="segment_id", 
                         summary_func=lambda z: pd.Series.median(z, skipna=True)):
@@ -81,24 +74,53 @@ def summarize_many_cols(df, cols_to_summarize, grouping_col="segment_id",
     
     return df_summary
     
+def _group_summary(df, codes, keys, grouping_col, measure_cols, binary_cols):
+    """pipeline_medians_40s over the groups given by codes (positions in keys, or -1
+    for rows in no group), each aggregation grouped on the codes in one pass"""
+
+    rest_cols = [col for col in df.columns if col not in measure_cols + binary_cols]
+    index = pd.Index(keys, name=grouping_col)
+    if (codes < 0).any():
+        df = df[codes >= 0]
+        codes = codes[codes >= 0]
+
+    # np.unique gives where each code first appears
+    the_rest = df[rest_cols].iloc[np.unique(codes, return_index=True)[1]]
+    the_rest.index = index
+    measures_medians = df[measure_cols].groupby(codes).median()
+    # binary columns are float32 (see corpus_schema): average them in float64, so that
+    # exactly 40% isn't rounded up past 0.4
+    binary_40 = df[binary_cols].astype(np.float64).groupby(codes).mean() > 0.4
+    measures_medians.index = binary_40.index = index
+
+    return pd.concat([the_rest, measures_medians, binary_40], axis=1)
+
 def pipeline_medians_40s(df, grouping_col='segment_id', measure_cols=measure_cols, 
                        binary_cols=binary_cols):
     """Return a summary of df where df is split by grouping_col, the median is taken 
     of all cols in measure_cols, and binary_cols are True iff more than 40% of their
     elements are True. For all other cols, the zeroth element in ea. group is returned"""
-    
-    measures_df = df[measure_cols + [grouping_col]]
-    binary_df = df[binary_cols + [grouping_col]]
-    the_rest = df[[col for col in df.columns if col not in measure_cols + binary_cols]]
-    
-    measures_medians = measures_df.groupby(grouping_col).apply(
-        lambda x: x.median(skipna=True))
-    binary_40 = binary_df.groupby(grouping_col).apply(
-        lambda x: x.mean(skipna=True) > 0.4)
-    the_rest = the_rest.groupby(grouping_col).apply(lambda x: x.iloc[0,:])
-    
-    return pd.concat([the_rest, measures_medians, binary_40], axis=1)
-    
+
+    codes, keys = pd.factorize(df[grouping_col], sort=True)
+    return _group_summary(df, codes, keys, grouping_col, measure_cols, binary_cols)
+
+def pipeline_rollups(df, levels=rollup_levels, measure_cols=measure_cols,
+                     binary_cols=binary_cols):
+    """pipeline_medians_40s of df at each of levels, (name, grouping column) pairs
+    from finest to coarsest: an OrderedDict from level name to its summary, each in
+    the order of the hierarchy (coarsest level first). df is sorted once for all of
+    them, so that each level's groups are runs of rows"""
+
+    levels = [ (name, col) for name, col in levels if col in df.columns ]
+    sort_cols = [ col for name, col in reversed(levels) ]
+    df = df.sort_values(sort_cols, kind='mergesort')
+    rollups = OrderedDict()
+    for name, grouping_col in levels:
+        codes, keys = pd.factorize(df[grouping_col], sort=False)
+        rollups[name] = _group_summary(df, codes, keys, grouping_col, measure_cols,
+                                       binary_cols)
+    return rollups
+
 def pipeline_recode(df):
     recodes = {'Unnamed: 0': 'index',
                'movamp_interp': 'movamp',
@@ -111,7 +133,7 @@ def pipeline_recode(df):
     return df.rename(columns=recodes)
     
 def pipeline_segment_labels(df):
-    logging.info(df.columns.values)
+    logging.debug(df.columns.values)
     df['segment_label'] = df['segment_with_stress'].map(lambda x: 
                                                         segment_re.sub(r"\1", str(x)))
     df['stress'] = df['segment_with_stress'].map(lambda x: 
@@ -134,7 +156,7 @@ def pipeline_durations(df):
     return df
     
 def pipeline_vowels_only(df, vowel_col='Segment label'):
-    return df[df[vowel_col].map(lambda x: vowel_re.search(x) is not None)]
+    return df[df[vowel_col].map(lambda x: vowel_re.search(x) is not None).astype(bool)]
 
 def pipeline_phrase_summaries(df, smile_col='smiles_interp', movamp_col='movamp_interp',
                                     interlocutor_smile='interlocutor_smile',
@@ -155,25 +177,187 @@ def pipeline_phrase_posns(df):
                                             (df['line_end'] - df['line_start']))
     return df    
         
+def pipeline_segment_details(df):
+    """Recodes, segment and stress information, durations and phrase positions of a
+    summary with one row per segment"""
+    df = pipeline_recode(df)
+    df = pipeline_segment_labels(df)
+    df = pipeline_durations(df)
+    return pipeline_phrase_posns(df)
+
+def summarize(df):
+    """The summary of df, pipeline output: one row per vowel segment"""
+    df = pipeline_phrase_summaries(df)
+    df = pipeline_vowels_only(df)
+    df = pipeline_medians_40s(df)
+    return pipeline_segment_details(df)
+
+def _runs(codes):
+    """Number of runs of equal elements in codes"""
+    return int((codes[1:] != codes[:-1]).sum()) + 1 if codes.size else 0
+
+def _check_runs(codes, col):
+    if _runs(codes) != np.unique(codes).size:
+        raise ValueError("Rows of the same {} are not together; sort the table "
+                         "first".format(col))
+
+def complete_groups(pieces, group_cols=stream_group_cols, order_col=stream_order_col,
+                    loose_col=stream_loose_col):
+    """Pieces of a table, from pieces (an iterable of DataFrames, in table order),
+    that each hold whole groups: the rows of the last group in each of group_cols
+    are held back and carried into the next piece. Rows missing loose_col (those 
+    outside any line, in pipeline output) are held back until the last of their 
+    order_col value's rows, and come in pieces of their own. The groups of order_col
+    and, apart from those rows, of each column in group_cols must be runs of rows, 
+    as they are in pipeline output (or see sorted_pieces); ValueError if they 
+    aren't"""
+
+    carried = None
+    loose = None
+    finished = set()
+    for piece in pieces:
+        if carried is not None:
+            piece = pd.concat([carried, piece], ignore_index=True)
+            carried = None
+        if piece.shape[0] == 0:
+            continue
+        _check_runs(pd.factorize(piece[order_col])[0], order_col)
+        order_keys = pd.unique(piece[order_col].values)
+        if finished.intersection(order_keys):
+            raise ValueError("Rows of the same {} are not together; sort the table "
+                             "first".format(order_col))
+        finished.update(order_keys[:-1])
+
+        if loose_col in piece.columns:
+            is_loose = piece[loose_col].isnull().values
+            if is_loose.any():
+                loose = piece[is_loose] if loose is None else \
+                    pd.concat([loose, piece[is_loose]], ignore_index=True)
+                piece = piece[~is_loose]
+        if piece.shape[0] > 0:
+            codes = dict((col, pd.factorize(piece[col])[0]) for col in group_cols)
+            for col, col_codes in codes.iteritems():
+                _check_runs(col_codes, col)
+            # where the last group of any column starts
+            start = piece.shape[0]
+            for col in group_cols:
+                others = np.flatnonzero(codes[col] != codes[col][-1])
+                start = min(start, others[-1] + 1 if others.size else 0)
+            carried = piece.iloc[start:]
+            if start > 0:
+                yield piece.iloc[:start]
+        if loose is not None:
+            done = loose[order_col].isin(finished).values
+            if done.any():
+                yield loose[done]
+                loose = loose[~done]
+    if carried is not None and carried.shape[0] > 0:
+        yield carried
+    if loose is not None and loose.shape[0] > 0:
+        yield loose
+
+def sorted_pieces(table_path, chunksize, directory=None, dtype=None,
+                  sort_cols=stream_group_cols, order_col=stream_order_col):
+    """Pieces of the table at table_path in order_col order, each one order_col
+    value's rows, sorted by sort_cols (stably, so that rows keep their order within
+    groups). The table is first split by order_col into temporary TSV files in
+    directory, chunksize rows at a time, so that only one order_col value's rows
+    are ever in memory"""
+
+    directory = tempfile.mkdtemp(prefix="summarize-", dir=directory)
+    try:
+        part_paths = {}
+        for piece in table_io.iter_table(table_path, chunksize, dtype=dtype):
+            for key, rows in piece.groupby(order_col, sort=False):
+                if key not in part_paths:
+                    part_paths[key] = os.path.join(directory,
+                        "part_{:06d}.tsv".format(len(part_paths)))
+                    header = True
+                else:
+                    header = False
+                with open(part_paths[key], 'a') as part_file:
+                    rows.to_csv(part_file, sep="\t", index=False, header=header,
+                                encoding='utf-8', float_format="%.17g")
+        for key in sorted(part_paths):
+            logging.debug("Sorting rows of {} {}".format(order_col, key))
+            # written with every digit, and read back exactly
+            part = table_io.read_table(part_paths[key], dtype=dtype, 
+                                       float_precision='round_trip')
+            sort_by = [ col for col in sort_cols if col in part.columns ]
+            yield part.sort_values(sort_by, kind='mergesort') if sort_by else part
+            os.remove(part_paths[key])
+    finally:
+        shutil.rmtree(directory)
+
+def summarize_stream(table_path, output_path, chunksize=stream_chunksize,
+                     sort=False):
+    """Summarize the table at table_path (as summarize does) a piece of about
+    chunksize rows at a time, writing each piece's summary to output_path (see
+    table_io.TableWriter) as it goes, so that memory use doesn't grow with the size
+    of the table. The table's lines and segments must be runs of rows (see
+    complete_groups; rows outside any line are kept until the end of their speaker
+    session instead), unless sort is True, in which case the table is sorted
+    first (see sorted_pieces), and memory use is bounded by the largest speaker
+    session instead"""
+
+    dtype = corpus_schema.read_dtypes(categoricals=False)
+    if sort:
+        pieces = sorted_pieces(table_path, chunksize, dtype=dtype)
+    else:
+        pieces = table_io.iter_table(table_path, chunksize, dtype=dtype)
+    with table_io.TableWriter(output_path) as output:
+        for piece in complete_groups(pieces):
+            logging.debug("Summarizing {} rows".format(piece.shape[0]))
+            summary = summarize(corpus_schema.apply_schema(piece, categoricals=False))
+            if summary.shape[0] > 0:
+                output.append(summary)
+    return output_path
+        
 if __name__ == '__main__':
-    table_path = sys.argv[1]
+    args = sys.argv[1:]
+    rollups = '--rollups' in args
+    sort = '--sort' in args
+    chunksize = None
+    for arg in list(args):
+        if arg in ('--rollups', '--sort'):
+            args.remove(arg)
+        elif arg.startswith('--chunksize='):
+            chunksize = int(arg.split("=", 1)[1])
+            args.remove(arg)
+    if rollups and len(args) < 2:
+        sys.exit("--rollups needs a summary_output to write next to")
+    if chunksize is not None:
+        if rollups:
+            sys.exit("--rollups can't be used with --chunksize")
+        logging.info("Summarizing {} rows at a time".format(chunksize))
+        summarize_stream(args[0], args[1] if len(args) > 1 else "-", chunksize, sort)
+        sys.exit()
+    elif sort:
+        sys.exit("--sort needs --chunksize")
+    table_path = args[0]
     logging.info("Loading data")
-    dtypes = dict(zip(measure_cols, ['float'] * len(measure_cols)) + 
-                  zip(binary_cols, ['bool'] * len(binary_cols)))
-    df = pd.read_table(table_path, sep='\t', dtype=dtypes,low_memory=False)
+    df = table_io.read_table(table_path, dtype=corpus_schema.read_dtypes(), 
+                             low_memory=False)
+    df = corpus_schema.apply_schema(df)
     logging.info("Phrase-level summaries")
     df = pipeline_phrase_summaries(df)
     logging.info("Cutting out non-vowels")
     df = pipeline_vowels_only(df)
     logging.info("Reducing to one observation per segment")
-    df = pipeline_medians_40s(df)
-    logging.info("Doing some recodes")
-    df = pipeline_recode(df)
-    logging.info("Getting segment and stress information")
-    df = pipeline_segment_labels(df)    
-    logging.info("Durations")
-    df = pipeline_durations(df)
-    logging.info("Phrase positions")
-    df = pipeline_phrase_posns(df)
+    if rollups:
+        rollup_dfs = pipeline_rollups(df)
+        df = rollup_dfs.pop('segment')
+        base_path, extension = os.path.splitext(args[1])
+        for level, rollup_df in rollup_dfs.iteritems():
+            logging.info("Writing {} summary".format(level))
+            table_io.write_table(pipeline_recode(rollup_df),
+                                 "{}_{}{}".format(base_path, level, extension))
+    else:
+        df = pipeline_medians_40s(df)
+    logging.info("Recodes, segment information, durations and phrase positions")
+    df = pipeline_segment_details(df)
     
-    print df.to_csv(sep='\t',index=False, encoding='utf-8')
\ No newline at end of file
+    if len(args) > 1:
+        table_io.write_table(df, args[1])
+    else:
+        print df.to_csv(sep='\t',index=False, encoding='utf-8')
\ No newline at end of file
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""table_io.py
+Patrick Callier
+
+Reading and writing the pipeline's tables in one of several formats, so that
+intermediate and final tables can be kept in a typed, compressed columnar format
+(Parquet, Feather or HDF5) instead of TSV. Columnar formats keep each column's dtype,
+so measures stay floats and IDs stay IDs from one stage to the next, and reading
+them back needs no type inference. TSV is always available, for export (to R,
+spreadsheets, etc.).
+
+The format of a file is given explicitly or inferred from its extension. Which
+columnar formats are available depends on the installed libraries: Parquet and
+Feather need pyarrow (and a pandas recent enough to use it), HDF5 needs PyTables.
+
+Tables too big to build in memory can be written a piece at a time with TableWriter
+(TSV, Parquet and HDF5 only), and read a piece at a time with iter_table.
+"""
+
+import os
+import sys
+import logging
+import collections
+
+import pandas as pd
+
+hdf5_key = "table"
+compression = {'parquet': 'snappy', 'hdf5': 'zlib'}
+# formats to use by default, best first
+preferred_formats = ['parquet', 'feather', 'hdf5', 'tsv']
+
+
+def _write_tsv(df, path, **kwargs):
+    kwargs.setdefault('index', False)
+    kwargs.setdefault('encoding', 'utf-8')
+    df.to_csv(path, sep="\t", **kwargs)
+
+def _read_tsv(path, **kwargs):
+    return pd.read_table(path, sep="\t", **kwargs)
+
+def _columnar(df):
+    """Columnar formats want a default index and string column names"""
+    df = df.reset_index(drop=True)
+    df.columns = [ str(column) for column in df.columns ]
+    return df
+
+def _write_parquet(df, path, **kwargs):
+    _columnar(df).to_parquet(path, compression=compression['parquet'], **kwargs)
+
+def _read_parquet(path, **kwargs):
+    return pd.read_parquet(path, columns=kwargs.get('usecols'))
+
+def _write_feather(df, path, **kwargs):
+    _columnar(df).to_feather(path)
+
+def _read_feather(path, **kwargs):
+    return pd.read_feather(path)
+
+def _write_hdf5(df, path, **kwargs):
+    _columnar(df).to_hdf(path, hdf5_key, mode='w', complevel=9,
+                         complib=compression['hdf5'])
+
+def _read_hdf5(path, **kwargs):
+    with pd.HDFStore(path, mode='r') as store:
+        keys = store.keys()
+        if "/" + hdf5_key in keys:
+            return store[hdf5_key]
+        # written in parts by TableWriter
+        return pd.concat([ store[key] for key in sorted(keys) ], ignore_index=True)
+
+def _has_module(name):
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+# name: (extension, writer, reader, whether it is available)
+TableFormat = collections.namedtuple('TableFormat', ['extension', 'write', 'read',
+                                                     'available'])
+formats = collections.OrderedDict([
+    ('tsv', TableFormat(".tsv", _write_tsv, _read_tsv, lambda: True)),
+    ('parquet', TableFormat(".parquet", _write_parquet, _read_parquet,
+        lambda: hasattr(pd, 'read_parquet') and _has_module('pyarrow'))),
+    ('feather', TableFormat(".feather", _write_feather, _read_feather,
+        lambda: hasattr(pd, 'read_feather') and _has_module('pyarrow'))),
+    ('hdf5', TableFormat(".h5", _write_hdf5, _read_hdf5,
+        lambda: _has_module('tables')))])
+
+
+def available_formats():
+    return [ name for name, table_format in formats.iteritems()
+             if table_format.available() ]
+
+def default_format():
+    """The best format that can be used here"""
+    available = available_formats()
+    return [ name for name in preferred_formats if name in available ][0]
+
+def format_of(path):
+    """Name of the format of path, by its extension"""
+    extension = os.path.splitext(path)[1].lower()
+    for name, table_format in formats.iteritems():
+        if table_format.extension == extension:
+            return name
+    if extension in (".txt", ".tab"):
+        return 'tsv'
+    raise ValueError("Unknown table format: {}".format(path))
+
+def table_path(base_path, table_format=None):
+    """base_path with the extension for table_format (default: default_format())"""
+    return base_path + formats[table_format or default_format()].extension
+
+def _checked_format(path, table_format):
+    table_format = table_format or format_of(path)
+    if not formats[table_format].available():
+        raise ImportError("Libraries for {} tables are not installed".format(table_format))
+    return formats[table_format]
+
+def write_table(df, path, table_format=None, **kwargs):
+    """Write df to path, in table_format or the format its extension implies.
+    Keyword arguments go to to_csv for TSV, and are ignored otherwise"""
+    logging.debug("Writing table to {}".format(path))
+    _checked_format(path, table_format).write(df, path, **kwargs)
+
+def read_table(path, table_format=None, **kwargs):
+    """Read a table written by write_table. Keyword arguments go to pd.read_table
+    for TSV (usecols is also understood by Parquet), and are ignored otherwise"""
+    logging.debug("Reading table from {}".format(path))
+    return _checked_format(path, table_format).read(path, **kwargs)
+
+def iter_table(path, chunksize, table_format=None, **kwargs):
+    """Read the table at path a piece at a time, in order: pieces of chunksize rows
+    for TSV, and for the others, the pieces TableWriter wrote (row groups, for
+    Parquet), or the whole table if it was written with write_table (or is Feather).
+    Keyword arguments are as for read_table"""
+    logging.debug("Reading table from {} in pieces".format(path))
+    table_format = table_format or format_of(path)
+    _checked_format(path, table_format)
+    if table_format == 'tsv':
+        for piece in pd.read_table(path, sep="\t", chunksize=chunksize, **kwargs):
+            yield piece
+    elif table_format == 'parquet':
+        import pyarrow.parquet
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for row_group in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(row_group,
+                columns=kwargs.get('usecols')).to_pandas()
+    elif table_format == 'hdf5':
+        with pd.HDFStore(path, mode='r') as store:
+            for key in sorted(store.keys()):
+                yield store[key]
+    else:
+        yield read_table(path, table_format, **kwargs)
+
+
+def _parquet_schema(table):
+    """Schema of a pyarrow table, with columns that were all missing (and so have
+    no type) as strings"""
+    import pyarrow
+    return pyarrow.schema([ pyarrow.field(field.name, pyarrow.string()) 
+                            if field.type == pyarrow.null() else field 
+                            for field in table.schema ])
+
+
+class TableWriter(object):
+    """Writes a table to path (in table_format, or the format its extension implies)
+    one piece at a time, so that the whole table never has to be in memory. The 
+    table has columns, if given, or else the columns of the first piece written; 
+    columns missing from a piece are filled with NaN, and columns the table doesn't 
+    have are dropped, with a warning (so that one odd piece doesn't end a long run).
+    Pieces are cast to dtypes (a dict from 
+    column to dtype), if given, so that they agree on the types of columns that may 
+    be missing or all NaN in some pieces. path "-" writes TSV to stdout. 
+    Use as a context manager, or call close() when done.
+    
+    Parquet files have one schema, taken from the first piece: categoricals are
+    written as their values (since each piece has its own categories), and columns
+    that are all missing in the first piece as strings"""
+
+    def __init__(self, path, table_format=None, columns=None, dtypes=None):
+        self.path = path
+        if path == "-":
+            self.table_format = 'tsv'
+        else:
+            self.table_format = table_format or format_of(path)
+            _checked_format(path, self.table_format)
+        if self.table_format == 'feather':
+            raise ValueError("Feather tables can't be written in pieces")
+        self.columns = None if columns is None else [ str(column) for column in columns ]
+        self.dtypes = dtypes or {}
+        self.n_pieces = 0
+        self.n_rows = 0
+        self.dropped_columns = set()
+        self._file = None
+        self._parquet_writer = None
+
+    def append(self, df):
+        if self.columns is None:
+            self.columns = [ str(column) for column in df.columns ]
+        df = _columnar(df)
+        extra_columns = [ column for column in df.columns if column not in self.columns ]
+        new_extra_columns = [ column for column in extra_columns 
+                              if column not in self.dropped_columns ]
+        if new_extra_columns:
+            logging.warning("Dropping columns not in the table written to {}: {}".format(
+                self.path, new_extra_columns))
+            self.dropped_columns.update(new_extra_columns)
+        if self.n_pieces == 0:
+            if self.table_format == 'tsv':
+                self._file = sys.stdout if self.path == "-" else open(self.path, 'w')
+            elif self.table_format == 'hdf5' and os.path.exists(self.path):
+                os.remove(self.path)
+        df = df.reindex(columns=self.columns)
+        for column, dtype in self.dtypes.iteritems():
+            if column in df.columns and df[column].dtype != dtype:
+                df[column] = df[column].astype(dtype)
+
+        if self.table_format == 'tsv':
+            _write_tsv(df, self._file, header=self.n_pieces == 0)
+            self._file.flush()
+        elif self.table_format == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            for column in df.columns:
+                if hasattr(df[column], 'cat'):
+                    df[column] = df[column].astype(object)
+            if self._parquet_writer is None:
+                schema = _parquet_schema(pyarrow.Table.from_pandas(df, 
+                                                                   preserve_index=False))
+                self._parquet_writer = pyarrow.parquet.ParquetWriter(self.path,
+                    schema, compression=compression['parquet'])
+            table = pyarrow.Table.from_pandas(df, preserve_index=False,
+                schema=self._parquet_writer.schema)
+            self._parquet_writer.write_table(table)
+        elif self.table_format == 'hdf5':
+            df.to_hdf(self.path, "{}_{:06d}".format(hdf5_key, self.n_pieces), mode='a',
+                      complevel=9, complib=compression['hdf5'])
+        self.n_pieces += 1
+        self.n_rows += df.shape[0]
+
+    def close(self):
+        if self._file is not None and self._file is not sys.stdout:
+            self._file.close()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        self._file = self._parquet_writer = None
+        logging.info("Wrote {} rows in {} pieces to {}".format(self.n_rows,
+                                                                self.n_pieces, self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()